@@ -0,0 +1,56 @@
+import hashlib
+import os
+import tempfile
+import uuid
+
+from fastapi import UploadFile
+
+# Directory shared with the extractor, uploads are written there instead of sent in messages
+BLOB_DIR = os.getenv('BLOB_DIR')
+CHUNK_SIZE = 1024 * 1024
+
+
+class Blob:
+    """An upload in the blob store, named by its sha256 and a per-request suffix."""
+
+    def __init__(self, path: str, sha256: str, size: int):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+    def headers(self) -> dict:
+        return {
+            'blob': os.path.basename(self.path),
+            'blob_sha256': self.sha256,
+            'blob_size': self.size,
+        }
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def store_upload(file: UploadFile, directory: str = BLOB_DIR) -> Blob:
+    """Streams an upload to the blob store, hashing it on the way, without holding it in memory."""
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        # Unique per request, so removing it once answered never affects another request
+        path = os.path.join(directory, f'{digest.hexdigest()}-{uuid.uuid4().hex}')
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return Blob(path, digest.hexdigest(), size)
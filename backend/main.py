@@ -1,19 +1,54 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, UploadFile
 from fastapi.responses import StreamingResponse
 import uvicorn
 
-from rpc import extract_text
+from blobs import BLOB_DIR, store_upload
+from rpc import extract_blob, extract_text, rpc_client
+
+# Seconds a conversion may take before it is abandoned, unset waits as long as it takes
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT') or 0) or None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The broker connection is opened by the first request and shared by all of them
+    yield
+    await rpc_client.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
 @app.post("/convert_pdf")
-async def convert_pdf(file: UploadFile):
+async def convert_pdf(
+    file: UploadFile,
+    fast: bool = False,
+    table_formats: str = None,
+    images: bool = True,
+    image_format: str = None,
+    image_quality: int = None,
+    image_max_size: int = None,
+    timeout: float = REQUEST_TIMEOUT,
+):
+    options = dict(
+        fast=fast,
+        table_formats=table_formats,
+        images=None if images else "none",
+        image_format=image_format,
+        image_quality=image_quality,
+        image_max_size=image_max_size,
+        timeout=timeout,
+    )
+    if BLOB_DIR:
+        # Large scans go through the shared directory rather than the broker
+        blob = await store_upload(file)
+        return StreamingResponse(extract_blob(blob, **options), media_type="application/json")
     file_content = await file.read()
-    return StreamingResponse(extract_text(file_content), media_type="application/json")
+    return StreamingResponse(extract_text(file_content, **options), media_type="application/json")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
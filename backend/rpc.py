@@ -1,68 +1,185 @@
+import asyncio
 import json
-from typing import IO
-from fastapi import UploadFile
-import pika
+import os
+import time
 import uuid
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, Optional
 
+import aio_pika
+from aio_pika.pool import Pool
 
-class FileRpcClient(object):
+from blobs import Blob
+from wire import ACCEPT, ACCEPT_ENCODING, decode, to_json
 
-    def __init__(self, file_type):
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(
-                host='localhost',
-                port=5672,
-                credentials=pika.PlainCredentials(
-                    'user',
-                    'password'
-                )
-            )
-        )
-
-
-        self.channel = self.connection.channel()
-
-        result = self.channel.queue_declare(queue='', exclusive=True)
-        self.callback_queue = result.method.queue
-
-        self.channel.basic_consume(
-            queue=self.callback_queue,
-            on_message_callback=self.on_response,
-            auto_ack=True)
-
-        self.response = None
-        self.corr_id = None
-
-    def on_response(self, ch, method, props, body):
-        if self.corr_id == props.correlation_id:
-            print("Received")
-            self.response = body
-
-    def call(self, file: bytes):
-        self.response = None
-        self.corr_id = str(uuid.uuid4())
-        self.channel.basic_publish(
-            exchange='',
-            routing_key='pdf',
-            properties=pika.BasicProperties(
-                reply_to=self.callback_queue,
-                correlation_id=self.corr_id,
-            ),
-            body=file
+# Priority levels of the extractor queues, read from the same RPC_MAX_PRIORITY as the extractor; 0 disables them
+MAX_PRIORITY = int(os.getenv('RPC_MAX_PRIORITY') or 0)
+
+# Fanout exchange the extractors listen on for cancelled requests
+CANCEL_EXCHANGE = 'extractor.cancel'
+
+# Channels requests are published on, shared by all requests of the process
+CHANNEL_POOL_SIZE = int(os.getenv('RPC_CHANNELS') or 4)
+
+
+class RpcClient:
+    """
+    One AMQP connection per backend process, shared by every request.
+
+    Requests are published on a small pool of channels and all responses arrive on a single reply
+    queue, from which they are routed by correlation id into a per-request asyncio queue.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.channels = None
+        # Client-named like the extractor's queues, see client_queue in its rpc_server/queues.py
+        self.reply_queue = f'backend.replies.{uuid.uuid4().hex}'
+        self.pending: Dict[str, asyncio.Queue] = {}
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self.lock:
+            if self.connection is not None:
+                return
+            connection = await aio_pika.connect_robust(
+                host=os.getenv('RPC_HOST') or 'localhost',
+                port=int(os.getenv('RPC_PORT') or 5672),
+                login=os.getenv('RPC_USER') or 'user',
+                password=os.getenv('RPC_PASSWORD') or 'password',
             )
-        print("sent")
+            connection.reconnect_callbacks.add(self.on_reconnect)
+
+            channel = await connection.channel()
+            queue = await channel.declare_queue(self.reply_queue, exclusive=True)
+            await queue.consume(self.on_response, no_ack=True)
+
+            self.channels = Pool(connection.channel, max_size=CHANNEL_POOL_SIZE)
+            self.connection = connection
+
+    async def close(self):
+        async with self.lock:
+            if self.connection is None:
+                return
+            await self.channels.close()
+            await self.connection.close()
+            self.connection = None
+
+    async def on_response(self, message: aio_pika.abc.AbstractIncomingMessage):
+        queue = self.pending.get(message.correlation_id)
+        # Responses of requests whose HTTP client went away are dropped
+        if queue is not None:
+            queue.put_nowait(message)
+
+    def on_reconnect(self, *args):
+        # Responses sent while the reply queue was gone are lost, so requests in flight can't complete
+        for queue in self.pending.values():
+            queue.put_nowait(None)
 
-        while True:
-            self.connection.process_data_events(time_limit=None)
-            if self.response is not None:
-                result = json.loads(self.response)
-                yield json.dumps(result)
+    async def call(self, file: bytes, headers: dict = None, size: int = None, file_type: str = 'pdf',
+                   timeout: float = None) -> AsyncIterator[str]:
+        """
+        Sends a file for conversion and yields the response messages as JSON, up to eof.
+
+        With a timeout, the request expires in the queue and carries a deadline the extractor
+        stops at. A request left before eof, on timeout or when the stream is closed, is cancelled.
+        """
+        await self.connect()
+        corr_id = str(uuid.uuid4())
+        responses = asyncio.Queue()
+        self.pending[corr_id] = responses
+        headers = {'accept': ACCEPT, 'accept_encoding': ACCEPT_ENCODING, **(headers or {})}
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+            headers['deadline'] = deadline
+        finished = False
+        try:
+            async with self.channels.acquire() as channel:
+                await channel.default_exchange.publish(
+                    aio_pika.Message(
+                        body=file,
+                        reply_to=self.reply_queue,
+                        correlation_id=corr_id,
+                        headers=headers,
+                        priority=size_priority(len(file) if size is None else size),
+                        expiration=timeout,
+                    ),
+                    routing_key=file_type,
+                )
+
+            # Pages already streamed, a redelivered job replays them before resuming
+            sent_pages = set()
+            while True:
+                try:
+                    message = await asyncio.wait_for(responses.get(), None if deadline is None else max(0, deadline - time.time()))
+                except asyncio.TimeoutError:
+                    yield json.dumps({'message': 'Failed to extract: deadline exceeded'})
+                    yield json.dumps({'message': 'eof'})
+                    break
+                if message is None:
+                    # The job may still be running, the cancel in finally stops it
+                    yield json.dumps({'message': 'Failed to extract: connection to the broker was lost'})
+                    yield json.dumps({'message': 'eof'})
+                    break
+                result = decode(message.body, message.content_type, message.content_encoding)
+                pnum = result.get("pnum")
+                if (message.headers or {}).get('replayed') and pnum in sent_pages:
+                    continue
+                if pnum is not None:
+                    sent_pages.add(pnum)
                 if result.get("message") == "eof":
+                    finished = True
+                yield to_json(result, message.body, message.content_type, message.content_encoding)
+                if finished:
                     break
-                self.response = None
+        finally:
+            # Also reached when the HTTP client disconnects and the response stream is closed
+            self.pending.pop(corr_id, None)
+            if not finished:
+                await self.cancel(corr_id)
+
+    async def cancel(self, corr_id: str):
+        """Tells the extractors to drop a request, queued or running."""
+        try:
+            async with self.channels.acquire() as channel:
+                exchange = await channel.declare_exchange(CANCEL_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+                await exchange.publish(aio_pika.Message(body=b'', correlation_id=corr_id), routing_key='')
+        except Exception as e:
+            print(f'Failed to cancel {corr_id}: {e}')
+
+
+rpc_client = RpcClient()
+
+
+def size_priority(size: int) -> Optional[int]:
+    """
+    Message priority of a file, the highest below 256 KiB and one level less per doubling above;
+    None when the queues have no priorities.
+    """
+    if not MAX_PRIORITY:
+        return None
+    return max(0, MAX_PRIORITY - (size // (256 * 1024)).bit_length())
+
+
+def request_headers(**options):
+    """AMQP headers carrying the conversion options, unset options keep the extractor defaults."""
+    return {name: value for name, value in options.items() if value is not None}
+
+
+async def extract_text(file: bytes, timeout: float = None, **options):
+    # Closing the stream, as on a client disconnect, closes the call right away rather than when collected
+    async with aclosing(rpc_client.call(file, request_headers(**options), timeout=timeout)) as messages:
+        async for message in messages:
+            yield message
 
 
-def extract_text(file: bytes):
-    client = FileRpcClient('pdf')
-    result = client.call(file)
-    return result
\ No newline at end of file
+async def extract_blob(blob: Blob, timeout: float = None, **options):
+    """Like extract_text, for a file in the blob store, which is removed once answered."""
+    try:
+        headers = {**request_headers(**options), **blob.headers()}
+        async with aclosing(rpc_client.call(b'', headers, size=blob.size, timeout=timeout)) as messages:
+            async for message in messages:
+                yield message
+    finally:
+        blob.remove()
@@ -0,0 +1,73 @@
+import base64
+import gzip
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The codec of the extractor's rpc_server/wire.py, deployed apart from it; extract_service/tests/test_wire.py
+# decodes every encoding the extractor produces with this module
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# A JSON header without the image contents, then the raw images, each prefixed by its length
+FRAMES = 'application/vnd.extractor.frames'
+
+# Response encodings asked of the extractor, preferred first; it falls back to JSON
+ACCEPT = ', '.join(([MSGPACK] if msgpack is not None else []) + [FRAMES, JSON])
+ACCEPT_ENCODING = ', '.join((['zstd'] if zstandard is not None else []) + ['gzip'])
+
+
+def decompress(body: bytes, content_encoding: str = None) -> bytes:
+    if content_encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(body)
+    if content_encoding == 'gzip':
+        return gzip.decompress(body)
+    return body
+
+
+def loads_frames(body: bytes) -> dict:
+    parts = []
+    offset = 0
+    while offset < len(body):
+        size, = struct.unpack_from('>I', body, offset)
+        offset += 4
+        parts.append(body[offset:offset + size])
+        offset += size
+    message = json.loads(parts[0])
+    page = message.get('page')
+    if isinstance(page, dict):
+        for image in page.get('images') or []:
+            if isinstance(image, dict) and 'blob' in image:
+                image['content'] = parts[1 + image.pop('blob')]
+    return message
+
+
+def decode(body: bytes, content_type: str = None, content_encoding: str = None) -> dict:
+    """A response message, with image contents as bytes in the binary encodings."""
+    body = decompress(body, content_encoding)
+    if content_type == MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    if content_type == FRAMES:
+        return loads_frames(body)
+    return json.loads(body)
+
+
+def json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_json(message: dict, body: bytes, content_type: str = None, content_encoding: str = None) -> str:
+    """The message as JSON for the HTTP response, reusing the body when it already is."""
+    if content_type in (None, JSON) and content_encoding is None:
+        return body.decode()
+    return json.dumps(message, default=json_default)
@@ -0,0 +1,229 @@
+"""
+An in-process stand-in for RabbitMQ, with the part of the aio_pika API the backend and the extractor use.
+
+    broker = MemoryBroker()
+    aio_pika.connect_robust = broker.connect_robust
+
+Queues keep the broker's semantics the services rely on: x-max-priority, per message expiration,
+prefetch per channel, acknowledgements and requeues, exclusive reply queues and fanout exchanges.
+Everything runs on the event loop of the caller, so the backend and the extractor must share it.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class IncomingMessage:
+    """A delivered message, with the attributes and methods of an aio_pika incoming message."""
+    def __init__(self, message, routing_key: str, redelivered: bool = False):
+        self.message = message
+        self.routing_key = routing_key
+        self.body = message.body
+        self.headers = message.headers
+        self.correlation_id = message.correlation_id
+        self.reply_to = message.reply_to
+        self.priority = message.priority
+        self.content_type = message.content_type
+        self.content_encoding = message.content_encoding
+        self.expiration = message.expiration
+        self.redelivered = redelivered
+        self.consumer = None
+        self.processed = False
+
+    async def ack(self):
+        self.settle()
+
+    async def nack(self, requeue: bool = True):
+        queue = self.settle()
+        if requeue and queue is not None:
+            queue.put(IncomingMessage(self.message, self.routing_key, redelivered=True))
+
+    async def reject(self, requeue: bool = False):
+        await self.nack(requeue=requeue)
+
+    def settle(self):
+        if self.processed or self.consumer is None:
+            return None
+        self.processed = True
+        self.consumer.channel.unacked -= 1
+        self.consumer.queue.dispatch_all()
+        return self.consumer.queue
+
+
+class Consumer:
+    def __init__(self, queue: 'Queue', channel: 'Channel', callback: Callable, no_ack: bool):
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.no_ack = no_ack
+
+    def ready(self) -> bool:
+        prefetch = self.channel.prefetch
+        return self.no_ack or not prefetch or self.channel.unacked < prefetch
+
+
+class Queue:
+    def __init__(self, broker: 'MemoryBroker', name: str, arguments: Optional[Dict] = None,
+                 exclusive: bool = False):
+        self.broker = broker
+        self.name = name
+        self.max_priority = (arguments or {}).get('x-max-priority') or 0
+        self.exclusive = exclusive
+        # (-priority, order, expires at, message): highest priority first, then first in
+        self.messages = []
+        self.consumers: List[Consumer] = []
+        self.order = itertools.count()
+        self.turn = 0
+
+    def put(self, message: IncomingMessage):
+        priority = min(message.priority or 0, self.max_priority)
+        expires = None
+        if isinstance(message.expiration, (int, float)):
+            expires = time.monotonic() + message.expiration
+        heapq.heappush(self.messages, (-priority, next(self.order), expires, message))
+        self.dispatch_all()
+
+    def dispatch_all(self):
+        while self.messages:
+            consumer = self.next_consumer()
+            if consumer is None:
+                return
+            _, _, expires, message = heapq.heappop(self.messages)
+            # Expired messages are dropped when they reach the head of the queue, as by RabbitMQ
+            if expires is not None and time.monotonic() > expires:
+                continue
+            if not consumer.no_ack:
+                message.consumer = consumer
+                consumer.channel.unacked += 1
+            self.broker.spawn(consumer.callback(message))
+
+    def next_consumer(self) -> Optional[Consumer]:
+        # Round robin over the consumers with prefetch left
+        for i in range(len(self.consumers)):
+            consumer = self.consumers[(self.turn + i) % len(self.consumers)]
+            if consumer.ready():
+                self.turn = (self.turn + i + 1) % len(self.consumers)
+                return consumer
+        return None
+
+
+class QueueHandle:
+    """A queue as declared on one channel."""
+    def __init__(self, queue: Queue, channel: 'Channel'):
+        self.queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def consume(self, callback: Callable, no_ack: bool = False, **kwargs) -> str:
+        self.queue.consumers.append(Consumer(self.queue, self.channel, callback, no_ack))
+        self.queue.dispatch_all()
+        return f'ctag.{self.name}.{len(self.queue.consumers)}'
+
+    async def bind(self, exchange, routing_key: str = '', **kwargs):
+        self.queue.broker.exchanges[getattr(exchange, 'name', exchange)].add(self.queue.name)
+
+
+class Exchange:
+    """A fanout exchange, or with no name the default exchange routing to the queue named by the key."""
+    def __init__(self, broker: 'MemoryBroker', name: str = ''):
+        self.broker = broker
+        self.name = name
+
+    async def publish(self, message, routing_key: str, **kwargs):
+        if self.name:
+            names = list(self.broker.exchanges.get(self.name, ()))
+        else:
+            names = [routing_key]
+        self.broker.published += 1
+        for name in names:
+            queue = self.broker.queues.get(name)
+            # Unroutable messages are dropped, as without the mandatory flag
+            if queue is not None:
+                queue.put(IncomingMessage(message, routing_key))
+
+
+class Channel:
+    def __init__(self, connection: 'Connection'):
+        self.connection = connection
+        self.broker = connection.broker
+        self.default_exchange = Exchange(self.broker)
+        self.prefetch = 0
+        self.unacked = 0
+        self.is_closed = False
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch = prefetch_count or 0
+
+    async def declare_queue(self, name: str = None, exclusive: bool = False, arguments: Dict = None,
+                            **kwargs) -> QueueHandle:
+        name = name or f'amq.gen.{next(self.broker.names)}'
+        queue = self.broker.queues.get(name)
+        if queue is None:
+            queue = self.broker.queues[name] = Queue(self.broker, name, arguments, exclusive)
+            if exclusive:
+                self.connection.exclusive.append(name)
+        return QueueHandle(queue, self)
+
+    async def declare_exchange(self, name: str, type=None, **kwargs) -> Exchange:
+        self.broker.exchanges.setdefault(name, set())
+        return Exchange(self.broker, name)
+
+    async def close(self):
+        self.is_closed = True
+        for queue in list(self.broker.queues.values()):
+            queue.consumers = [c for c in queue.consumers if c.channel is not self]
+
+
+class Connection:
+    def __init__(self, broker: 'MemoryBroker'):
+        self.broker = broker
+        self.reconnect_callbacks = set()
+        self.close_callbacks = set()
+        self.channels: List[Channel] = []
+        self.exclusive: List[str] = []
+        self.is_closed = False
+
+    async def channel(self, **kwargs) -> Channel:
+        channel = Channel(self)
+        self.channels.append(channel)
+        return channel
+
+    async def close(self, exc=None):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for channel in self.channels:
+            await channel.close()
+        for name in self.exclusive:
+            self.broker.queues.pop(name, None)
+            for bound in self.broker.exchanges.values():
+                bound.discard(name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class MemoryBroker:
+    def __init__(self):
+        self.queues: Dict[str, Queue] = {}
+        # Fanout exchange name -> names of the queues bound to it
+        self.exchanges: Dict[str, set] = {}
+        self.names = itertools.count()
+        self.tasks = set()
+        self.published = 0
+
+    async def connect_robust(self, *args, **kwargs) -> Connection:
+        return Connection(self)
+
+    connect = connect_robust
+
+    def spawn(self, coroutine):
+        # Deliveries run as tasks, as aio_pika runs consumer callbacks
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
@@ -0,0 +1,360 @@
+"""
+Synthetic documents for the benchmarks, generated from a seed so every run converts the same files.
+
+Pdfs are written directly, with the base-14 fonts, so they need nothing besides Pillow: born-digital
+text, scanned pages without a text layer, tables, equations and images. Docx files are assembled from
+WordprocessingML: long text, large tables with merged cells, and many images.
+"""
+import io
+import os
+import random
+import zipfile
+import zlib
+from typing import Dict, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw, ImageFilter
+
+PDF_KINDS = ("text", "scanned", "tables", "equations", "images")
+DOCX_KINDS = ("long_text", "large_tables", "many_images")
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are from or have an which not at but "
+    "model document page table extraction layout order detection recognition text image figure result "
+    "method value analysis section system data process time number first between each general report"
+).split()
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+
+
+class Document:
+    """A generated file and what it holds."""
+    def __init__(self, name: str, kind: str, file_type: str, path: str, pages: int):
+        self.name = name
+        self.kind = kind
+        self.file_type = file_type
+        self.path = path
+        self.pages = pages
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "kind": self.kind, "file_type": self.file_type, "pages": self.pages,
+                "bytes": os.path.getsize(self.path)}
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def synthetic_image(rng: random.Random, width: int, height: int) -> Image.Image:
+    """A gradient with a few shapes, which compresses like a figure rather than like noise."""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(10, max(11, width // 2)), y0 + rng.randrange(10, max(11, height // 2))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), outline=color, width=3)
+    return image
+
+
+# Pdf
+
+def pdf_string(text: str) -> bytes:
+    data = text.encode("latin-1", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class PdfPage:
+    def __init__(self):
+        self.ops: List[bytes] = []
+        self.images: List[Image.Image] = []
+
+    def text(self, x: float, y: float, text: str, size: float = 11, font: str = "F1"):
+        self.ops.append(b"BT /%s %.1f Tf %.1f %.1f Td %s Tj ET" % (font.encode(), size, x, y, pdf_string(text)))
+
+    def line(self, x0: float, y0: float, x1: float, y1: float):
+        self.ops.append(b"%.1f %.1f m %.1f %.1f l S" % (x0, y0, x1, y1))
+
+    def image(self, image: Image.Image, x: float, y: float, width: float, height: float):
+        self.images.append(image.convert("RGB"))
+        self.ops.append(b"q %.1f 0 0 %.1f %.1f %.1f cm /Im%d Do Q" % (width, height, x, y, len(self.images)))
+
+
+class PdfWriter:
+    """Just enough of the pdf format to place text, lines and images on pages."""
+    def __init__(self):
+        self.objects: List[Optional[bytes]] = []
+        self.pages: List[PdfPage] = []
+
+    def reserve(self) -> int:
+        self.objects.append(None)
+        return len(self.objects)
+
+    def set(self, number: int, body: bytes):
+        self.objects[number - 1] = body
+
+    def add(self, body: bytes) -> int:
+        number = self.reserve()
+        self.set(number, body)
+        return number
+
+    def stream(self, dictionary: bytes, data: bytes) -> int:
+        data = zlib.compress(data)
+        return self.add(b"<< %s /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream" % (dictionary, len(data), data))
+
+    def new_page(self) -> PdfPage:
+        page = PdfPage()
+        self.pages.append(page)
+        return page
+
+    def save(self, path: str):
+        pages_number = self.reserve()
+        helvetica = self.add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        symbol = self.add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Symbol >>")
+        kids = []
+        for page in self.pages:
+            xobjects = b""
+            for i, image in enumerate(page.images, start=1):
+                number = self.stream(
+                    b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB /BitsPerComponent 8" % image.size,
+                    image.tobytes()
+                )
+                xobjects += b"/Im%d %d 0 R " % (i, number)
+            contents = self.stream(b"", b"\n".join(page.ops))
+            resources = b"<< /Font << /F1 %d 0 R /F2 %d 0 R >> /XObject << %s>> >>" % (helvetica, symbol, xobjects)
+            kids.append(self.add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources %s /Contents %d 0 R >>" % (
+                pages_number, PAGE_WIDTH, PAGE_HEIGHT, resources, contents)))
+        self.set(pages_number, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)))
+        catalog = self.add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_number)
+
+        out = io.BytesIO()
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, start=1):
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.objects) + 1))
+        for offset in offsets:
+            out.write(b"%010d 00000 n \n" % offset)
+        out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.objects) + 1, catalog, xref))
+        with open(path, "wb") as f:
+            f.write(out.getvalue())
+
+
+def text_page(page: PdfPage, rng: random.Random, pnum: int, lines: int = 48):
+    page.text(72, 740, f"Section {pnum + 1}: {sentence(rng, 4)[:-1]}", size=16)
+    y = 710
+    for i in range(lines):
+        if i % 12 == 11:
+            y -= 8
+            continue
+        page.text(72, y, sentence(rng, 11)[:90], size=10)
+        y -= 13
+
+
+def scanned_page(page: PdfPage, rng: random.Random, pnum: int):
+    # Text rendered into the image only, so the page has no text layer and goes through OCR
+    scale = 2
+    image = Image.new("L", (PAGE_WIDTH * scale, PAGE_HEIGHT * scale), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((72 * scale, 50 * scale), f"Scanned page {pnum + 1}", fill=0, font_size=16 * scale)
+    y = 90 * scale
+    for _ in range(40):
+        draw.text((72 * scale, y), sentence(rng, 10)[:80], fill=0, font_size=10 * scale)
+        y += 15 * scale
+    image = image.rotate(rng.uniform(-0.8, 0.8), fillcolor=255).filter(ImageFilter.GaussianBlur(0.6))
+    page.image(image, 0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+
+
+def table_page(page: PdfPage, rng: random.Random, pnum: int, tables: int = 2, rows: int = 12, columns: int = 5):
+    page.text(72, 750, f"Tables {pnum + 1}", size=14)
+    top = 720
+    width, height = (PAGE_WIDTH - 144) / columns, 22
+    for _ in range(tables):
+        for r in range(rows + 1):
+            page.line(72, top - r * height, PAGE_WIDTH - 72, top - r * height)
+        for c in range(columns + 1):
+            page.line(72 + c * width, top, 72 + c * width, top - rows * height)
+        for r in range(rows):
+            for c in range(columns):
+                value = rng.choice(WORDS).title() if r == 0 else f"{rng.uniform(0, 1000):.2f}"
+                page.text(76 + c * width, top - r * height - 15, value, size=9)
+        top -= rows * height + 60
+
+
+def equation_page(page: PdfPage, rng: random.Random, pnum: int):
+    page.text(72, 750, f"Derivations {pnum + 1}", size=14)
+    y = 715
+    for i in range(14):
+        page.text(72, y, sentence(rng, 12)[:90], size=10)
+        y -= 18
+        # Sum, integral and Greek letters in the Symbol font, with sub and superscripts
+        page.text(110, y, "\xe5", size=20, font="F2")
+        page.text(108, y - 9, "i=1", size=7)
+        page.text(130, y, f"a{i} x", size=12)
+        page.text(152, y + 6, "2", size=7)
+        page.text(170, y, "=", size=12)
+        page.text(190, y, "\xf2", size=20, font="F2")
+        page.text(205, y, "a b", size=12, font="F2")
+        page.text(240, y, f"dx + {rng.randint(1, 9)}/{rng.randint(2, 9)}", size=12)
+        y -= 30
+
+
+def image_page(page: PdfPage, rng: random.Random, pnum: int):
+    page.text(72, 750, f"Figures {pnum + 1}", size=14)
+    for i in range(4):
+        x, y = 72 + (i % 2) * 240, 430 - (i // 2) * 330
+        page.image(synthetic_image(rng, 400, 300), x, y + 30, 220, 165)
+        page.text(x, y + 10, f"Figure {pnum * 4 + i + 1}. {sentence(rng, 6)}"[:45], size=9)
+
+
+PDF_PAGES = {"text": text_page, "scanned": scanned_page, "tables": table_page, "equations": equation_page, "images": image_page}
+
+
+def write_pdf(path: str, kind: str, pages: int, seed: int):
+    rng = random.Random(f"{kind}:{seed}")
+    writer = PdfWriter()
+    for pnum in range(pages):
+        PDF_PAGES[kind](writer.new_page(), rng, pnum)
+    writer.save(path)
+
+
+# Docx
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+EMU_PER_PIXEL = 9525
+
+
+def w_paragraph(text: str, style: Optional[str] = None) -> str:
+    props = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f'<w:p>{props}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def w_page_break() -> str:
+    return '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+
+def w_table(rng: random.Random, rows: int, columns: int) -> str:
+    grid = "".join('<w:gridCol w:w="1800"/>' for _ in range(columns))
+    out = [f'<w:tbl><w:tblPr><w:tblW w:w="0" w:type="auto"/></w:tblPr><w:tblGrid>{grid}</w:tblGrid>']
+    for r in range(rows):
+        out.append("<w:tr>")
+        c = 0
+        while c < columns:
+            props = []
+            span = 1
+            # A merged header cell and a vertically merged first column, as real reports have
+            if r == 0 and c == 0 and columns > 2:
+                span = 2
+                props.append('<w:gridSpan w:val="2"/>')
+            if c == 0 and r > 0:
+                props.append('<w:vMerge w:val="restart"/>' if r % 4 == 1 else "<w:vMerge/>")
+            text = rng.choice(WORDS).title() if r == 0 else f"{rng.uniform(0, 1000):.2f}"
+            if c == 0 and r > 0 and r % 4 != 1:
+                text = ""
+            out.append(f'<w:tc><w:tcPr>{"".join(props)}</w:tcPr>{w_paragraph(text)}</w:tc>')
+            c += span
+        out.append("</w:tr>")
+    out.append("</w:tbl>")
+    return "".join(out)
+
+
+def w_drawing(rid: str, index: int, width: int, height: int) -> str:
+    cx, cy = width * EMU_PER_PIXEL, height * EMU_PER_PIXEL
+    return (
+        '<w:p><w:r><w:drawing><wp:inline>'
+        f'<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{index}" name="Picture {index}"/>'
+        '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture"><pic:pic>'
+        f'<pic:nvPicPr><pic:cNvPr id="{index}" name="image{index}.png"/><pic:cNvPicPr/></pic:nvPicPr>'
+        f'<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+        f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"/></pic:spPr>'
+        '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+    )
+
+
+def write_docx(path: str, kind: str, pages: int, seed: int):
+    rng = random.Random(f"{kind}:{seed}")
+    body = []
+    media = {}
+    for pnum in range(pages):
+        body.append(w_paragraph(f"Chapter {pnum + 1}", style="Heading1"))
+        if kind == "long_text":
+            for _ in range(12):
+                body.append(w_paragraph(" ".join(sentence(rng, 14) for _ in range(3))))
+        elif kind == "large_tables":
+            body.append(w_paragraph(sentence(rng, 12)))
+            body.append(w_table(rng, rows=40, columns=6))
+        elif kind == "many_images":
+            for i in range(4):
+                # Every third image repeats an earlier one, as logos and icons do
+                index = len(media) + 1
+                if index > 3 and i == 3:
+                    rid = f"rId{rng.randrange(1, index - 1) + 100}"
+                else:
+                    rid = f"rId{index + 100}"
+                    buffer = io.BytesIO()
+                    synthetic_image(rng, 320, 240).save(buffer, format="PNG")
+                    media[rid] = (f"media/image{index}.png", buffer.getvalue())
+                body.append(w_drawing(rid, pnum * 4 + i + 1, 320, 240))
+                body.append(w_paragraph(f"Figure {pnum * 4 + i + 1}. {sentence(rng, 8)}"))
+        if pnum < pages - 1:
+            body.append(w_page_break())
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:document xmlns:w="{W}" xmlns:r="{R}" '
+        'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+        'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+        'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<w:body>{"".join(body)}<w:sectPr><w:pgSz w:w="12240" w:h="15840"/></w:sectPr></w:body></w:document>'
+    )
+    relationships = "".join(
+        f'<Relationship Id="{rid}" Type="{R}/image" Target="{target}"/>' for rid, (target, _) in media.items()
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Default Extension="png" ContentType="image/png"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        docx.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{R}/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>'
+        ))
+        docx.writestr("word/_rels/document.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{relationships}</Relationships>'
+        ))
+        docx.writestr("word/document.xml", document)
+        for target, data in media.values():
+            # Stored, as Word does for images that don't compress
+            docx.writestr(f"word/{target}", data, compress_type=zipfile.ZIP_STORED)
+
+
+def build_corpus(directory: str, pdf_kinds: Sequence[str] = PDF_KINDS, docx_kinds: Sequence[str] = DOCX_KINDS,
+                 pdf_pages: int = 10, docx_pages: int = 50, seed: int = 0) -> List[Document]:
+    """Writes the corpus to `directory`, reusing files already generated with the same parameters."""
+    os.makedirs(directory, exist_ok=True)
+    documents = []
+    for kinds, file_type, pages, write in ((pdf_kinds, "pdf", pdf_pages, write_pdf), (docx_kinds, "docx", docx_pages, write_docx)):
+        for kind in kinds:
+            name = f"{kind}-{pages}p-s{seed}.{file_type}"
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                write(path + ".part", kind, pages, seed)
+                os.replace(path + ".part", path)
+            documents.append(Document(name, kind, file_type, path, pages))
+    return documents
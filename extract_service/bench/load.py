@@ -0,0 +1,276 @@
+"""
+Load tests /convert_pdf with concurrent clients, and reports latencies, throughput and errors.
+
+    python -m bench.load --clients 16 --requests 200 --page-seconds 0.2
+    python -m bench.load --broker amqp --clients 16 --duration 60
+    python -m bench.load --url http://localhost:8000 --clients 8 --requests 100 --file scan.pdf
+
+By default the backend app, an in-memory broker (bench.broker) and the pdf lane of the extractor all
+run in this process, on one event loop, with the backend served over HTTP by uvicorn. The extractor
+replays the recorded responses of MOCK=1, each page taking --page-seconds, so the numbers are those
+of the services and the broker rather than of the models. With --broker amqp, the backend and the
+extractor connect to the broker of RPC_HOST instead. With --url, only the clients run, against a
+backend already deployed, with whatever extractors serve it.
+
+Each upload gets a unique trailing comment, so requests are neither answered from the result cache
+nor joined to a conversion in flight. Needs the backend's requirements, which include httpx and uvicorn.
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import math
+import os
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.corpus import PDF_KINDS, build_corpus
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "backend")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest rank percentile."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def unique_upload(pdf: bytes) -> bytes:
+    # A comment after %%EOF, ignored by pdf readers
+    return pdf + f"\n%{uuid.uuid4().hex}\n".encode()
+
+
+def read_messages(buffer: str, decoder=json.JSONDecoder()):
+    """Messages complete in `buffer`, the backend streams them as concatenated JSON, and what remains."""
+    messages = []
+    offset = 0
+    while True:
+        while offset < len(buffer) and buffer[offset].isspace():
+            offset += 1
+        try:
+            message, offset = decoder.raw_decode(buffer, offset)
+        except json.JSONDecodeError:
+            return messages, buffer[offset:]
+        messages.append(message)
+
+
+async def convert(http: httpx.AsyncClient, url: str, pdf: bytes, params: Dict) -> Dict:
+    """Sends one pdf and reads its response to the end."""
+    result = {"ttfp_s": None, "latency_s": None, "messages": 0, "pages": 0, "error": None}
+    start = time.perf_counter()
+    eof = False
+    try:
+        files = {"file": ("load.pdf", unique_upload(pdf), "application/pdf")}
+        async with http.stream("POST", f"{url}/convert_pdf", params=params, files=files) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            buffer = ""
+            async for chunk in response.aiter_text():
+                messages, buffer = read_messages(buffer + chunk)
+                for message in messages:
+                    result["messages"] += 1
+                    if message.get("pnum") is not None:
+                        result["pages"] += 1
+                        if result["ttfp_s"] is None:
+                            result["ttfp_s"] = time.perf_counter() - start
+                    text = message.get("message") or ""
+                    if text.startswith(("Failed", "Cancelled")) and result["error"] is None:
+                        result["error"] = text
+                    eof = eof or text == "eof"
+        if not eof and result["error"] is None:
+            result["error"] = "Response ended before eof"
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        result["latency_s"] = time.perf_counter() - start
+    return result
+
+
+async def run_clients(url: str, pdf: bytes, params: Dict, clients: int, requests: Optional[int],
+                      duration: Optional[float]) -> Dict:
+    """`clients` loops, each sending the next request once its last one is answered."""
+    results = []
+    counter = itertools.count()
+    start = time.perf_counter()
+
+    async def client(http):
+        while True:
+            if requests is not None and next(counter) >= requests:
+                return
+            if duration is not None and time.perf_counter() - start >= duration:
+                return
+            results.append(await convert(http, url, pdf, params))
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(None)) as http:
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+    return summarize(results, time.perf_counter() - start)
+
+
+def summarize(results: List[Dict], elapsed: float) -> Dict:
+    errors = [result["error"] for result in results if result["error"] is not None]
+    answered = [result for result in results if result["error"] is None]
+    messages = sum(result["messages"] for result in results)
+    summary = {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(results) if results else 0.0,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(results) / elapsed if elapsed > 0 else 0.0,
+        "messages": messages,
+        "messages_per_s": messages / elapsed if elapsed > 0 else 0.0,
+        "pages_per_s": sum(result["pages"] for result in answered) / elapsed if elapsed > 0 else 0.0,
+    }
+    # Latencies of the answered requests only, failures are counted by the error rate
+    for name in ("ttfp_s", "latency_s"):
+        values = [result[name] for result in answered if result[name] is not None]
+        for p in PERCENTILES:
+            summary[f"{name}_p{p}"] = percentile(values, p)
+    # The most frequent errors, by message
+    counts = {}
+    for error in errors:
+        counts[error] = counts.get(error, 0) + 1
+    summary["error_messages"] = dict(sorted(counts.items(), key=lambda item: -item[1])[:5])
+    return summary
+
+
+def format_summary(summary: Dict) -> str:
+    def row(title, name):
+        values = [summary[f"{name}_p{p}"] for p in PERCENTILES]
+        return f"{title:<20}" + "".join(
+            f"  p{p} {'-' if value is None else f'{value:.3f}s':>9}" for p, value in zip(PERCENTILES, values))
+
+    lines = [
+        f"{summary['requests']} requests in {summary['elapsed_s']:.1f}s, "
+        f"{summary['errors']} errors ({summary['error_rate']:.1%})",
+        f"{summary['requests_per_s']:.2f} requests/s, {summary['messages_per_s']:.1f} messages/s, "
+        f"{summary['pages_per_s']:.1f} pages/s",
+        row("time to first page", "ttfp_s"),
+        row("total latency", "latency_s"),
+    ]
+    for error, count in summary["error_messages"].items():
+        lines.append(f"{count:>6} x {error}")
+    return "\n".join(lines)
+
+
+def load_backend(backend_dir: str):
+    """The FastAPI app of the backend, imported from its directory."""
+    # The backend imports its modules as top level ones: rpc, blobs, wire
+    sys.path.insert(0, backend_dir)
+    spec = importlib.util.spec_from_file_location("backend_main", os.path.join(backend_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+async def serve_stack(args) -> tuple:
+    """Starts the extractor's pdf lane and the backend in this process, returns the url and a stop callback."""
+    import aio_pika
+    import uvicorn
+
+    if args.broker == "memory":
+        from bench.broker import MemoryBroker
+        broker = MemoryBroker()
+        # Both services connect through aio_pika.connect_robust
+        aio_pika.connect_robust = broker.connect_robust
+
+    from extractor.config import extractor_cfg
+    from rpc_server import server
+    from rpc_server.config import rpc_cfg
+    # The models are never loaded here, so the pdf lane replays the MOCK=1 responses
+    extractor_cfg.mock_page_seconds = args.page_seconds
+    extractor = server.Server([rpc_cfg.lanes["pdf"]])
+    extractor_task = asyncio.create_task(extractor.serve())
+
+    app = load_backend(args.backend_dir)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", args.port))
+    http = uvicorn.Server(uvicorn.Config(app, log_level="warning", timeout_keep_alive=30))
+    http_task = asyncio.create_task(http.serve(sockets=[sock]))
+    while not http.started:
+        if http_task.done():
+            http_task.result()
+            raise RuntimeError("The backend stopped while starting")
+        await asyncio.sleep(0.05)
+
+    async def stop():
+        http.should_exit = True
+        await http_task
+        extractor_task.cancel()
+        await asyncio.gather(extractor_task, return_exceptions=True)
+        sock.close()
+
+    host, port = sock.getsockname()
+    return f"http://{host}:{port}", stop
+
+
+async def run(args, pdf: bytes) -> Dict:
+    params = {"fast": args.fast, "images": not args.no_images}
+    if args.timeout:
+        params["timeout"] = args.timeout
+    if args.url:
+        return await run_clients(args.url.rstrip("/"), pdf, params, args.clients, args.requests, args.duration)
+    url, stop = await serve_stack(args)
+    try:
+        return await run_clients(url, pdf, params, args.clients, args.requests, args.duration)
+    finally:
+        await stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load tests /convert_pdf with concurrent clients.")
+    parser.add_argument("--clients", type=int, default=8, help="Requests in flight at a time")
+    parser.add_argument("--requests", type=int, help="Requests sent in all, 10 per client by default")
+    parser.add_argument("--duration", type=float, help="Seconds to keep sending requests for, instead of --requests")
+    parser.add_argument("--page-seconds", type=float, default=0.1, help="Seconds each mock page takes in the extractor")
+    parser.add_argument("--broker", choices=("memory", "amqp"), default="memory",
+                        help="The in-memory stand-in, or the broker of RPC_HOST")
+    parser.add_argument("--url", help="Base url of a running backend, nothing is started in this process")
+    parser.add_argument("--backend-dir", default=BACKEND_DIR)
+    parser.add_argument("--port", type=int, default=0, help="Port of the in-process backend, any free one by default")
+    parser.add_argument("--file", help="Pdf uploaded by every request, a synthetic one by default")
+    parser.add_argument("--pdf-kind", choices=PDF_KINDS, default="text")
+    parser.add_argument("--pdf-pages", type=int, default=8)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "extractor-bench"))
+    parser.add_argument("--fast", action="store_true")
+    parser.add_argument("--no-images", action="store_true")
+    parser.add_argument("--timeout", type=float, help="Seconds each request may take, the backend default when unset")
+    parser.add_argument("--results", help="Writes the settings and the summary to this JSON file")
+    args = parser.parse_args(argv)
+    if args.clients < 1:
+        parser.error("--clients must be at least 1")
+    if args.requests is None and args.duration is None:
+        args.requests = 10 * args.clients
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            pdf = f.read()
+    else:
+        document, = build_corpus(args.corpus_dir, [args.pdf_kind], [], args.pdf_pages, 0)
+        with open(document.path, "rb") as f:
+            pdf = f.read()
+
+    summary = asyncio.run(run(args, pdf))
+    print(format_summary(summary))
+    if args.results:
+        settings = {name: value for name, value in vars(args).items() if name not in ("results", "backend_dir")}
+        with open(args.results, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "settings": settings, "summary": summary}, f, indent=2)
+    return 1 if summary["requests"] and summary["errors"] == summary["requests"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
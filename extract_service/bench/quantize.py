@@ -0,0 +1,220 @@
+"""
+Accuracy against speed of the CPU precisions of PDF_QUANTIZE, on the pdfs of the synthetic corpus.
+
+    python -m bench.quantize --modes none,int8,bf16 --pdf-pages 5 --report quantize.md --results quantize.json
+
+Each precision runs in its own process, which loads the models with it, warms up and converts every
+pdf of the corpus. The first mode, full precision by default, is the reference: the accuracy of a
+page is the similarity of its text, and of its tables, to the reference's, one minus the normalized
+Levenshtein distance. Speed is pages per second and the time to the first page, the median over
+--repeat conversions, with the load time and weight size of the models in each precision. A
+precision that fails stops the comparison, with its process's exit status.
+
+Run it with the settings of the queue being sized (TORCH_THREADS, PDF_FEATURES, ...): they apply
+to every precision alike.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from bench.corpus import PDF_KINDS, build_corpus
+from extractor.metrics import peak_rss_bytes
+from extractor.models import QUANTIZE_MODES
+
+
+def convert_document(path: str) -> Dict:
+    """Converts one pdf, returning its timings and the text and tables of each page."""
+    from extractor.images import ImageOptions
+    from extractor.pdf import convert_pdf
+    pages = {}
+    start = time.perf_counter()
+    first = None
+    # Images are left out, their encoding doesn't depend on the precision of the models
+    for response in convert_pdf(path, image_options=ImageOptions(enabled=False)):
+        page = response.get("page")
+        if page is None:
+            continue
+        if first is None:
+            first = time.perf_counter() - start
+        pages[str(page["page"])] = {
+            "text": page["text"],
+            "tables": "\n\n".join(str(table.get("content", "")) for table in page["tables"]),
+        }
+    latency = time.perf_counter() - start
+    return {
+        "latency_s": latency,
+        "ttfp_s": latency if first is None else first,
+        "pages_per_s": len(pages) / latency if latency > 0 else 0.0,
+        "pages": pages,
+    }
+
+
+def run_worker(args) -> Dict:
+    """Runs in the child process of one precision, set by PDF_QUANTIZE."""
+    from extractor.config import extractor_cfg
+    from extractor.models import load_stats
+    from extractor.pdf import load_models, warm_up
+    from rpc_server.config import rpc_cfg
+    from rpc_server.supervisor import set_torch_threads, split_threads
+    set_torch_threads(rpc_cfg.torch_threads or split_threads(1), rpc_cfg.torch_interop_threads)
+    if len(load_models()) == 0:
+        raise RuntimeError("MOCK=1, there are no models to compare")
+    warm_up()
+
+    documents = {}
+    for document in build_corpus(args.corpus_dir, split(args.pdf_kinds), [], args.pdf_pages, 0, args.seed):
+        runs = [convert_document(document.path) for _ in range(args.repeat)]
+        result = {name: statistics.median(run[name] for run in runs) for name in ("latency_s", "ttfp_s", "pages_per_s")}
+        result.update({"kind": document.kind, "pages": runs[0]["pages"]})
+        documents[document.name] = result
+        print(f"{extractor_cfg.quantize:<5} {document.name:<32} {result['pages_per_s']:8.2f} pages/s", flush=True)
+    return {"quantize": extractor_cfg.quantize, "models": load_stats, "peak_rss_bytes": peak_rss_bytes(),
+            "documents": documents}
+
+
+def run_mode(mode: str, args) -> Dict:
+    """
+    Runs the conversions of one precision in a new process, so its models are loaded for it alone.
+    Raises CalledProcessError when it fails, rather than reporting the precisions that worked.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        command = [sys.executable, "-m", "bench.quantize", "--worker", "--output", output.name,
+                   "--pdf-kinds", args.pdf_kinds, "--pdf-pages", str(args.pdf_pages), "--seed", str(args.seed),
+                   "--repeat", str(args.repeat), "--corpus-dir", args.corpus_dir]
+        subprocess.run(command, env={**os.environ, "PDF_QUANTIZE": mode}, check=True)
+        with open(output.name) as f:
+            return json.load(f)
+
+
+def similarity(reference: str, text: str) -> float:
+    from rapidfuzz.distance import Levenshtein
+    if not reference and not text:
+        return 1.0
+    return Levenshtein.normalized_similarity(reference, text)
+
+
+def accuracy(reference: Dict, result: Dict, field: str) -> Optional[float]:
+    """Mean similarity over the pages of a document, None when the reference has nothing to compare."""
+    scores = []
+    for pnum, page in reference["pages"].items():
+        if field == "tables" and not page["tables"]:
+            continue
+        scores.append(similarity(page[field], result["pages"].get(pnum, {}).get(field, "")))
+    return statistics.mean(scores) if scores else None
+
+
+def compare(runs: List[Dict]) -> List[Dict]:
+    """A row per document kind and precision, against the first precision."""
+    reference = runs[0]
+    rows = []
+    for run in runs:
+        for name, result in run["documents"].items():
+            base = reference["documents"][name]
+            rows.append({
+                "document": name,
+                "kind": result["kind"],
+                "quantize": run["quantize"],
+                "pages_per_s": result["pages_per_s"],
+                "speedup": result["pages_per_s"] / base["pages_per_s"] if base["pages_per_s"] else None,
+                "ttfp_s": result["ttfp_s"],
+                "text_accuracy": accuracy(base, result, "text"),
+                "table_accuracy": accuracy(base, result, "tables"),
+            })
+    return rows
+
+
+def fmt(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def report(runs: List[Dict], rows: List[Dict], settings: Dict) -> str:
+    lines = [
+        "# CPU precision: accuracy against speed",
+        "",
+        f"Reference: {runs[0]['quantize']}. Corpus: {settings['pdf_kinds']}, {settings['pdf_pages']} pages, "
+        f"seed {settings['seed']}, median of {settings['repeat']}. Machine: {settings['cpus']} cpus, "
+        f"TORCH_THREADS={settings['torch_threads']}, bf16 instructions: {settings['bf16']}.",
+        "",
+        "| document | precision | pages/s | speedup (x) | first page | text accuracy | table accuracy |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for row in rows:
+        lines.append(
+            f"| {row['kind']} | {row['quantize']} | {fmt(row['pages_per_s'], '.2f')} | {fmt(row['speedup'], '.2f')} "
+            f"| {fmt(row['ttfp_s'], '.2f')}s | {fmt(row['text_accuracy'], '.3f')} | {fmt(row['table_accuracy'], '.3f')} |")
+    lines += [
+        "",
+        "| precision | models load | weights | peak rss |",
+        "|---|---|---|---|",
+    ]
+    for run in runs:
+        models = run["models"].values()
+        lines.append(
+            f"| {run['quantize']} | {sum(m['seconds'] for m in models):.1f}s "
+            f"| {sum(m['weight_bytes'] for m in models) / 1024 ** 2:.0f} MiB | {run['peak_rss_bytes'] / 1024 ** 2:.0f} MiB |")
+    return "\n".join(lines) + "\n"
+
+
+def split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compares the accuracy and speed of the CPU precisions.")
+    parser.add_argument("--modes", default="none,int8,bf16", help="Values of PDF_QUANTIZE, the first is the reference")
+    parser.add_argument("--pdf-kinds", default=",".join(PDF_KINDS))
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "extractor-bench"))
+    parser.add_argument("--report", help="Writes the markdown report to this file, printed otherwise")
+    parser.add_argument("--results", help="Writes the runs and the comparison to this JSON file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        result = run_worker(args)
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    modes = split(args.modes)
+    for mode in modes:
+        if mode not in QUANTIZE_MODES:
+            parser.error(f"Invalid mode: {mode}")
+    # Generated once, before the runs share it
+    build_corpus(args.corpus_dir, split(args.pdf_kinds), [], args.pdf_pages, 0, args.seed)
+    runs = []
+    for mode in modes:
+        try:
+            runs.append(run_mode(mode, args))
+        except subprocess.CalledProcessError as e:
+            print(f"PDF_QUANTIZE={mode} failed with status {e.returncode}", file=sys.stderr)
+            return e.returncode
+
+    from extractor.models import bf16_supported
+    settings = {"modes": modes, "pdf_kinds": args.pdf_kinds, "pdf_pages": args.pdf_pages, "seed": args.seed,
+                "repeat": args.repeat, "cpus": os.cpu_count(), "torch_threads": os.getenv("TORCH_THREADS"),
+                "bf16": bf16_supported()}
+    rows = compare(runs)
+    text = report(runs, rows, settings)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text)
+    print(text)
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "settings": settings, "runs": runs,
+                       "rows": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
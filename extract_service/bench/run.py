@@ -0,0 +1,305 @@
+"""
+Benchmarks the converters on the synthetic corpus, and compares the results with an earlier run.
+
+    python -m bench.run --pdf-pages 10 --docx-pages 50 --results bench.json
+    python -m bench.run --results bench.json --baseline baseline.json --check
+
+Targets:
+- pdf: custom_convert_pdf with the loaded models, skipped with MOCK=1
+- docx: the docx Converter, through convert_docx_to_md
+- server: the whole Lane.on_request path of the rpc server, from the request message to eof, with the
+  result cache and checkpoints off. Publishing is recorded in memory instead of sent to a broker.
+
+Each document is converted in a forked process, so its peak RSS is its own, and the models loaded
+once by this process are shared. With --repeat, every metric is the median over the runs.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from bench.corpus import DOCX_KINDS, PDF_KINDS, Document, build_corpus
+from extractor.metrics import current_rss_bytes, peak_rss_bytes
+
+TARGETS = ("pdf", "docx", "server")
+# Metrics compared with a baseline, and whether a higher value is better
+METRICS = {
+    "latency_s": False,
+    "ttfp_s": False,
+    "pages_per_s": True,
+    "peak_rss_bytes": False,
+}
+
+
+class Timer:
+    """Times the pages of one conversion as they are produced."""
+    def __init__(self):
+        self.rss = current_rss_bytes()
+        self.start = time.perf_counter()
+        self.first = None
+        self.pages = 0
+
+    def page(self):
+        if self.first is None:
+            self.first = time.perf_counter() - self.start
+        self.pages += 1
+
+    def result(self) -> Dict:
+        latency = time.perf_counter() - self.start
+        return {
+            "latency_s": latency,
+            "ttfp_s": latency if self.first is None else self.first,
+            "pages": self.pages,
+            "pages_per_s": self.pages / latency if latency > 0 else 0.0,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "rss_growth_bytes": max(0, peak_rss_bytes() - self.rss),
+        }
+
+
+# Targets, calling timer.page() for each page
+
+def run_pdf(document: Document, timer: Timer):
+    from extractor.config import extractor_cfg
+    from extractor.models import autocast_dtype
+    from extractor.pdf import model_lst
+    from extractor.pdf_convertor.convert import custom_convert_pdf
+    for _ in custom_convert_pdf(
+            document.path,
+            model_lst,
+            batch_multiplier=extractor_cfg.batch_multiplier,
+            batch_pages=extractor_cfg.batch_pages,
+            prefetch_pages=extractor_cfg.prefetch_pages,
+            queue_size=extractor_cfg.queue_size,
+            autocast_dtype=autocast_dtype(extractor_cfg.quantize)):
+        timer.page()
+
+
+def run_docx(document: Document, timer: Timer):
+    from extractor.docx import convert_docx_to_md
+    for _ in convert_docx_to_md(document.path):
+        timer.page()
+
+
+class RecordingExchange:
+    """Stands in for the default exchange of the lane's channel: pages are timed as they are published."""
+    def __init__(self, timer: Timer):
+        self.timer = timer
+        self.messages = []
+
+    async def publish(self, message, routing_key: str):
+        body = json.loads(message.body)
+        self.messages.append(body)
+        if body.get("pnum") is not None:
+            self.timer.page()
+
+
+class RecordingChannel:
+    def __init__(self, timer: Timer):
+        self.default_exchange = RecordingExchange(timer)
+
+
+class BenchRequest:
+    """Stands in for an incoming request message, with the attributes the lane reads."""
+    def __init__(self, body: bytes, headers: Dict):
+        self.body = body
+        self.headers = headers
+        self.correlation_id = str(uuid.uuid4())
+        self.reply_to = "bench"
+        self.redelivered = False
+        self.priority = None
+        self.acked = False
+
+    async def ack(self):
+        self.acked = True
+
+    async def nack(self, requeue: bool = True):
+        raise RuntimeError("Request was requeued")
+
+
+def run_server(document: Document, timer: Timer):
+    from rpc_server import server
+    from rpc_server.cancel import CancelRegistry
+    from rpc_server.config import rpc_cfg
+    # Every request converts, and pdfs are converted whole by this process
+    server.result_cache = None
+    server.checkpoints = None
+    rpc_cfg.shard_min_pages = 0
+
+    async def run():
+        lane = server.Lane(rpc_cfg.lanes[document.file_type], CancelRegistry(), shards=None)
+        lane.channel = RecordingChannel(timer)
+        with open(document.path, "rb") as f:
+            request = BenchRequest(f.read(), {})
+        await lane.on_request(request)
+        for message in lane.channel.default_exchange.messages:
+            if message.get("message", "").startswith(("Failed", "Cancelled")):
+                raise RuntimeError(message["message"])
+        if not request.acked:
+            raise RuntimeError("Request was not acknowledged")
+
+    asyncio.run(run())
+
+
+RUNNERS: Dict[str, Callable[[Document, Timer], None]] = {"pdf": run_pdf, "docx": run_docx, "server": run_server}
+
+
+def child(conn, target: str, document: Document):
+    try:
+        timer = Timer()
+        RUNNERS[target](document, timer)
+        conn.send(timer.result())
+    except BaseException as e:
+        traceback.print_exc()
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_isolated(target: str, document: Document) -> Dict:
+    """Converts a document in a forked process, which shares the models loaded by this one."""
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=child, args=(sender, target, document))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "Benchmark process died"}
+    process.join()
+    return result
+
+
+def median_result(runs: List[Dict]) -> Dict:
+    errors = [run["error"] for run in runs if "error" in run]
+    if errors:
+        return {"error": errors[0], "runs": len(runs)}
+    result = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+    result["runs"] = len(runs)
+    return result
+
+
+def machine() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "torch_threads": os.getenv("TORCH_THREADS"),
+        "mock": os.getenv("MOCK") == "1",
+    }
+
+
+def run_benchmarks(documents: List[Document], targets: List[str], repeat: int = 1) -> Dict[str, Dict]:
+    results = {}
+    for target in targets:
+        for document in documents:
+            if target == "pdf" and document.file_type != "pdf":
+                continue
+            if target == "docx" and document.file_type != "docx":
+                continue
+            key = f"{target}/{document.name}"
+            result = median_result([run_isolated(target, document) for _ in range(repeat)])
+            results[key] = result
+            print(format_result(key, result), flush=True)
+    return results
+
+
+def format_result(key: str, result: Dict) -> str:
+    if "error" in result:
+        return f"{key:<40} error: {result['error']}"
+    return (f"{key:<40} {result['latency_s']:8.2f}s  first page {result['ttfp_s']:7.2f}s  "
+            f"{result['pages_per_s']:8.2f} pages/s  peak rss {result['peak_rss_bytes'] / 1024 ** 2:8.0f} MiB")
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[Dict]:
+    """Changes of each metric from the baseline, flagging those worse by more than `tolerance`."""
+    rows = []
+    for key, result in current["results"].items():
+        before = baseline.get("results", {}).get(key)
+        if before is None or "error" in before or "error" in result:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append({"key": key, "metric": metric, "baseline": old, "current": new,
+                         "change": change, "regressed": regressed})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the extractors on a synthetic corpus.")
+    parser.add_argument("--targets", default=",".join(TARGETS), help="Comma separated: pdf, docx, server")
+    parser.add_argument("--pdf-kinds", default=",".join(PDF_KINDS))
+    parser.add_argument("--docx-kinds", default=",".join(DOCX_KINDS))
+    parser.add_argument("--pdf-pages", type=int, default=10)
+    parser.add_argument("--docx-pages", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "extractor-bench"),
+                        help="Where the corpus is generated, and reused from on later runs")
+    parser.add_argument("--results", help="Writes the results to this JSON file, usable as a later baseline")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--check", action="store_true", help="Exits with 1 on a regression from the baseline")
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    for target in targets:
+        if target not in TARGETS:
+            parser.error(f"Invalid target: {target}")
+    pdf_kinds = [k.strip() for k in args.pdf_kinds.split(",") if k.strip()]
+    docx_kinds = [k.strip() for k in args.docx_kinds.split(",") if k.strip()]
+    documents = build_corpus(args.corpus_dir, pdf_kinds, docx_kinds, args.pdf_pages, args.docx_pages, args.seed)
+
+    model_stats = {}
+    if any(d.file_type == "pdf" for d in documents) and ("pdf" in targets or "server" in targets):
+        from extractor.models import load_stats
+        from extractor.pdf import load_models
+        # Loaded here, before forking, like the server's workers
+        models = load_models()
+        if len(models) == 0 and "pdf" in targets:
+            print("MOCK=1, skipping the pdf target")
+            targets.remove("pdf")
+        model_stats = dict(load_stats)
+
+    current = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": machine(),
+        "settings": {"targets": targets, "pdf_pages": args.pdf_pages, "docx_pages": args.docx_pages,
+                     "seed": args.seed, "repeat": args.repeat},
+        "corpus": [document.to_dict() for document in documents],
+        # Load time and memory of each model, the lazy ones are loaded by the forked runs only
+        "models": model_stats,
+        "results": run_benchmarks(documents, targets, args.repeat),
+    }
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(baseline, current, args.tolerance)
+    for row in rows:
+        flag = "REGRESSION" if row["regressed"] else ""
+        print(f"{row['key']:<40} {row['metric']:<15} {row['baseline']:12.3f} -> {row['current']:12.3f} {row['change']:+8.1%} {flag}")
+    regressions = [row for row in rows if row["regressed"]]
+    print(f"{len(regressions)} regressions beyond {args.tolerance:.0%} over {len(rows)} comparisons")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import threading
+import time
+from typing import Optional
+
+
+class Cancelled(Exception):
+    """Raised inside a conversion once its request is cancelled or past its deadline."""
+
+
+class CancelToken:
+    """
+    Lets a conversion be abandoned between pages and stages: set from another thread by a cancel
+    request, or expired by the request deadline, a unix timestamp.
+    """
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason: str = "cancelled"):
+        self.reason = reason
+        self.event.set()
+
+    def cancelled(self) -> bool:
+        if not self.event.is_set() and self.deadline is not None and time.time() > self.deadline:
+            self.cancel("deadline exceeded")
+        return self.event.is_set()
+
+    def check(self):
+        if self.cancelled():
+            raise Cancelled(self.reason)
+
+
+def check_cancelled(cancel: Optional[CancelToken]):
+    if cancel is not None:
+        cancel.check()
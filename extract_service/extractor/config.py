@@ -0,0 +1,36 @@
+import os
+import dotenv
+dotenv.load_dotenv()
+
+def names(value, default: str):
+    """A comma separated list of lowercase names."""
+    return [name.strip().lower() for name in (value if value is not None else default).split(',') if name.strip()]
+
+class ExtractorConfig:
+    def __init__(self):
+        # Pages pushed through each model together, defaults to the marker batch sizes when unset
+        self.batch_pages = int(os.getenv('PDF_BATCH_PAGES') or 0) or None
+        self.batch_multiplier = int(os.getenv('PDF_BATCH_MULTIPLIER') or 1)
+        # Rendered pages allowed to wait ahead of inference, defaults to one window. Images are
+        # resident for these and at most one window in each of the stages from rendering to tables
+        self.prefetch_pages = int(os.getenv('PDF_PREFETCH_PAGES') or 0) or None
+        # Windows allowed to wait between two stages of the pdf pipeline
+        self.queue_size = int(os.getenv('PDF_STAGE_QUEUE_SIZE') or 1)
+        # Threads encoding extracted images
+        self.image_workers = int(os.getenv('IMAGE_ENCODE_WORKERS') or 4)
+        # Thresholds for using the embedded text layer instead of detection and OCR
+        self.text_layer_min_chars = int(os.getenv('TEXT_LAYER_MIN_CHARS') or 50)
+        self.text_layer_min_line_ratio = float(os.getenv('TEXT_LAYER_MIN_LINE_RATIO') or 0.8)
+        # Optional parts of pdf conversion, only the models they need are loaded: ocr, tables, equations
+        self.pdf_features = names(os.getenv('PDF_FEATURES'), 'ocr,tables,equations')
+        # Models loaded by the first page that needs them rather than at startup, e.g. texify
+        self.lazy_models = names(os.getenv('PDF_LAZY_MODELS'), '')
+        # Precision of the surya models on CPU: none, int8 (dynamic quantization of linear layers),
+        # bf16, or auto for bf16 on CPUs with native support and int8 elsewhere
+        self.quantize = (os.getenv('PDF_QUANTIZE') or 'none').lower()
+        # Converts a synthetic page once the models are loaded, before requests are taken
+        self.warmup = (os.getenv('PDF_WARMUP') or '1') not in ('0', 'false', 'no')
+        # Seconds each page of the recorded responses takes with MOCK=1, to load test without the models
+        self.mock_page_seconds = float(os.getenv('MOCK_PAGE_SECONDS') or 0)
+
+extractor_cfg = ExtractorConfig()
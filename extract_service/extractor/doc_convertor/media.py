@@ -0,0 +1,74 @@
+import hashlib
+import io
+import os.path
+import zipfile
+from typing import Dict, Optional
+
+from PIL import Image
+
+from docx2md.docxfile import DocxFile, DocxFileError
+from extractor.images import ImageOptions, encode_image
+
+
+class InMemoryDocx(DocxFile):
+    """A DocxFile read from a path, or from bytes or a file-like object without writing them to disk."""
+    def __init__(self, file):
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            file = io.BytesIO(file)
+        try:
+            self.docx = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise DocxFileError("Not a zip file.")
+        if "word/document.xml" not in self.namelist():
+            raise DocxFileError("Not a .docx file.")
+
+
+class MediaCache:
+    """
+    The images of one document, each read from the archive and encoded once.
+
+    Images are looked up by embed id, then by the sha256 of their file, so an image placed several
+    times, under one relationship or several, is sent once. As for pdfs, later occurrences are sent as
+    {"name", "ref", "hash"} where "ref" is the name the content was first sent under.
+    """
+    def __init__(self, media, options: Optional[ImageOptions] = None):
+        self.media = media
+        self.options = options or ImageOptions()
+        # embed id -> (name, sha256 of the file), and the name each file was first sent under
+        self.embeds: Dict[str, tuple] = {}
+        self.sent: Dict[str, str] = {}
+
+    def image(self, embed_id: str) -> Optional[Dict]:
+        """The image data of an embed for the page it appears on, None when images are skipped."""
+        if not self.options.enabled:
+            return None
+        if embed_id not in self.embeds:
+            media_info = self.media[embed_id]
+            try:
+                data = self.media.docx.docx.read(f"word/{media_info.path}")
+            except KeyError:
+                # A relationship to a part missing from the archive: the image is left out
+                print(f"Missing image {media_info.path}")
+                return None
+            name = os.path.basename(media_info.path)
+            digest = hashlib.sha256(data).hexdigest()
+            self.embeds[embed_id] = (name, digest)
+            if digest not in self.sent:
+                self.sent[digest] = name
+                return {"name": name, "hash": digest, **self.encode(data, name)}
+        name, digest = self.embeds[embed_id]
+        return {"name": name, "ref": self.sent[digest], "hash": digest}
+
+    def encode(self, data: bytes, name: str) -> Dict:
+        """The image in the requested format and size; sent as stored when it already is."""
+        try:
+            image = Image.open(io.BytesIO(data))
+            fits = not self.options.max_size or max(image.size) <= self.options.max_size
+            if image.format == self.options.format and fits and self.options.quality is None:
+                return {"format": image.format, "content": data}
+            image.load()
+            return {"format": self.options.format, "content": encode_image(image, self.options)}
+        except Exception as e:
+            # Formats Pillow can't decode, such as emf, are sent as stored
+            print(f"Could not convert image {name}: {e}")
+            return {"format": os.path.splitext(name)[1].lstrip(".").upper(), "content": data}
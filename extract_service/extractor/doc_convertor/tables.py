@@ -0,0 +1,173 @@
+import csv
+import io
+import re
+from typing import Dict, Iterator, List, Optional
+
+# As for pdfs: the representations in each table's data, the first is its content
+DEFAULT_TABLE_FORMATS = ("csv",)
+
+# Elements that can wrap the rows of a table or the cells of a row
+WRAPPERS = ("sdt", "sdtContent", "customXml")
+
+
+def children(node, tag: str) -> Iterator:
+    """Children of `node` named `tag`, including those inside content controls."""
+    for child in node.iterchildren():
+        if child.tag == tag:
+            yield child
+        elif child.tag in WRAPPERS:
+            yield from children(child, tag)
+
+
+def child(node, tag: str):
+    if node is None:
+        return None
+    return next(children(node, tag), None)
+
+
+def int_val(node, default: int = 0) -> int:
+    if node is None:
+        return default
+    try:
+        return int(node.attrib.get("val", default))
+    except ValueError:
+        return default
+
+
+class Cell:
+    """A cell of a table: its text, first grid column, grid columns spanned and place in a vertical merge."""
+    __slots__ = ("text", "column", "span", "vmerge", "rowspan", "covered")
+
+    def __init__(self, text: str, column: int, span: int = 1, vmerge: Optional[str] = None):
+        self.text = text
+        self.column = column
+        self.span = span
+        # None, "restart" for the first cell of a vertical merge, or "continue" for the cells below it
+        self.vmerge = vmerge
+        self.rowspan = 1
+        # Part of the merge started by a cell above, which holds the text
+        self.covered = False
+
+
+class Row:
+    def __init__(self, before: int = 0, after: int = 0):
+        # Empty grid columns before the first cell and after the last
+        self.before = before
+        self.after = after
+        self.cells: List[Cell] = []
+
+    @property
+    def width(self) -> int:
+        return self.before + sum(cell.span for cell in self.cells) + self.after
+
+
+class Table:
+    """
+    The grid of a table, read once from its xml, from which every representation is rendered.
+    """
+    def __init__(self, grid_columns: int = 0):
+        self.rows: List[Row] = []
+        self.grid_columns = grid_columns
+
+    def add_row(self, before: int = 0, after: int = 0) -> Row:
+        row = Row(before, after)
+        self.rows.append(row)
+        return row
+
+    def add_cell(self, text: str, span: int = 1, vmerge: Optional[str] = None) -> Cell:
+        row = self.rows[-1]
+        column = row.before + sum(cell.span for cell in row.cells)
+        cell = Cell(text, column, max(1, span), vmerge)
+        row.cells.append(cell)
+        return cell
+
+    @property
+    def columns(self) -> int:
+        return max([self.grid_columns] + [row.width for row in self.rows])
+
+    def close(self):
+        """Counts the rows each vertical merge spans, once all rows are read."""
+        starts = {}
+        for row in self.rows:
+            # A merge ends at the first row without a continuing cell in its column
+            next_starts = {}
+            for cell in row.cells:
+                start = starts.get(cell.column)
+                if cell.vmerge == "continue" and start is not None:
+                    start.rowspan += 1
+                    cell.covered = True
+                    next_starts[cell.column] = start
+                elif cell.vmerge == "restart":
+                    next_starts[cell.column] = cell
+            starts = next_starts
+        return self
+
+    def format(self, table_format: str):
+        if table_format == "markdown":
+            return self.markdown()
+        if table_format == "html":
+            return self.html()
+        if table_format == "csv":
+            return self.csv()
+        raise ValueError(f"Invalid table format: {table_format}")
+
+    def markdown(self) -> str:
+        lines = [
+            "| # " * self.columns + "|",
+            "|---" * self.columns + "|",
+        ]
+        for row in self.rows:
+            line = "|" + "|" * row.before
+            for cell in row.cells:
+                line += re.sub(r"\n+", "<br>", cell.text) + "|" * cell.span
+            lines.append(line + "|" * row.after)
+        return "\n".join(lines)
+
+    def html(self, table_id: Optional[str] = None) -> str:
+        lines = [f'<table id="{table_id}">' if table_id else "<table>"]
+        for row in self.rows:
+            lines.append("<tr>")
+            lines.extend(["<td></td>"] * row.before)
+            for cell in row.cells:
+                if cell.covered:
+                    continue
+                attr = "" if cell.span <= 1 else f' colspan="{cell.span}"'
+                attr += "" if cell.rowspan <= 1 else f' rowspan="{cell.rowspan}"'
+                text = re.sub(r"\n+", "<br>", cell.text)
+                lines.append(f"<td{attr}>{text}</td>")
+            lines.extend(["<td></td>"] * row.after)
+            lines.append("</tr>")
+        lines.append("</table>")
+        return "\n".join(lines)
+
+    def csv(self) -> str:
+        of = io.StringIO()
+        writer = csv.writer(of, lineterminator="\n")
+        for values in self.values():
+            writer.writerow(values)
+        return of.getvalue().rstrip("\n")
+
+    def values(self) -> List[List[str]]:
+        """The text of each grid position, spanned and merged positions left empty."""
+        columns = self.columns
+        values = []
+        for row in self.rows:
+            line = [""] * columns
+            for cell in row.cells:
+                if not cell.covered:
+                    line[cell.column] = cell.text
+            values.append(line)
+        return values
+
+    def grid(self) -> Dict:
+        """Rows and columns of the table, and the position and spans of each cell."""
+        return {
+            "rows": len(self.rows),
+            "columns": self.columns,
+            "cells": [
+                {"row": y, "column": cell.column, "rowspan": cell.rowspan, "colspan": cell.span, "text": cell.text}
+                for y, row in enumerate(self.rows)
+                for cell in row.cells
+                if not cell.covered
+            ],
+        }
@@ -1,16 +1,20 @@
-import io
 import os
 import json
+import queue
 import traceback
-from docx2md.docxfile import DocxFile
 from extractor.doc_convertor.convert import Converter
+from extractor.doc_convertor.media import InMemoryDocx, MediaCache
 from docx2md.docxmedia import DocxMedia
-import tempfile
+from extractor.images import ImageOptions
+from extractor.metrics import Profile, maybe_stage
 
 class DocxToMarkdown:
-    def __init__(self, use_md_table=True, debug=False):
+    def __init__(self, use_md_table=True, debug=False, table_formats=None, image_options=None):
         self.use_md_table = use_md_table
         self.debug = debug
+        # Representations in each table's data, as for pdfs; None keeps the default
+        self.table_formats = table_formats
+        self.image_options = image_options or ImageOptions()
 
     def convert(self, src, dst):
         """Convert a DOCX file to Markdown."""
@@ -33,23 +37,35 @@ class DocxToMarkdown:
         # Save media files
         media.save(target_dir)
 
-    def yield_convert(self, src):
-        docx = self._create_docx(src)
-        
-        # Convert to Markdown
-        media = DocxMedia(docx)
-        for page in self._yield_convert(docx, media):
-            yield {"page": page, "pnum": page["page"], "message": "success"}
-        pass
+    def yield_convert(self, src, profile=None):
+        with maybe_stage(profile, "docx_load"):
+            docx = self._create_docx(src)
+            media = DocxMedia(docx)
+
+        # Convert to Markdown, each page as soon as it is parsed
+        try:
+            pages = self._yield_convert(docx, media)
+            while True:
+                with maybe_stage(profile, "docx_convert"):
+                    page = next(pages, None)
+                if page is None:
+                    break
+                if profile is not None:
+                    profile.metadata["pages"] = page["page"] + 1
+                yield {"page": page, "pnum": page["page"], "message": "success"}
+        finally:
+            docx.close()
 
     def _yield_convert(self, docx, media):
-        xml_text = docx.document()
-        converter = Converter(xml_text, media, self.use_md_table)
-        return converter.convert()
+        # Streamed out of the zip rather than read into memory whole
+        with docx.docx.open("word/document.xml") as xml:
+            converter = Converter(xml, media, self.use_md_table, self.table_formats, MediaCache(media, self.image_options))
+            yield from converter.yield_convert()
     
     def _create_docx(self, file):
+        """Opens a DOCX from a path, or from its bytes in memory."""
         try:
-            return DocxFile(file)
+            return InMemoryDocx(file)
         except Exception as e:
             traceback.print_exc()
             raise RuntimeError(f"Error loading DOCX file: {e}")
@@ -69,7 +85,7 @@ class DocxToMarkdown:
 
     def _convert(self, docx, target_dir, media):
         xml_text = docx.document()
-        converter = Converter(xml_text, media, self.use_md_table)
+        converter = Converter(xml_text, media, self.use_md_table, self.table_formats)
         return converter.convert()
 
     def _save_md(self, file, text):
@@ -84,25 +100,45 @@ class DocxToMarkdown:
             with open(file, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=4)  # `indent=4` to format the JSON
 
-def convert_docx_to_md(src):
-    """Convert a DOCX file to Markdown."""
-    converter = DocxToMarkdown()
-    return converter.yield_convert(src)
+def convert_docx_to_md(src, profile=None, table_formats=None, image_options=None):
+    """Convert a DOCX file, given by path or as bytes, to Markdown."""
+    converter = DocxToMarkdown(table_formats=table_formats, image_options=image_options)
+    return converter.yield_convert(src, profile=profile)
+
+def convert_docx_file(file, table_formats=None, image_options=None, *, pages, stop):
+    """
+    Convert a DOCX given by path or held in memory, for pool processes: puts each page on the
+    `pages` queue as soon as it is converted, then None, until done or `stop` is set, and returns
+    the profile of the conversion.
+    """
+    profile = Profile("docx")
+    converted = convert_docx_to_md(file, profile=profile, table_formats=table_formats, image_options=image_options)
+    try:
+        for page in converted:
+            if not put_page(pages, stop, page):
+                break
+    finally:
+        converted.close()
+        # Ends the pages, whether converted or failed
+        put_page(pages, stop, None)
+    return profile.stages, profile.metadata
+
+def put_page(pages, stop, page) -> bool:
+    """Puts a page on the bounded queue, False once the reader stopped and no longer takes any."""
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
 if __name__ == "__main__":
     with open("test.docx", "rb") as f:
         bytes = f.read()
 
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as temp_file:
-        temp_file.write(bytes)
-        temp_file_path = temp_file.name
-
     try:
-        for page in convert_docx_to_md(temp_file_path):
+        for page in convert_docx_to_md(bytes):
             print(page)
     except Exception as e:
         print(e)
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
@@ -0,0 +1,90 @@
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from extractor.config import extractor_cfg
+
+IMAGE_FORMATS = ("PNG", "JPEG", "WEBP")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by all encoders, created on first use so it is never inherited across a fork."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=extractor_cfg.image_workers, thread_name_prefix="image-encode")
+        return _executor
+
+class ImageOptions:
+    """How extracted images are sent: codec, quality, largest side in pixels, or not at all."""
+    def __init__(self, format: str = "PNG", quality: Optional[int] = None, max_size: Optional[int] = None, enabled: bool = True):
+        format = format.upper()
+        if format == "JPG":
+            format = "JPEG"
+        if format not in IMAGE_FORMATS:
+            raise ValueError(f"Invalid image format: {format}")
+        self.format = format
+        self.quality = quality
+        self.max_size = max_size
+        self.enabled = enabled
+
+def image_hash(image: Image.Image) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def encode_image(image: Image.Image, options: ImageOptions) -> bytes:
+    """Downscales and encodes an image. The bytes are base64 encoded only if the response is sent as JSON."""
+    if options.max_size and max(image.size) > options.max_size:
+        image = image.copy()
+        image.thumbnail((options.max_size, options.max_size))
+    if options.format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    params = {}
+    if options.quality is not None and options.format != "PNG":
+        params["quality"] = options.quality
+    buffered = io.BytesIO()
+    image.save(buffered, format=options.format, **params)
+    return buffered.getvalue()
+
+class ImageEncoder:
+    """
+    Encodes the images of one document in the shared thread pool.
+
+    Each distinct image is sent once. Later occurrences, such as a logo repeated on every page, are sent
+    as {"name", "ref", "hash"} where "ref" is the name the content was first sent under.
+    """
+    def __init__(self, options: ImageOptions = None):
+        self.options = options or ImageOptions()
+        self.sent = {}
+
+    def encode(self, imgs: Dict[str, Image.Image]) -> List[Dict]:
+        if not self.options.enabled or len(imgs) == 0:
+            return []
+        executor = get_executor()
+        names = list(imgs)
+        hashes = list(executor.map(image_hash, [imgs[name] for name in names]))
+
+        img_list = []
+        to_encode = []
+        for name, digest in zip(names, hashes):
+            if digest in self.sent:
+                img_list.append({"name": name, "ref": self.sent[digest], "hash": digest})
+                continue
+            self.sent[digest] = name
+            item = {"name": name, "format": self.options.format, "hash": digest}
+            img_list.append(item)
+            to_encode.append((item, imgs[name]))
+
+        contents = executor.map(encode_image, [image for _, image in to_encode], [self.options] * len(to_encode))
+        for (item, _), content in zip(to_encode, contents):
+            item["content"] = content
+        return img_list
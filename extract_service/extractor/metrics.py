@@ -0,0 +1,207 @@
+import os
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional, Tuple
+
+# Histogram buckets in seconds, from a fast docx page to a long pdf
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is the high-water mark of the process, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+class Histogram:
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Process-wide histograms and counters, rendered in the Prometheus text format."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.gauges: Dict[Tuple[str, Tuple], float] = {}
+        self.help: Dict[str, Tuple[str, str]] = {}
+        # Index of the worker process, which names its textfile
+        self.worker = 0
+
+    def observe(self, name: str, value: float, description: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.help.setdefault(name, ("histogram", description))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, description: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.help.setdefault(name, ("counter", description))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, description: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.help.setdefault(name, ("gauge", description))
+            self.gauges[key] = value
+
+    def render(self) -> str:
+        def fmt(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+        lines = []
+        with self.lock:
+            for name, (kind, description) in sorted(self.help.items()):
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "histogram":
+                    for (n, labels), hist in sorted(self.histograms.items()):
+                        if n != name:
+                            continue
+                        for bound, count in zip(hist.buckets, hist.counts):
+                            lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist.count}")
+                        lines.append(f"{name}_sum{fmt(labels)} {hist.sum}")
+                        lines.append(f"{name}_count{fmt(labels)} {hist.count}")
+                else:
+                    values = self.counters if kind == "counter" else self.gauges
+                    for (n, labels), value in sorted(values.items()):
+                        if n == name:
+                            lines.append(f"{name}{fmt(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, directory: str):
+        """
+        Writes the metrics for the node exporter textfile collector, one file per worker: a
+        restarted worker takes over the file of the one it replaces.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"extractor_{self.worker}.prom")
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            f.write(self.render())
+        os.replace(f.name, path)
+
+
+def clear_textfiles(directory: str):
+    """Removes the textfiles of a previous run, whose workers may have been more than this one's."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith("extractor_") and name.endswith(".prom"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+registry = MetricsRegistry()
+
+
+class Profile:
+    """
+    Wall time, CPU time and peak RSS growth per stage of one conversion.
+
+    CPU time is that of the whole process while the stage ran, so stages that overlap in the pdf
+    pipeline, and torch worker threads, are all accounted for, and overlapping stages share it.
+    """
+    def __init__(self, file_type: str):
+        self.file_type = file_type
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Dict] = {}
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.start_rss = peak_rss_bytes()
+        # Document level results to report with the timings, filled in by the converters
+        self.metadata: Dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        rss = peak_rss_bytes()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, time.process_time() - cpu, peak_rss_bytes() - rss)
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def wrapped(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapped
+
+    def record(self, name: str, wall: float, cpu: float, rss_delta: int):
+        with self.lock:
+            stats = self.stages.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_delta_bytes": 0})
+            stats["calls"] += 1
+            stats["wall_seconds"] += wall
+            stats["cpu_seconds"] += cpu
+            stats["peak_rss_delta_bytes"] += rss_delta
+        registry.observe("extractor_stage_seconds", wall, "Wall time per stage call", stage=name, file_type=self.file_type)
+        registry.observe("extractor_stage_cpu_seconds", cpu, "Process CPU time per stage call", stage=name, file_type=self.file_type)
+
+    def merge(self, stages: Dict[str, Dict], metadata: Dict):
+        """Adds the stages and metadata of a profile taken in another process."""
+        for name, stats in stages.items():
+            with self.lock:
+                total = self.stages.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_delta_bytes": 0})
+                add_stats(total, stats)
+            registry.observe("extractor_stage_seconds", stats["wall_seconds"], "Wall time per stage call", stage=name, file_type=self.file_type)
+            registry.observe("extractor_stage_cpu_seconds", stats["cpu_seconds"], "Process CPU time per stage call", stage=name, file_type=self.file_type)
+        self.metadata.update(metadata)
+
+    def totals(self) -> Dict:
+        with self.lock:
+            stages = {name: dict(stats) for name, stats in self.stages.items()}
+        return {
+            "wall_seconds": time.perf_counter() - self.start,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            "peak_rss_delta_bytes": peak_rss_bytes() - self.start_rss,
+            "stages": stages,
+        }
+
+
+def maybe_stage(profile: Optional[Profile], name: str):
+    """profile.stage(name), or a no-op when the caller did not ask for a profile."""
+    if profile is None:
+        return nullcontext()
+    return profile.stage(name)
+
+
+def add_stats(total: Dict, stats: Dict) -> Dict:
+    """Adds the numbers of `stats` into `total`, recursing into nested dicts."""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            add_stats(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+    return total
@@ -0,0 +1,237 @@
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional, Sequence
+
+from extractor.metrics import current_rss_bytes, registry
+
+# In the order custom_convert_pdf unpacks them, as returned by marker's load_all_models
+MODEL_NAMES = ("texify", "layout", "order", "detection", "ocr", "table_rec")
+
+# Every conversion runs layout and reading order
+CORE_MODELS = ("layout", "order")
+
+# Models each optional feature needs
+FEATURE_MODELS = {
+    "ocr": ("detection", "ocr"),
+    # Cells are found by text detection and read by OCR
+    "tables": ("detection", "ocr", "table_rec"),
+    "equations": ("texify",),
+}
+
+# Models PDF_QUANTIZE applies to, texify keeps full precision
+QUANTIZED_MODELS = ("layout", "order", "detection", "ocr", "table_rec")
+QUANTIZE_MODES = ("none", "int8", "bf16", "auto")
+
+# Load time and memory of each model loaded by this process, by name
+load_stats: Dict[str, Dict] = {}
+
+# Model calls that run at once, as many as the pdf pipeline has stages running models: detect_ocr,
+# layout_order and tables_equations
+INFERENCE_SLOTS = 3
+
+# Torch intra-op threads of the process, set along with torch's; read from torch on first use otherwise
+torch_threads: Optional[int] = None
+
+_slots = threading.BoundedSemaphore(INFERENCE_SLOTS)
+_locks: Dict[int, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def required_models(features: Sequence[str]) -> List[str]:
+    needed = set(CORE_MODELS)
+    for feature in features:
+        if feature not in FEATURE_MODELS:
+            raise ValueError(f"Invalid pdf feature: {feature}")
+        needed.update(FEATURE_MODELS[feature])
+    return [name for name in MODEL_NAMES if name in needed]
+
+
+def setup_model(name: str):
+    # marker imports torch and every model class, so only once something is loaded
+    from marker import models
+    return {
+        "texify": models.setup_texify_model,
+        "layout": models.setup_layout_model,
+        "order": models.setup_order_model,
+        "detection": models.setup_detection_model,
+        "ocr": models.setup_recognition_model,
+        "table_rec": models.setup_table_rec_model,
+    }[name]()
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU has bfloat16 instructions; without them bf16 matmuls are slower than float32 ones."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def resolve_quantize(mode: str) -> str:
+    """The precision a PDF_QUANTIZE mode stands for on this CPU."""
+    if mode == "auto":
+        return "bf16" if bf16_supported() else "int8"
+    return mode
+
+
+def autocast_dtype(mode: str):
+    """
+    The dtype model ops run in under autocast for a PDF_QUANTIZE mode, None for those that keep them
+    as they are. bf16 only casts the weights: surya builds some of its inputs in float32.
+    """
+    if resolve_quantize(mode) != "bf16":
+        return None
+    import torch
+    return torch.bfloat16
+
+
+def quantize_model(model, mode: str):
+    """The model in int8 or bf16 for CPU inference, changed in place so its processor stays attached."""
+    import torch
+    mode = resolve_quantize(mode)
+    if next(model.parameters()).device.type != "cpu":
+        print(f"Not quantizing a model on {model.device}")
+        return model, "none"
+    with torch.no_grad():
+        if mode == "bf16":
+            return model.to(torch.bfloat16), mode
+        # Dynamic quantization: linear weights stored in int8, activations quantized batch by batch
+        model = model.float()
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True), mode
+
+
+def weight_bytes(model) -> int:
+    """Size of the weights, with the int8 ones, which are packed outside the parameters."""
+    try:
+        state = model.state_dict()
+    except AttributeError:
+        return 0
+    total = 0
+    for value in state.values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if hasattr(tensor, "element_size"):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def load_model(name: str, quantize: str = "none"):
+    """Loads one model, recording how long it took and the memory it added."""
+    rss = current_rss_bytes()
+    start = time.perf_counter()
+    model = setup_model(name)
+    if quantize != "none" and name in QUANTIZED_MODELS:
+        model, quantize = quantize_model(model, quantize)
+    else:
+        quantize = "none"
+    stats = {
+        "seconds": time.perf_counter() - start,
+        "rss_bytes": max(0, current_rss_bytes() - rss),
+        "weight_bytes": weight_bytes(model),
+        "quantize": quantize,
+    }
+    load_stats[name] = stats
+    registry.set("extractor_model_load_seconds", stats["seconds"], description="Seconds taken to load each model", model=name)
+    registry.set("extractor_model_rss_bytes", stats["rss_bytes"], description="Resident memory added by loading each model", model=name)
+    registry.set("extractor_model_weight_bytes", stats["weight_bytes"], description="Size of the weights of each model", model=name)
+    print(f"Loaded {name} model in {stats['seconds']:.1f}s: {stats['weight_bytes'] / 1024 ** 2:.0f} MiB of weights, "
+          f"rss +{stats['rss_bytes'] / 1024 ** 2:.0f} MiB" + (f", {quantize}" if quantize != "none" else ""))
+    return model
+
+
+def thread_share() -> int:
+    """The torch threads of one of the model calls running at once."""
+    global torch_threads
+    with _locks_lock:
+        if torch_threads is None:
+            import torch
+            torch_threads = torch.get_num_threads()
+    return max(1, torch_threads // INFERENCE_SLOTS)
+
+
+def model_lock(model) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(id(model), threading.Lock())
+
+
+@contextmanager
+def model_call(*models):
+    """
+    Runs the body as the only caller of `models`, None for a disabled one, on a share of the torch threads.
+
+    surya keeps state of a call on the model, such as the decoder caches of OCR and table recognition,
+    and the pipeline stages of concurrent conversions share the models: each is called by one thread at
+    a time. Every calling thread starts its own pool of intra-op threads, so at most INFERENCE_SLOTS
+    calls run at once, each on its share of the threads.
+    """
+    import torch
+    share = thread_share()
+    # Locked in a fixed order, so calls to several models can't deadlock
+    distinct = {id(model): model for model in models if model is not None}
+    with ExitStack() as stack:
+        for key in sorted(distinct):
+            stack.enter_context(model_lock(distinct[key]))
+        stack.enter_context(_slots)
+        # Per thread: the pool of this thread's parallel ops
+        torch.set_num_threads(share)
+        yield
+
+
+class LazyModel:
+    """
+    Stands in for a model until it is first used, by attribute or call, which loads it.
+
+    Loaded after the workers are forked, such a model is not shared between them: each worker that
+    needs it holds its own copy.
+    """
+    def __init__(self, name: str, quantize: str = "none"):
+        self.name = name
+        self.quantize = quantize
+        self.model = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    def get(self):
+        if self.model is None:
+            # Windows of concurrent conversions can reach it together
+            with self.lock:
+                if self.model is None:
+                    self.model = load_model(self.name, self.quantize)
+        return self.model
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+def load_models(features: Sequence[str], lazy: Sequence[str] = (), quantize: str = "none") -> List[Optional[object]]:
+    """
+    The models list for custom_convert_pdf: the models `features` need, loaded now unless named in
+    `lazy`, and None in place of the others. `quantize` is one of QUANTIZE_MODES.
+    """
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError(f"Invalid quantization: {quantize}")
+    for name in lazy:
+        if name not in MODEL_NAMES:
+            raise ValueError(f"Invalid model: {name}")
+    needed = required_models(features)
+    models = []
+    for name in MODEL_NAMES:
+        if name not in needed:
+            models.append(None)
+        elif name in lazy:
+            models.append(LazyModel(name, quantize))
+        else:
+            models.append(load_model(name, quantize))
+    loaded = [name for name in needed if name not in lazy]
+    total = sum(load_stats[name]["seconds"] for name in loaded)
+    print(f"Loaded {', '.join(loaded)} in {total:.1f}s; deferred: {', '.join(n for n in needed if n in lazy) or 'none'}; "
+          f"skipped: {', '.join(n for n in MODEL_NAMES if n not in needed) or 'none'}")
+    return models
@@ -1,15 +1,19 @@
 import json
 import os
-from re import S
-from typing import Dict, List
+import tempfile
+import time
 import dotenv
-import base64
-import io
 
 dotenv.load_dotenv()
 
-from marker.models import load_all_models
+import pypdfium2 as pdfium
+from PIL import Image, ImageDraw
 from extractor.pdf_convertor.convert import custom_convert_pdf
+from extractor.config import extractor_cfg
+from extractor.cancel import check_cancelled
+from extractor.images import ImageEncoder, ImageOptions
+from extractor.pdf_convertor.render import pdfium_lock
+from extractor import models
 
 model_lst = []
 
@@ -19,40 +23,87 @@ def load_models():
       model_lst = []
     else:
       if len(model_lst)==0:
-        model_lst = load_all_models()
+        # Only the models of the enabled features, the lazy ones load on first use
+        model_lst = models.load_models(extractor_cfg.pdf_features, extractor_cfg.lazy_models, extractor_cfg.quantize)
     return model_lst
 
-def convert_image_to_base64(image):
-    """Converts a PIL Image to a base64 string."""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG") # or whichever format is appropriate
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
+def warmup_page(path):
+  # A scanned page without a text layer, so it goes through detection and OCR as well as layout and order
+  image = Image.new("RGB", (1275, 1650), "white")
+  draw = ImageDraw.Draw(image)
+  draw.text((150, 150), "Warm-up", fill="black", font_size=64)
+  for line in range(12):
+    draw.text((150, 300 + line * 50), "The quick brown fox jumps over the lazy dog. 0123456789", fill="black", font_size=32)
+  for row in range(5):
+    draw.line((150, 950 + row * 60, 1125, 950 + row * 60), fill="black", width=2)
+    for column in range(4):
+      draw.text((170 + column * 240, 965 + row * 60), f"cell {row}.{column}", fill="black", font_size=28)
+  image.save(path, "PDF", resolution=150)
 
-def convert_to_img_list(imgs: Dict) -> List:
-  img_list = list()
-  for img_name in imgs:
-    img_list.append({
-        "name": img_name,
-        "content": convert_image_to_base64(imgs[img_name])})
-  return img_list
+def warm_up():
+  """
+  Converts a tiny synthetic page, so that torch's lazy initialisation is paid before the first request.
+  Run it in each worker after forking: the parent must not run inference. Lazy models stay unloaded.
+  """
+  if len(model_lst) == 0:
+    return
+  start = time.perf_counter()
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "warmup.pdf")
+    warmup_page(path)
+    for _ in convert_pdf(path, image_options=ImageOptions(enabled=False)):
+      pass
+  print(f"Warmed up in {time.perf_counter() - start:.1f}s")
+
+def count_pages(fpath) -> int:
+  with pdfium_lock:
+    doc = pdfium.PdfDocument(fpath)
+    try:
+      return len(doc)
+    finally:
+      doc.close()
 
-def convert_pdf(fpath):
+def convert_pdf(fpath, fast=False, table_formats=None, start_page=0, max_pages=None, image_options=None, profile=None, cancel=None):
   metadata = dict()
+  image_options = image_options or ImageOptions()
 
   if len(model_lst) == 0:
     abs = os.path.abspath(os.path.dirname(__file__))
     with open(f"{abs}/responses.json", "r") as f:
       data = json.load(f)
       for response in data:
-        yield response
+        pnum = response.get("pnum", start_page)
+        if pnum >= start_page and (max_pages is None or pnum < start_page + max_pages):
+          if extractor_cfg.mock_page_seconds and response.get("pnum") is not None:
+            time.sleep(extractor_cfg.mock_page_seconds)
+            check_cancelled(cancel)
+          yield response
   else:
-    for text, images, meta, tables, pnum, message in custom_convert_pdf(fpath, model_lst):
+    for text, images, meta, tables, pnum, message in custom_convert_pdf(
+        fpath,
+        model_lst,
+        max_pages=max_pages,
+        start_page=start_page or None,
+        batch_multiplier=extractor_cfg.batch_multiplier,
+        batch_pages=extractor_cfg.batch_pages,
+        prefetch_pages=extractor_cfg.prefetch_pages,
+        fast=fast,
+        table_formats=table_formats,
+        include_images=image_options.enabled,
+        encode_images=ImageEncoder(image_options).encode,
+        queue_size=extractor_cfg.queue_size,
+        autocast_dtype=models.autocast_dtype(extractor_cfg.quantize),
+        profile=profile,
+        cancel=cancel):
+      text_layer = meta['text_layer']['pages'].get(pnum, False)
+      # Page numbers restart at 0 from start_page
+      pnum += start_page
       page = {
           'page': pnum,
           'text': text,
-          'images': convert_to_img_list(images),
-          'tables': tables
+          'images': images,
+          'tables': tables,
+          'text_layer': text_layer
           }
       if pnum == 0:
         metadata['languages'] = meta['languages']
@@ -1,22 +1,22 @@
 import warnings
 
-from marker.pdf.images import render_image
-
 warnings.filterwarnings("ignore", category=UserWarning) # Filter torch pytree user warnings
 
 import os
+import time
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1" # For some reason, transformers decided to use .isin for a simple op, which is not supported on MPS
 
 
 import pypdfium2 as pdfium # Needs to be at the top to avoid warnings
+import torch
 from PIL import Image
 
 from marker.utils import flush_cuda_memory
 from marker.debug.data import dump_bbox_debug_data, draw_page_debug_images
-from marker.layout.layout import surya_layout, annotate_block_types
-from marker.layout.order import surya_order, sort_blocks_in_reading_order
+from marker.layout.layout import surya_layout, annotate_block_types, get_batch_size as get_layout_batch_size
+from marker.layout.order import surya_order, sort_blocks_in_reading_order, get_batch_size as get_order_batch_size
 from marker.ocr.lang import replace_langs_with_codes, validate_langs
-from marker.ocr.detection import surya_detection
+from marker.ocr.detection import surya_detection, get_batch_size as get_detector_batch_size
 from marker.ocr.recognition import run_ocr
 from marker.pdf.extract_text import get_text_blocks
 from marker.cleaners.headers import filter_header_footer, filter_common_titles
@@ -31,11 +31,53 @@ from marker.cleaners.text import cleanup_text
 from marker.images.extract import extract_images
 from marker.images.save import images_to_dict
 from marker.cleaners.toc import compute_toc
+from marker.schema.page import Page
 
-from typing import Generator, List, Dict, Tuple, Optional
+from typing import Callable, Generator, List, Dict, Tuple, Optional, Sequence
 from marker.settings import settings
 
-from extractor.pdf_convertor.tables import format_table_in_page
+from extractor.pdf_convertor.tables import format_tables, DEFAULT_TABLE_FORMATS
+from extractor.cancel import CancelToken, check_cancelled
+from extractor.metrics import Profile, add_stats, maybe_stage
+from extractor.models import model_call
+from extractor.pdf_convertor.pipeline import Pipeline
+from extractor.pdf_convertor.render import LockedPage, pdfium_lock, render_window
+from extractor.pdf_convertor.textlayer import has_usable_text_layer, text_lines_from_text_layer
+
+# Stages that hold the rendered images of a window, from rendering until tables are read
+IMAGE_STAGES = ("render", "detect_ocr", "layout_order", "tables_equations")
+
+
+class DocWindow:
+    """
+    Read-only view over a PdfDocument so that position i in a page sublist maps to the right pdf page.
+
+    marker's batched helpers (run_ocr, replace_equations, extract_images) index the document by the
+    position of each page in the list they are given, not by page.pnum. Pages are handed out as
+    LockedPages, so those helpers hold pdfium_lock only while rendering.
+    """
+    def __init__(self, doc, start: int, idxs: Optional[List[int]] = None):
+        self.doc = doc
+        self.start = start
+        self.idxs = idxs
+
+    def __len__(self):
+        if self.idxs is not None:
+            return len(self.idxs)
+        return len(self.doc) - self.start
+
+    def __getitem__(self, idx: int) -> LockedPage:
+        if self.idxs is not None:
+            idx = self.idxs[idx]
+        with pdfium_lock:
+            return LockedPage(self.doc[self.start + idx])
+
+
+def get_window_size(batch_multiplier: int = 1) -> int:
+    """Number of pages pushed through each model together, sized so that no model splits a window into several batches."""
+    batch_size = min(get_detector_batch_size(), get_layout_batch_size(), get_order_batch_size())
+    return max(1, int(batch_size * batch_multiplier))
+
 
 def custom_convert_pdf(
         fname: str,
@@ -45,11 +87,20 @@ def custom_convert_pdf(
         metadata: Optional[Dict] = None,
         langs: Optional[List[str]] = None,
         batch_multiplier: int = 1,
-        ocr_all_pages: bool = False
+        ocr_all_pages: bool = False,
+        batch_pages: Optional[int] = None,
+        prefetch_pages: Optional[int] = None,
+        fast: bool = False,
+        table_formats: Optional[Sequence[str]] = None,
+        include_images: bool = True,
+        encode_images: Optional[Callable[[Dict[str, Image.Image]], object]] = None,
+        queue_size: int = 1,
+        autocast_dtype: Optional[torch.dtype] = None,
+        profile: Optional[Profile] = None,
+        cancel: Optional[CancelToken] = None
 ) -> Generator[Tuple[str, Dict[str, Image.Image], Dict, Dict, int], None, None]:
-    message = "success"
-
     ocr_all_pages = ocr_all_pages or settings.OCR_ALL_PAGES
+    table_formats = DEFAULT_TABLE_FORMATS if table_formats is None else table_formats
 
     if metadata:
         langs = metadata.get("languages", langs)
@@ -70,107 +121,342 @@ def custom_convert_pdf(
         yield "", {}, out_meta
         return
 
-    # Get initial text blocks from the pdf
-    doc = pdfium.PdfDocument(fname)
-    pages, toc = get_text_blocks(
-        doc,
-        fname,
-        max_pages=max_pages,
-        start_page=start_page
-    )
+    check_cancelled(cancel)
+
+    # Get initial text blocks from the pdf, locked as other jobs may be converting in this process
+    with maybe_stage(profile, "text_blocks"), pdfium_lock:
+        doc = pdfium.PdfDocument(fname)
+        pages, toc = get_text_blocks(
+            doc,
+            fname,
+            max_pages=max_pages,
+            start_page=start_page
+        )
     out_meta.update({
         "pdf_toc": toc,
         "pages": len(pages),
+        "text_layer": {
+            "forced": fast,
+            "pages": {},
+            "fast_pages": 0,
+            "ocr_pages": 0,
+            "ocr_seconds": 0.0,
+            "saved_seconds": None,
+        },
     })
 
     # Trim pages from doc to align with start page
     if start_page:
-        for page_idx in range(start_page):
-            doc.del_page(0)
+        with pdfium_lock:
+            for page_idx in range(start_page):
+                doc.del_page(0)
 
     max_len = min(len(pages), len(doc))
-    lowres_images = [render_image(doc[pnum], dpi=settings.SURYA_DETECTOR_DPI) for pnum in range(max_len)]
-
-    # Unpack models from list
-    texify_model, layout_model, order_model, detection_model, ocr_model, table_rec_model = model_lst
-
-    for pnum, (page, lowres_image) in enumerate(zip(pages, lowres_images)):
-        # Identify text lines, layout, reading order
-        surya_detection([lowres_image], [page], detection_model, batch_multiplier=batch_multiplier)
-
-        # OCR for the page
-        [page], ocr_stats = run_ocr(doc, [page], langs, ocr_model, batch_multiplier=batch_multiplier, ocr_all_pages=ocr_all_pages)
-        flush_cuda_memory()
-        out_meta["ocr_stats"] = ocr_stats
-
-        if len([b for b in page.blocks]) == 0:
-            message = f"Could not extract any text blocks for page {pnum + 1} in {fname}"
-            yield "", {}, out_meta, [], pnum, message
-            continue
+    window_size = batch_pages or get_window_size(batch_multiplier)
+
+    conversion = PdfConversion(
+        fname, doc, model_lst, langs, out_meta,
+        batch_multiplier=batch_multiplier,
+        ocr_all_pages=ocr_all_pages,
+        fast=fast,
+        page_offset=start_page or 0,
+        table_formats=table_formats,
+        include_images=include_images,
+        encode_images=encode_images,
+        autocast_dtype=autocast_dtype,
+        profile=profile,
+        cancel=cancel
+    )
+    windows = (
+        Window(window_start, pages[window_start:min(window_start + window_size, max_len)])
+        for window_start in range(0, max_len, window_size)
+    )
 
-        surya_layout([lowres_image], [page], layout_model, batch_multiplier=batch_multiplier)
+    # Rendered pages wait ahead of inference, one window by default. At most the prefetched windows
+    # and one per stage that uses them have images resident, whatever the queues between those stages
+    prefetch_windows = -(-(prefetch_pages or window_size) // window_size)
+    pipeline = Pipeline(conversion.stages(), capacity=queue_size, capacities={"detect_ocr": prefetch_windows},
+                        span=(IMAGE_STAGES[0], IMAGE_STAGES[-1], prefetch_windows + len(IMAGE_STAGES)))
+    for window in pipeline.run(windows):
+        out_meta["pipeline"] = pipeline.stats()
+        for result in window.results:
+            yield result
+
+    if profile is not None:
+        text_layer = {k: v for k, v in out_meta["text_layer"].items() if k != "pages"}
+        profile.metadata.update({
+            "pages": out_meta["pages"],
+            "text_layer": text_layer,
+            "ocr_stats": out_meta.get("ocr_stats_total", {}),
+            "block_stats": out_meta.get("block_stats_total", {}),
+            "pipeline": out_meta.get("pipeline", {}),
+            "computed_toc": out_meta.get("computed_toc", []),
+        })
+
+
+def has_equations(pages: List[Page]) -> bool:
+    """Whether layout found formulas, which replace_equations sends to texify."""
+    return any(box.label == "Formula" for page in pages for box in page.layout.bboxes)
+
+
+class Window:
+    """A run of consecutive pages that goes through every stage together."""
+    def __init__(self, start: int, pages: List[Page]):
+        self.start = start
+        self.pages = pages
+        self.images = None
+        # Positions of the pages that have text blocks, the others skip every model after OCR
+        self.idxs = []
+        self.ocr_stats = None
+        self.block_stats = {}
+        self.bad_span_ids = []
+        self.tables = {}
+        self.results = []
+
+
+class PdfConversion:
+    """
+    The stages of a pdf conversion, each taking and returning a Window.
+
+    Stages run concurrently on different windows. Models are called under model_call, as tables reuse
+    the detection and OCR models from another stage than detection and OCR, and concurrent conversions
+    share them all. pdfium_lock is held only for pdfium calls, rendering and the text layer, never
+    across inference.
+    """
+    def __init__(self, fname, doc, model_lst: List, langs, out_meta: Dict, batch_multiplier: int = 1,
+                 ocr_all_pages: bool = False, fast: bool = False, page_offset: int = 0,
+                 table_formats: Sequence[str] = DEFAULT_TABLE_FORMATS, include_images: bool = True,
+                 encode_images: Optional[Callable] = None, autocast_dtype: Optional[torch.dtype] = None,
+                 profile: Optional[Profile] = None, cancel: Optional[CancelToken] = None):
+        self.fname = fname
+        self.doc = doc
+        # Unpack models from list, None for those of disabled features
+        self.texify_model, self.layout_model, self.order_model, self.detection_model, self.ocr_model, self.table_rec_model = model_lst
+        self.langs = langs
+        self.out_meta = out_meta
+        self.batch_multiplier = batch_multiplier
+        self.ocr_all_pages = ocr_all_pages
+        self.fast = fast
+        self.page_offset = page_offset
+        self.table_formats = table_formats
+        self.include_images = include_images
+        self.encode_images = encode_images
+        # Set for bf16 weights, which would otherwise be fed float32 inputs
+        self.autocast_dtype = autocast_dtype
+        self.profile = profile
+        self.cancel = cancel
+
+    def stages(self) -> List[Tuple[str, Callable[[Window], Window]]]:
+        stages = [
+            ("render", self.render),
+            ("detect_ocr", self.detect_ocr),
+            ("layout_order", self.layout_order),
+            ("tables_equations", self.tables_equations),
+            ("text", self.assemble_text),
+            ("images", self.encode_page_images),
+        ]
+        # Grad mode is per thread, and each stage runs in a thread of the pipeline
+        stages = [(name, self.inference(fn)) for name, fn in stages]
+        if self.cancel is not None:
+            stages = [(name, self.checked(fn)) for name, fn in stages]
+        if self.profile is None:
+            return stages
+        return [(name, self.profile.wrap(name, fn)) for name, fn in stages]
+
+    def inference(self, fn: Callable[[Window], Window]) -> Callable[[Window], Window]:
+        # No autograd bookkeeping: tensors skip version counting and views skip tracking
+        def stage(window: Window) -> Window:
+            with torch.inference_mode(), torch.autocast("cpu", dtype=self.autocast_dtype, enabled=self.autocast_dtype is not None):
+                return fn(window)
+        return stage
+
+    def checked(self, fn: Callable[[Window], Window]) -> Callable[[Window], Window]:
+        # A cancelled request stops the pipeline before its next stage, which ends the conversion
+        def stage(window: Window) -> Window:
+            self.cancel.check()
+            return fn(window)
+        return stage
+
+    def render(self, window: Window) -> Window:
+        window.images = render_window(self.doc, window.start, len(window.pages))
+        return window
+
+    def detect_ocr(self, window: Window) -> Window:
+        # Born-digital pages keep their embedded text and skip the detection and OCR models, as do all
+        # pages without OCR
+        no_ocr = self.detection_model is None or self.ocr_model is None
+        fast_idxs = [
+            i for i, page in enumerate(window.pages)
+            if self.fast or no_ocr or (not self.ocr_all_pages and has_usable_text_layer(page))
+        ]
+        for i in fast_idxs:
+            window.pages[i].text_lines = text_lines_from_text_layer(window.pages[i], window.images[i])
+        ocr_idxs = [i for i in range(len(window.pages)) if i not in fast_idxs]
+
+        if len(ocr_idxs) > 0:
+            ocr_start = time.perf_counter()
+            ocr_pages = [window.pages[i] for i in ocr_idxs]
+
+            # Identify text lines
+            with model_call(self.detection_model):
+                surya_detection([window.images[i] for i in ocr_idxs], ocr_pages, self.detection_model, batch_multiplier=self.batch_multiplier)
+
+            # OCR, marker indexes doc by position in the page list so give it a view aligned with these pages
+            with model_call(self.ocr_model):
+                ocr_pages, window.ocr_stats = run_ocr(DocWindow(self.doc, window.start, ocr_idxs), ocr_pages, self.langs, self.ocr_model, batch_multiplier=self.batch_multiplier, ocr_all_pages=self.ocr_all_pages)
+            flush_cuda_memory()
+
+            for i, page in zip(ocr_idxs, ocr_pages):
+                window.pages[i] = page
+            self.out_meta["text_layer"]["ocr_seconds"] += time.perf_counter() - ocr_start
+
+        update_text_layer_stats(self.out_meta["text_layer"], window.start, fast_idxs, ocr_idxs)
+
+        # Pages without any text blocks are reported as-is and skip the remaining models
+        window.idxs = [i for i, page in enumerate(window.pages) if len(page.blocks) > 0]
+        return window
+
+    def layout_order(self, window: Window) -> Window:
+        if len(window.idxs) == 0:
+            return window
+        text_pages = [window.pages[i] for i in window.idxs]
+        text_images = [window.images[i] for i in window.idxs]
+
+        with model_call(self.layout_model):
+            surya_layout(text_images, text_pages, self.layout_model, batch_multiplier=self.batch_multiplier)
 
         # Find headers and footers
-        bad_span_ids = filter_header_footer([page])
-        out_meta["block_stats"] = {"header_footer": len(bad_span_ids)}
+        window.bad_span_ids = filter_header_footer(text_pages)
+        window.block_stats["header_footer"] = len(window.bad_span_ids)
 
         # Add block types from layout
-        annotate_block_types([page])
+        annotate_block_types(text_pages)
 
         # Sort from reading order
-        surya_order([lowres_image], [page], order_model, batch_multiplier=batch_multiplier)
-        sort_blocks_in_reading_order([page])
+        with model_call(self.order_model):
+            surya_order(text_images, text_pages, self.order_model, batch_multiplier=self.batch_multiplier)
+        sort_blocks_in_reading_order(text_pages)
 
         # Dump debug data if flags are set
-        draw_page_debug_images(fname, [page])
-        dump_bbox_debug_data(fname, [page])
+        draw_page_debug_images(self.fname, text_pages)
+        dump_bbox_debug_data(self.fname, text_pages)
 
         # Fix code blocks
-        code_block_count = identify_code_blocks([page])
-        out_meta["block_stats"]["code"] = code_block_count
-        indent_blocks([page])
-
-        # Fix table blocks
-        table_count, table_data = format_table_in_page(page, doc, fname, detection_model, table_rec_model, ocr_model)
-        out_meta["block_stats"]["table"] = table_count
-
-        for block in page.blocks:
-            block.filter_spans(bad_span_ids)
-            block.filter_bad_span_types()
-
-        filtered, eq_stats = replace_equations(
-            doc,
-            [page],
-            texify_model,
-            batch_multiplier=batch_multiplier
-        )
-        flush_cuda_memory()
-        out_meta["block_stats"]["equations"] = eq_stats
-
-        # Extract images and figures if enabled
-        if settings.EXTRACT_IMAGES:
-            extract_images([doc[pnum]], [page])
-
-        # Split out headers
-        split_heading_blocks([page])
-        infer_heading_levels([page])
-        find_bold_italic([page])
-
-        # Use headers to compute a table of contents
-        out_meta["computed_toc"] = compute_toc([page])
-
-        # Copy to avoid changing original data
-        merged_lines = merge_spans(filtered)
-        text_blocks = merge_lines(merged_lines)
-        text_blocks = filter_common_titles(text_blocks)
-        full_text = get_full_text(text_blocks)
-
-        # Handle empty blocks being joined
-        full_text = cleanup_text(full_text)
-
-        # Replace bullet characters with a -
-        full_text = replace_bullets(full_text)
-
-        doc_images = images_to_dict([page])
-
-        yield full_text, doc_images, out_meta, table_data, pnum, message
\ No newline at end of file
+        window.block_stats["code"] = identify_code_blocks(text_pages)
+        indent_blocks(text_pages)
+        return window
+
+    def tables_equations(self, window: Window) -> Window:
+        if len(window.idxs) > 0:
+            text_pages = [window.pages[i] for i in window.idxs]
+            text_doc = DocWindow(self.doc, window.start, window.idxs)
+
+            # Fix table blocks, for all pages of the window at once
+            if self.table_rec_model is not None:
+                table_count, page_tables = format_tables(
+                    text_pages,
+                    text_doc,
+                    self.fname,
+                    [self.page_offset + window.start + i for i in window.idxs],
+                    self.detection_model,
+                    self.table_rec_model,
+                    self.ocr_model,
+                    table_formats=self.table_formats,
+                    profile=self.profile
+                )
+            else:
+                table_count, page_tables = 0, [[] for _ in window.idxs]
+            window.tables = dict(zip(window.idxs, page_tables))
+            window.block_stats["table"] = table_count
+
+            for page in text_pages:
+                for block in page.blocks:
+                    block.filter_spans(window.bad_span_ids)
+                    block.filter_bad_span_types()
+
+            # Only windows with formulas touch texify, which a lazy model loads on
+            if self.texify_model is not None and has_equations(text_pages):
+                # texify is not quantized, and keeps its float32 ops
+                with model_call(self.texify_model), torch.autocast("cpu", enabled=False):
+                    text_pages, eq_stats = replace_equations(
+                        text_doc,
+                        text_pages,
+                        self.texify_model,
+                        batch_multiplier=self.batch_multiplier
+                    )
+                flush_cuda_memory()
+            else:
+                eq_stats = {"successful_ocr": 0, "unsuccessful_ocr": 0, "equations": 0}
+            window.block_stats["equations"] = eq_stats
+
+            # Extract images and figures if enabled
+            if settings.EXTRACT_IMAGES and self.include_images:
+                extract_images(text_doc, text_pages)
+
+            # Split out headers
+            split_heading_blocks(text_pages)
+            infer_heading_levels(text_pages)
+            find_bold_italic(text_pages)
+
+        # Rendered pages are not needed past this point
+        window.images = None
+        return window
+
+    def assemble_text(self, window: Window) -> Window:
+        for offset, page in enumerate(window.pages):
+            pnum = window.start + offset
+            if len(page.blocks) == 0:
+                message = f"Could not extract any text blocks for page {pnum + 1} in {self.fname}"
+                window.results.append(["", {}, self.out_meta, [], pnum, message])
+                continue
+
+            # Use headers to compute a table of contents, pages carry their number in the document
+            self.out_meta.setdefault("computed_toc", []).extend(compute_toc([page]))
+
+            full_text, doc_images = get_page_text(page)
+            window.results.append([full_text, doc_images, self.out_meta, window.tables[offset], pnum, "success"])
+
+        # The latest window's stats, plus totals over the document
+        if window.ocr_stats is not None:
+            self.out_meta["ocr_stats"] = window.ocr_stats
+            add_stats(self.out_meta.setdefault("ocr_stats_total", {}), window.ocr_stats)
+        if len(window.idxs) > 0:
+            self.out_meta["block_stats"] = window.block_stats
+            add_stats(self.out_meta.setdefault("block_stats_total", {}), window.block_stats)
+        return window
+
+    def encode_page_images(self, window: Window) -> Window:
+        for result in window.results:
+            if self.encode_images is not None:
+                result[1] = self.encode_images(result[1])
+        window.results = [tuple(result) for result in window.results]
+        return window
+
+
+def update_text_layer_stats(stats: Dict, window_start: int, fast_idxs: List[int], ocr_idxs: List[int]):
+    for i in fast_idxs:
+        stats["pages"][window_start + i] = True
+    for i in ocr_idxs:
+        stats["pages"][window_start + i] = False
+    stats["fast_pages"] += len(fast_idxs)
+    stats["ocr_pages"] += len(ocr_idxs)
+
+    # Estimate the time saved from what detection and OCR cost per page on this document
+    if stats["ocr_pages"] > 0:
+        stats["saved_seconds"] = stats["fast_pages"] * stats["ocr_seconds"] / stats["ocr_pages"]
+
+
+def get_page_text(page: Page) -> Tuple[str, Dict[str, Image.Image]]:
+    # Copy to avoid changing original data
+    merged_lines = merge_spans([page])
+    text_blocks = merge_lines(merged_lines)
+    text_blocks = filter_common_titles(text_blocks)
+    full_text = get_full_text(text_blocks)
+
+    # Handle empty blocks being joined
+    full_text = cleanup_text(full_text)
+
+    # Replace bullet characters with a -
+    full_text = replace_bullets(full_text)
+
+    return full_text, images_to_dict([page])
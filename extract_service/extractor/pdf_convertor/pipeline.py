@@ -0,0 +1,146 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+# Marks the end of the stream between stages
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StageQueue:
+    """Bounded queue between two stages that records how full it gets."""
+    def __init__(self, name: str, capacity: int, stopped: threading.Event):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.queue = queue.Queue(maxsize=self.capacity)
+        self.stopped = stopped
+        self.puts = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def put(self, item) -> bool:
+        # Poll so that a stopped pipeline can't leave a producer blocked on a full queue
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            depth = self.queue.qsize()
+            self.puts += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+            return True
+        return False
+
+    def get(self):
+        while not self.stopped.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def stats(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "items": self.puts,
+            "max_depth": self.max_depth,
+            "mean_depth": self.depth_total / self.puts if self.puts else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages, each on its own thread, connected by bounded queues.
+
+    Every stage has a single worker and handles items first in, first out, so items come out in the
+    order they went in. An exception in any stage stops the pipeline and is re-raised to the consumer.
+
+    `span` is (first, last, count): at most `count` items between the start of stage `first` and the
+    end of stage `last`, whatever the capacity of the queues between them.
+    """
+    def __init__(self, stages: List[Tuple[str, Callable]], capacity: int = 1, capacities: Optional[Dict[str, int]] = None,
+                 span: Optional[Tuple[str, str, int]] = None):
+        self.stages = stages
+        self.stopped = threading.Event()
+        # capacities overrides the size of the queue feeding the named stages
+        capacities = capacities or {}
+        self.queues = [StageQueue(name, capacities.get(name, capacity), self.stopped) for name, _ in stages]
+        self.output = StageQueue("output", capacity, self.stopped)
+        self.busy = {name: 0.0 for name, _ in stages}
+        self.span_first, self.span_last, count = span or (None, None, 0)
+        self.span = threading.Semaphore(max(1, count))
+        self.threads = []
+
+    def run(self, items: Iterable) -> Generator:
+        self.threads = [threading.Thread(target=self._feed, args=(items,), daemon=True)]
+        for i, (name, fn) in enumerate(self.stages):
+            outbox = self.queues[i + 1] if i + 1 < len(self.queues) else self.output
+            self.threads.append(threading.Thread(target=self._work, args=(name, fn, self.queues[i], outbox), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self.output.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield item
+        finally:
+            self.close()
+
+    def _feed(self, items: Iterable):
+        try:
+            for item in items:
+                if not self.queues[0].put(item):
+                    return
+            self.queues[0].put(_DONE)
+        except BaseException as e:
+            self.queues[0].put(_Failed(e))
+
+    def _work(self, name: str, fn: Callable, inbox: StageQueue, outbox: StageQueue):
+        while True:
+            item = inbox.get()
+            if item is _DONE or isinstance(item, _Failed):
+                outbox.put(item)
+                return
+            if name == self.span_first and not self._enter_span():
+                return
+            try:
+                start = time.perf_counter()
+                item = fn(item)
+                self.busy[name] += time.perf_counter() - start
+            except BaseException as e:
+                outbox.put(_Failed(e))
+                return
+            finally:
+                if name == self.span_last:
+                    self.span.release()
+            if not outbox.put(item):
+                return
+
+    def _enter_span(self) -> bool:
+        # Polled like the queues, a stopped pipeline leaves no stage waiting
+        while not self.stopped.is_set():
+            if self.span.acquire(timeout=0.1):
+                return True
+        return False
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self) -> Dict:
+        """Per stage, the busy time and the depth of the queue feeding it."""
+        return {
+            name: {"busy_seconds": self.busy[name], "queue": self.queues[i].stats()}
+            for i, (name, _) in enumerate(self.stages)
+        }
@@ -0,0 +1,42 @@
+import threading
+from typing import List
+
+from PIL import Image
+
+from marker.pdf.images import render_image
+from marker.settings import settings
+
+# pdfium is not thread-safe, even across documents. Every call into it, direct or through marker,
+# pdftext or a LockedPage, must hold this lock, and nothing else should: models run outside it.
+pdfium_lock = threading.RLock()
+
+
+class RenderedPage:
+    """A page already rendered, standing in for the pdfium bitmap marker calls to_pil() on."""
+    def __init__(self, image: Image.Image):
+        self.image = image
+
+    def to_pil(self) -> Image.Image:
+        return self.image
+
+
+class LockedPage:
+    """
+    A pdfium page whose render() holds pdfium_lock, for marker helpers that render the pages they
+    are given (OCR, equations, images, tables): only the rendering is serialized, not their models.
+    """
+    def __init__(self, page):
+        self.page = page
+
+    def render(self, **kwargs) -> RenderedPage:
+        with pdfium_lock:
+            return RenderedPage(self.page.render(**kwargs).to_pil())
+
+
+def render_window(doc, start: int, count: int, dpi: int = settings.SURYA_DETECTOR_DPI) -> List[Image.Image]:
+    """Renders `count` consecutive pages starting at `start`, releasing the lock between pages."""
+    images = []
+    for pnum in range(start, start + count):
+        with pdfium_lock:
+            images.append(render_image(doc[pnum], dpi=dpi))
+    return images
@@ -1,5 +1,4 @@
 from tqdm import tqdm
-from pypdfium2 import PdfDocument
 from tabled.assignment import assign_rows_columns
 from tabled.formats import formatter
 from tabled.inference.detection import merge_tables
@@ -11,68 +10,135 @@ from marker.pdf.images import render_image
 from marker.schema.bbox import rescale_bbox
 from marker.schema.block import Line, Span, Block
 from marker.schema.page import Page
-from typing import List
+from typing import List, Optional, Sequence
 from marker.ocr.recognition import get_batch_size as get_ocr_batch_size
 from marker.ocr.detection import get_batch_size as get_detector_batch_size
 
 from marker.settings import settings
-from marker.tables.table import get_table_boxes, get_batch_size
+from marker.tables.table import get_batch_size
 
-def format_table_in_page(page: Page, doc: PdfDocument, fname: str, detection_model, table_rec_model, ocr_model):
+from extractor.metrics import Profile, maybe_stage
+from extractor.models import model_call
+from extractor.pdf_convertor.render import pdfium_lock
+
+DEFAULT_TABLE_FORMATS = ("csv",)
+
+
+def get_page_table_boxes(page: Page) -> List[List[float]]:
+    """Table boxes found by the layout model on a page, in layout image coordinates."""
+    bbox = [b.bbox for b in page.layout.bboxes if b.label == "Table"]
+    if len(bbox) == 0:
+        return []
+
+    # Merge tables that are next to each other
+    bbox = merge_tables(bbox)
+    return list(filter(lambda b: b[3] - b[1] > 10 and b[2] - b[0] > 10, bbox))
+
+
+def format_tables(
+        pages: List[Page],
+        doc,
+        fname: str,
+        pdf_page_idxs: List[int],
+        detection_model,
+        table_rec_model,
+        ocr_model,
+        table_formats: Sequence[str] = DEFAULT_TABLE_FORMATS,
+        profile: Optional[Profile] = None
+):
     """
-    Processes and formats tables within a single page of a PDF document.
+    Recognizes and formats the tables of several pages with one batched call per model.
 
     Parameters:
-    - page (Page): The page object to process.
-    - doc (PdfDocument): The PDF document object.
+    - pages (List[Page]): The pages to process, after layout and reading order.
+    - doc: A view of the PDF document indexed by position in `pages`, whose pages lock their rendering.
     - fname (str): The filename of the PDF document.
-    - detection_model: The table detection model.
+    - pdf_page_idxs (List[int]): The index of each page in the original file, used to read its text layer.
+    - detection_model: The text detection model, used to find cells.
     - table_rec_model: The table recognition model.
     - ocr_model: The OCR model for text recognition.
+    - table_formats: The representations to include in the table data, "markdown", "csv" and/or "html";
+      with none, the tables are still written into the page text but no table data is returned.
+    - profile (Profile): Optional, records the time spent in each step.
 
     Returns:
-    - int: The number of tables detected and formatted on the page.
-    - list: Formatted data of tables on the page including markdown and CSV representations.
+    - int: The number of tables detected and formatted.
+    - list: Per page, the formatted data of its tables.
     """
+    page_table_data = [[] for _ in pages]
+
+    # Pages without table blocks are skipped before anything is rendered
+    page_boxes = [get_page_table_boxes(page) for page in pages]
+    table_page_idxs = [i for i, boxes in enumerate(page_boxes) if len(boxes) > 0]
+    if len(table_page_idxs) == 0:
+        return 0, page_table_data
+
+    table_imgs = []
+    table_boxes = []
+    img_sizes = []
+    page_sizes = {}
+    with maybe_stage(profile, "table_render"):
+        for i in table_page_idxs:
+            page = pages[i]
+            highres_img = render_image(doc[i], dpi=settings.SURYA_TABLE_DPI)
+            page_sizes[i] = highres_img.size
+            for bb in page_boxes[i]:
+                highres_bb = rescale_bbox(page.layout.image_bbox, [0, 0, highres_img.size[0], highres_img.size[1]], bb)
+                table_imgs.append(highres_img.crop(highres_bb))
+                table_boxes.append(highres_bb)
+                img_sizes.append(highres_img.size)
+
+        # Use the pdf text layer for cells, unless the page was OCRed and its text lines are not accurate
+        text_layer_idxs = [i for i in table_page_idxs if pages[i].ocr_method is None]
+        page_text_lines = {}
+        if len(text_layer_idxs) > 0:
+            # pdftext reads the file with pdfium
+            with pdfium_lock:
+                sel_text_lines = get_page_text_lines(
+                    fname,
+                    [pdf_page_idxs[i] for i in text_layer_idxs],
+                    [page_sizes[i] for i in text_layer_idxs],
+                )
+            page_text_lines = dict(zip(text_layer_idxs, sel_text_lines))
+        table_text_lines = [page_text_lines.get(i) for i in table_page_idxs for _ in page_boxes[i]]
+
     # Disable tqdm output for cell detection
     tqdm.disable = True
 
-    # Process table boxes, images, and necessary information for this page only
-    table_imgs, table_boxes, table_counts, table_text_lines, img_sizes = get_table_boxes([page], doc, fname)
-
     # Detect cells and identify regions needing OCR
-    cells, needs_ocr = get_cells(table_imgs, table_boxes, img_sizes, table_text_lines,
-                                 [detection_model, detection_model.processor],
-                                 detect_boxes=settings.OCR_ALL_PAGES,
-                                 detector_batch_size=get_detector_batch_size())
+    with maybe_stage(profile, "table_cells"), model_call(detection_model):
+        cells, needs_ocr = get_cells(table_imgs, table_boxes, img_sizes, table_text_lines,
+                                     [detection_model, detection_model.processor],
+                                     detect_boxes=settings.OCR_ALL_PAGES,
+                                     detector_batch_size=get_detector_batch_size())
     tqdm.disable = False
 
     # Recognize and assign cells within tables
-    table_rec = recognize_tables(table_imgs, cells, needs_ocr,
-                                 [table_rec_model, table_rec_model.processor, ocr_model, ocr_model.processor],
-                                 table_rec_batch_size=get_batch_size(),
-                                 ocr_batch_size=get_ocr_batch_size())
+    with maybe_stage(profile, "table_recognition"), model_call(table_rec_model, ocr_model):
+        table_rec = recognize_tables(table_imgs, cells, needs_ocr,
+                                     [table_rec_model, table_rec_model.processor, ocr_model, ocr_model.processor],
+                                     table_rec_batch_size=get_batch_size(),
+                                     ocr_batch_size=get_ocr_batch_size())
+        cells = [assign_rows_columns(tr, im_size) for tr, im_size in zip(table_rec, img_sizes)]
 
-    # Format tables as Markdown and CSV
-    cells = [assign_rows_columns(tr, im_size) for tr, im_size in zip(table_rec, img_sizes)]
-    table_md = [formatter("markdown", cell)[0] for cell in cells]
-    table_csv = [formatter("csv", cell)[0] for cell in cells]
-
-    # Initialize table data for the current page
     table_count = 0
-    page_table_data = []  # Data for tables on this specific page
+    table_start = 0
+    with maybe_stage(profile, "table_format"):
+        for i in table_page_idxs:
+            page_table_count = len(page_boxes[i])
+            page_cells = cells[table_start:table_start + page_table_count]
+            page_table_boxes = table_boxes[table_start:table_start + page_table_count]
+            table_count += insert_page_tables(pages[i], page_cells, page_table_boxes, page_sizes[i], page_table_data[i], table_formats)
+            table_start += page_table_count
+
+    return table_count, page_table_data
 
-    # If no tables detected, return early
-    page_table_count = table_counts[0]
-    if page_table_count == 0:
-        return 0, []
 
-    # Determine insertion points for each table block
+def insert_page_tables(page: Page, cells, page_table_boxes, highres_size, table_data: List, table_formats: Sequence[str]) -> int:
+    """Replaces the layout table blocks of a page with formatted tables, appending their data to `table_data`."""
     table_insert_points = {}
     blocks_to_remove = set()
     pnum = page.pnum
-    highres_size = img_sizes[0]
-    page_table_boxes = table_boxes[:page_table_count]
 
     # Identify blocks overlapping with table boxes
     for table_idx, table_box in enumerate(page_table_boxes):
@@ -89,20 +155,29 @@ def format_table_in_page(page: Page, doc: PdfDocument, fname: str, detection_mod
     new_page_blocks = [block for block_idx, block in enumerate(page.blocks) if block_idx not in blocks_to_remove]
 
     # Insert formatted tables into new page blocks at designated points
+    table_count = 0
     for table_idx, table_box in enumerate(page_table_boxes):
+        table_count += 1
         if table_idx not in table_insert_points:
-            table_count += 1
             continue
 
-        markdown = table_md[table_count]
-        csv_data = table_csv[table_count]
-
-        # Record table data for the page
-        page_table_data.append({
-            "table_index": table_idx,
-            "content": csv_data,
-            "bbox": table_box
-        })
+        # Markdown is always needed for the page text, other formats only when requested
+        formatted = {"markdown": formatter("markdown", cells[table_idx])[0]}
+        for table_format in table_formats:
+            if table_format not in formatted:
+                formatted[table_format] = formatter(table_format, cells[table_idx])[0]
+
+        # Record table data for the page, unless no format was requested
+        if len(table_formats) > 0:
+            data = {
+                "table_index": table_idx,
+                "content": formatted[table_formats[0]],
+                "format": table_formats[0],
+                "bbox": table_box
+            }
+            for table_format in table_formats[1:]:
+                data[table_format] = formatted[table_format]
+            table_data.append(data)
 
         # Create a new table block
         table_block = Block(
@@ -118,7 +193,7 @@ def format_table_in_page(page: Page, doc: PdfDocument, fname: str, detection_mod
                     font_size=0,
                     font_weight=0,
                     block_type="Table",
-                    text=markdown
+                    text=formatted["markdown"]
                 )]
             )]
         )
@@ -127,9 +202,8 @@ def format_table_in_page(page: Page, doc: PdfDocument, fname: str, detection_mod
         insert_point = table_insert_points[table_idx]
         insert_point = min(insert_point, len(new_page_blocks))
         new_page_blocks.insert(insert_point, table_block)
-        table_count += 1
-    table_data = page_table_data
 
     # Update page blocks with new content
     page.blocks = new_page_blocks
-    return table_count, table_data
\ No newline at end of file
+    return table_count
+
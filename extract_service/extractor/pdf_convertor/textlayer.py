@@ -0,0 +1,47 @@
+from PIL import Image
+from surya.schema import PolygonBox, TextDetectionResult
+
+from marker.ocr.heuristics import detect_bad_ocr
+from marker.schema.bbox import rescale_bbox
+from marker.schema.page import Page
+
+from extractor.config import extractor_cfg
+
+
+def has_usable_text_layer(page: Page, min_chars: int = None, min_line_ratio: float = None) -> bool:
+    """
+    Decides from the pdftext output alone whether a page's embedded text can be used without OCR.
+
+    A page qualifies when it carries enough text, that text does not look like garbled OCR, and most of
+    its lines actually contain characters (scans with a sparse invisible text layer fail this).
+    """
+    min_chars = extractor_cfg.text_layer_min_chars if min_chars is None else min_chars
+    min_line_ratio = extractor_cfg.text_layer_min_line_ratio if min_line_ratio is None else min_line_ratio
+
+    text = page.prelim_text
+    if len(text.strip()) < min_chars:
+        return False
+    if detect_bad_ocr(text):
+        return False
+
+    lines = page.get_all_lines()
+    if len(lines) == 0:
+        return False
+    return len(page.get_nonblank_lines()) / len(lines) >= min_line_ratio
+
+
+def text_lines_from_text_layer(page: Page, image: Image.Image) -> TextDetectionResult:
+    """Builds the detection result the layout model expects from the embedded text lines, in image coordinates."""
+    image_bbox = [0, 0, image.size[0], image.size[1]]
+    bboxes = []
+    for line in page.get_nonblank_lines():
+        x0, y0, x1, y1 = rescale_bbox(page.bbox, image_bbox, line.bbox)
+        bboxes.append(PolygonBox(polygon=[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], confidence=1.0))
+
+    return TextDetectionResult(
+        bboxes=bboxes,
+        vertical_lines=[],
+        heatmap=None,
+        affinity_map=None,
+        image_bbox=image_bbox
+    )
@@ -1,15 +1,44 @@
-from extractor.pdf import load_models, model_lst
-from rpc_server.server import start_server
+from extractor.config import extractor_cfg
+from extractor.metrics import clear_textfiles, registry
+from rpc_server.config import rpc_cfg
+from rpc_server.supervisor import pin_cores, run_workers, set_torch_threads, split_threads
 import traceback
 
 def main():
+    from rpc_server.server import start_server
+    # Nodes without pdfs never import torch: docx conversion doesn't need it
+    serves_pdf = 'pdf' in rpc_cfg.file_types
+    if rpc_cfg.metrics_dir:
+        clear_textfiles(rpc_cfg.metrics_dir)
     try:
-        model_lst = load_models()
-        print('Models loaded')
-        start_server()
+        torch_threads = None
+        if serves_pdf:
+            # Imported here, not at the top: docx pool processes import this module again, and must not load torch
+            from extractor.pdf import load_models, warm_up
+            # Size torch threads before the models load, so N workers x threads matches the cores
+            torch_threads = rpc_cfg.torch_threads or split_threads(rpc_cfg.workers)
+            set_torch_threads(torch_threads, rpc_cfg.torch_interop_threads)
+            load_models()
+            print('Models loaded')
+
+        def start_worker(index=0):
+            registry.worker = index
+            if serves_pdf:
+                if rpc_cfg.pin_cores:
+                    print(f'Worker {index} pinned to cores {pin_cores(index, torch_threads)}')
+                set_torch_threads(torch_threads, rpc_cfg.torch_interop_threads)
+                # In the worker, the parent must not run inference before forking
+                if extractor_cfg.warmup:
+                    warm_up()
+            start_server(rpc_cfg.file_types)
+
+        if rpc_cfg.workers > 1:
+            run_workers(rpc_cfg.workers, start_worker)
+        else:
+            start_worker()
     except Exception as e:
         print(f'Error: {e}')
         traceback.print_exc()
-    
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
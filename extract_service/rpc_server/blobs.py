@@ -0,0 +1,110 @@
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from typing import Optional
+
+from rpc_server.options import parse_int, parse_str
+
+def request_size(body: bytes, headers) -> int:
+    """Size of the file of a request, without touching the blob store."""
+    return parse_int((headers or {}).get('blob_size')) or len(body)
+
+class RequestFile:
+    """
+    The file of a request: the message body, or a file of the blob store that the backend writes
+    large uploads to, referenced by the 'blob', 'blob_sha256' and 'blob_size' headers.
+
+    Blobs are read in place from their path, so the file is never held in memory as a whole.
+    """
+    def __init__(self, body: bytes = b'', path: Optional[str] = None, sha256: Optional[str] = None, size: Optional[int] = None):
+        self.body = body
+        self.path = path
+        self.sha256 = sha256
+        self._size = size
+        self._digest = None
+
+    @classmethod
+    def from_message(cls, body: bytes, headers, directory: Optional[str]) -> 'RequestFile':
+        headers = headers or {}
+        name = parse_str(headers.get('blob'))
+        if name is None:
+            return cls(body)
+        if directory is None:
+            raise ValueError('Blob references are not enabled, set BLOB_DIR')
+        # A bare file name, so a reference can't point outside the store
+        if os.path.basename(name) != name or name.startswith('.'):
+            raise ValueError(f'Invalid blob reference: {name}')
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'Blob not found: {name}')
+        return cls(path=path, sha256=parse_str(headers.get('blob_sha256')), size=parse_int(headers.get('blob_size')))
+
+    @property
+    def size(self) -> int:
+        if self.path is None:
+            return len(self.body)
+        if self._size is None:
+            self._size = os.path.getsize(self.path)
+        return self._size
+
+    def digest(self) -> str:
+        """sha256 of the content. A blob is hashed through a memory map and checked against the hash it was sent with."""
+        if self._digest is not None:
+            return self._digest
+        if self.path is None:
+            self._digest = hashlib.sha256(self.body).hexdigest()
+            return self._digest
+
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                digest = hashlib.sha256()
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    digest = hashlib.sha256(data)
+        self._digest = digest.hexdigest()
+        if self.sha256 is not None and self._digest != self.sha256.lower():
+            raise ValueError(f'Blob {os.path.basename(self.path)} does not match its sha256')
+        return self._digest
+
+    def headers(self) -> dict:
+        """The headers referencing a blob, none for a file sent in the message."""
+        if self.path is None:
+            return {}
+        return {'blob': os.path.basename(self.path), 'blob_sha256': self.digest(), 'blob_size': self.size}
+
+    def to_blob(self, directory: str, name: str) -> 'RequestFile':
+        """
+        The file in the blob store: itself if it is already there, otherwise its body written under
+        `name`, so that messages about it carry a reference rather than a copy.
+        """
+        if self.path is not None:
+            return self
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(self.body)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        blob = RequestFile(path=path, sha256=self.digest(), size=len(self.body))
+        blob._digest = self._digest
+        return blob
+
+    def remove(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def source(self):
+        """What the converters open: the blob path, or the body in a file-like object."""
+        if self.path is not None:
+            return self.path
+        return io.BytesIO(self.body)
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import tempfile
+from importlib import metadata
+from typing import Dict, Iterator, Optional
+
+def package_version(name: str) -> Optional[str]:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+# Conversion settings read from the environment by marker and the extractor
+SETTINGS_ENV = (
+    'OCR_ALL_PAGES', 'OCR_ENGINE', 'EXTRACT_IMAGES', 'TORCH_DEVICE',
+    'TEXT_LAYER_MIN_CHARS', 'TEXT_LAYER_MIN_LINE_RATIO', 'PDF_FEATURES', 'PDF_QUANTIZE',
+)
+
+def conversion_settings(file_type: str, options) -> Dict:
+    """Everything besides the file bytes that can change the pages produced for a request."""
+    return {
+        'file_type': file_type,
+        'options': vars(options),
+        'env': {name: os.getenv(name) for name in SETTINGS_ENV},
+        'versions': {name: package_version(name) for name in ('marker-pdf', 'docx2md')},
+    }
+
+def request_key(file_digest: str, settings: Dict) -> str:
+    """Content address of a request: the sha256 of the file and the settings it is converted with."""
+    digest = hashlib.sha256(file_digest.encode())
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+# Share of max_bytes the entries are evicted down to once over it
+EVICT_TO = 0.9
+
+class CacheWriter:
+    """Collects the messages of one response and publishes them to the cache once complete."""
+    def __init__(self, cache, key: str):
+        self.cache = cache
+        self.key = key
+        self.file = tempfile.NamedTemporaryFile(dir=cache.directory, suffix='.tmp', delete=False)
+
+    def write(self, message: bytes):
+        # JSON messages never contain a raw newline, so one message per line
+        self.file.write(message)
+        self.file.write(b'\n')
+
+    def commit(self):
+        size = self.file.tell()
+        self.file.close()
+        path = self.cache.path(self.key)
+        try:
+            # An identical request may have stored it first
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(self.file.name, path)
+        self.cache.added(size - replaced, 0 if replaced else 1)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
+
+class ResultCache:
+    """
+    Page message streams stored on local disk, keyed by a hash of the file and its conversion settings.
+
+    Entries are evicted least recently used first once they take more than `max_bytes`. Several
+    worker processes can share a directory; writes are atomic renames.
+
+    The size and number of the entries are scanned from the directory at startup and when evicting,
+    and kept up to date by this process's commits in between, so the request path never lists the
+    directory. The entries other processes commit are counted from the next scan.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        entries = self.entries()
+        self.bytes = sum(size for _, size, _ in entries)
+        self.count = len(entries)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.jsonl')
+
+    def get(self, key: str) -> Optional[Iterator[bytes]]:
+        """The cached messages for `key`, or None on a miss."""
+        path = self.path(key)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        # Mark the entry as recently used
+        os.utime(path)
+        self.hits += 1
+        return self._replay(file)
+
+    def _replay(self, file) -> Iterator[bytes]:
+        with file:
+            for line in file:
+                self.bytes_served += len(line)
+                yield line.rstrip(b'\n')
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def writer(self, key: str) -> CacheWriter:
+        return CacheWriter(self, key)
+
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.jsonl'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def added(self, size: int, count: int):
+        self.bytes += size
+        self.count += count
+        if self.bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        if total <= self.max_bytes:
+            self.bytes, self.count = total, count
+            return
+        # Down to below the limit, so that a full cache isn't scanned again at the next commit
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            count -= 1
+            self.evictions += 1
+        self.bytes, self.count = total, count
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': self.count,
+            'bytes': self.bytes,
+            'bytes_served': self.bytes_served,
+            'evictions': self.evictions,
+        }
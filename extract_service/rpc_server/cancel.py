@@ -0,0 +1,68 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from extractor.cancel import CancelToken
+from rpc_server.options import parse_str
+
+# Fanout exchange the backend publishes cancels to, with the correlation id of the request
+CANCEL_EXCHANGE = 'extractor.cancel'
+# How long a cancel for a request this process has not received yet is kept, it may still be queued
+REMEMBER_SECONDS = 3600
+
+def header_time(headers, name: str) -> Optional[float]:
+    value = parse_str((headers or {}).get(name))
+    return float(value) if value not in (None, '') else None
+
+def request_deadline(headers) -> Optional[float]:
+    """The 'deadline' header, a unix timestamp after which the client no longer waits."""
+    return header_time(headers, 'deadline')
+
+def request_sent(headers) -> Optional[float]:
+    """The 'sent' header of a shard, when its coordinator published it."""
+    return header_time(headers, 'sent')
+
+def applies(before: Optional[float], sent: Optional[float]) -> bool:
+    # A cancel with 'sent_before' spares the messages published again under the same correlation id
+    return before is None or sent is None or sent < before
+
+class CancelRegistry:
+    """Cancel tokens of the jobs of this process by correlation id, shared by the lanes."""
+    def __init__(self):
+        self.active: Dict[str, List[Tuple[CancelToken, Optional[float]]]] = {}
+        # Correlation id -> (received at, sent_before) of cancels for jobs not received yet
+        self.early: Dict[str, Tuple[float, Optional[float]]] = {}
+
+    def open(self, correlation_id: str, deadline: Optional[float] = None, sent: Optional[float] = None) -> CancelToken:
+        token = CancelToken(deadline)
+        early = self.early.get(correlation_id)
+        if early is not None:
+            _, before = early
+            if applies(before, sent):
+                token.cancel()
+            # Other attempts sent before it may still be queued
+            if before is None:
+                del self.early[correlation_id]
+        self.active.setdefault(correlation_id, []).append((token, sent))
+        return token
+
+    def close(self, correlation_id: str, token: CancelToken):
+        tokens = [entry for entry in self.active.get(correlation_id, []) if entry[0] is not token]
+        if tokens:
+            self.active[correlation_id] = tokens
+        else:
+            self.active.pop(correlation_id, None)
+
+    def cancel(self, correlation_id: str, before: Optional[float] = None):
+        tokens = [token for token, sent in self.active.get(correlation_id, []) if applies(before, sent)]
+        if tokens:
+            print(f'Cancelling request {correlation_id}')
+            for token in tokens:
+                token.cancel()
+            if before is None:
+                return
+        # Not received yet: remember it, so the job is skipped when it's dequeued
+        now = time.time()
+        self.early[correlation_id] = (now, before)
+        for key, (at, _) in list(self.early.items()):
+            if now - at > REMEMBER_SECONDS:
+                del self.early[key]
@@ -0,0 +1,98 @@
+import json
+import os
+import time
+from typing import List, Optional
+
+class Checkpoint:
+    """Messages already published for one document, appended as they are produced."""
+    def __init__(self, path: str):
+        self.path = path
+        self._messages = None
+
+    def messages(self) -> List[bytes]:
+        """Complete messages in the checkpoint; a line cut short by a crash is dropped."""
+        if self._messages is None:
+            self._messages = []
+            try:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            for line in data.split(b'\n')[:-1]:
+                self._messages.append(line)
+            # Drop any partial trailing line before appending more
+            if data and not data.endswith(b'\n'):
+                with open(self.path, 'r+b') as f:
+                    f.truncate(len(data) - len(data.split(b'\n')[-1]))
+        return self._messages
+
+    def next_page(self) -> int:
+        """The first page that has no message yet."""
+        pnums = [json.loads(message).get('pnum') for message in self.messages()]
+        pnums = [pnum for pnum in pnums if pnum is not None]
+        return max(pnums) + 1 if pnums else 0
+
+    def page_count(self) -> Optional[int]:
+        for message in self.messages():
+            metadata = json.loads(message).get('metadata')
+            if metadata is not None:
+                return metadata.get('pages')
+        return None
+
+    def finished(self) -> bool:
+        pages = self.page_count()
+        return pages is not None and self.next_page() >= pages
+
+    def append(self, message: bytes):
+        with open(self.path, 'ab') as f:
+            f.write(message)
+            f.write(b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.messages().append(message)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self._messages = []
+
+class CheckpointStore:
+    """
+    Per-request checkpoints on local disk, so a redelivered job can resume where it stopped.
+
+    A redelivery keeps the correlation id of the message, so it finds its checkpoint, while identical
+    requests converted at the same time each write their own. Checkpoints whose redelivery never came,
+    the message expired or was rejected, are swept once they have not been written to for `max_age`
+    seconds: on startup, and every tenth of that while opening others.
+    """
+    def __init__(self, directory: str, max_age: Optional[float] = None):
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self.swept = 0.0
+        self.sweep()
+
+    def open(self, key: str, request_id: Optional[str] = None) -> Checkpoint:
+        if self.max_age and time.time() - self.swept > self.max_age / 10:
+            self.sweep()
+        name = key if not request_id else f'{key}.{safe_name(request_id)}'
+        return Checkpoint(os.path.join(self.directory, f'{name}.jsonl'))
+
+    def sweep(self):
+        """Removes the checkpoints older than max_age."""
+        if not self.max_age:
+            return
+        self.swept = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.jsonl') and entry.stat().st_mtime < self.swept - self.max_age:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Removed by the job that finished with it, or another worker's sweep
+                pass
+
+def safe_name(value: str) -> str:
+    """A correlation id set by the client, usable in a file name."""
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in value)
@@ -2,11 +2,74 @@ import os
 import dotenv
 dotenv.load_dotenv()
 
+class LaneConfig:
+    """Consumer settings of one queue, read from RPC_<FILE TYPE>_* variables."""
+    def __init__(self, file_type: str, concurrency: int, worker: str):
+        prefix = f'RPC_{file_type.upper()}'
+        self.file_type = file_type
+        # Jobs converted at once by this lane in each process
+        self.concurrency = int(os.getenv(f'{prefix}_CONCURRENCY') or concurrency)
+        # Unacknowledged messages held, jobs waiting for a slot start smallest first
+        self.prefetch = max(self.concurrency, int(os.getenv(f'{prefix}_PREFETCH') or 0))
+        # "thread" converts in the worker process, "process" in a pool of light processes without the models
+        self.worker = (os.getenv(f'{prefix}_WORKER') or worker).lower()
+        self.processes = int(os.getenv(f'{prefix}_PROCESSES') or self.concurrency)
+        if self.worker not in ('thread', 'process'):
+            raise ValueError(f'Invalid {prefix}_WORKER: {self.worker}')
+
 class RpcConfig:
     def __init__(self):
         self.host = os.getenv('RPC_HOST')
         self.port = os.getenv('RPC_PORT')   
         self.user = os.getenv('RPC_USER')
         self.password = os.getenv('RPC_PASSWORD')
+        # An independent lane per file type, so small docx jobs never wait behind long pdfs
+        self.lanes = {
+            'pdf': LaneConfig('pdf', concurrency=1, worker='thread'),
+            'docx': LaneConfig('docx', concurrency=2, worker='process'),
+        }
+        # File types this node serves; without pdf, workers never import torch or load models
+        file_types = [t.strip().lower() for t in (os.getenv('RPC_FILE_TYPES') or ','.join(self.lanes)).split(',') if t.strip()]
+        for file_type in file_types:
+            if file_type not in self.lanes:
+                raise ValueError(f'Invalid RPC_FILE_TYPES: {file_type}')
+        self.file_types = file_types
+        # Priority levels of the queues, small files are sent with a higher priority; off by default.
+        # The broker refuses to declare an existing queue with other arguments (PRECONDITION_FAILED), so
+        # enabling it means stopping the extractors, deleting the pdf, docx and shard queues, and
+        # starting them and the backends with the same RPC_MAX_PRIORITY.
+        self.max_priority = int(os.getenv('RPC_MAX_PRIORITY') or 0)
+        # Bytes of messages an in-flight conversion keeps for identical requests joining it late; past
+        # them, later requests convert the document again. 0 keeps them all
+        self.flight_history_bytes = int(os.getenv('RPC_FLIGHT_HISTORY_BYTES') or 64 * 1024 ** 2)
+        # Pdfs of at least this many pages are split into page ranges converted by any node; 0 disables it
+        self.shard_min_pages = int(os.getenv('RPC_SHARD_MIN_PAGES') or 0)
+        self.shard_pages = max(1, int(os.getenv('RPC_SHARD_PAGES') or 64))
+        # Shards of a document in flight at once, their pages wait on the coordinator; 0 sends all
+        self.shard_window = int(os.getenv('RPC_SHARD_WINDOW') or 8)
+        # Seconds without a message from the shard being streamed before the document fails; 0 waits forever
+        self.shard_timeout = float(os.getenv('RPC_SHARD_TIMEOUT') or 900)
+        # Seconds between AMQP heartbeats, unset uses the broker's
+        self.heartbeat = int(os.getenv('RPC_HEARTBEAT') or 0) or None
+        # Forked worker processes sharing the loaded models, 1 runs the server in the main process
+        self.workers = int(os.getenv('WORKERS') or 1)
+        # Torch intra-op threads per worker, defaults to the cores split evenly between workers. The pdf
+        # pipeline's model calls, up to one per stage running models, each get a third of them
+        self.torch_threads = int(os.getenv('TORCH_THREADS') or 0) or None
+        # Torch inter-op threads per worker, for the independent ops of one graph
+        self.torch_interop_threads = int(os.getenv('TORCH_INTEROP_THREADS') or 1)
+        # Restricts each worker to its own torch_threads cores, so workers don't share or migrate between cores
+        self.pin_cores = (os.getenv('TORCH_PIN_CORES') or '0') not in ('0', 'false', 'no')
+        # Directory of the result cache, unset disables caching
+        self.cache_dir = os.getenv('CACHE_DIR') or None
+        self.cache_max_bytes = int(os.getenv('CACHE_MAX_BYTES') or 1024 ** 3)
+        # Directory of per-page checkpoints for resuming redelivered pdf jobs, unset disables them
+        self.checkpoint_dir = os.getenv('CHECKPOINT_DIR') or None
+        # Seconds after which a checkpoint not written to is abandoned and removed, 0 keeps them
+        self.checkpoint_max_age = float(os.getenv('CHECKPOINT_MAX_AGE') or 24 * 3600)
+        # Directory shared with the backend, which writes large uploads there instead of sending them
+        self.blob_dir = os.getenv('BLOB_DIR') or None
+        # Directory for the node exporter textfile collector, unset disables metrics files
+        self.metrics_dir = os.getenv('METRICS_DIR') or None
     
 rpc_cfg = RpcConfig()
\ No newline at end of file
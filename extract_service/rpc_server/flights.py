@@ -0,0 +1,81 @@
+import asyncio
+from typing import List, Optional, Union
+
+from extractor.cancel import CancelToken
+from rpc_server.wire import page_images
+
+# Ends a follower's stream: the conversion finished, or was abandoned and must be retried
+DONE = 'done'
+ABANDONED = 'abandoned'
+
+class SharedCancelToken(CancelToken):
+    """Cancels a conversion shared by several requests once every one of them is cancelled."""
+    def __init__(self, tokens: List[CancelToken]):
+        super().__init__()
+        self.tokens = tokens
+
+    def cancelled(self) -> bool:
+        tokens = list(self.tokens)
+        if not self.event.is_set() and tokens and all(token.cancelled() for token in tokens):
+            self.cancel(tokens[-1].reason)
+        return self.event.is_set()
+
+def message_size(message: Union[bytes, dict]) -> int:
+    """Roughly the memory a message holds: stored JSON, or the text and images of a page."""
+    if isinstance(message, (bytes, bytearray)):
+        return len(message)
+    page = message.get('page')
+    if not isinstance(page, dict):
+        return 0
+    return len(page.get('text') or '') + sum(len(image['content'] or '') for image in page_images(message))
+
+class Flight:
+    """
+    One conversion shared by identical requests, the first of which runs it.
+
+    Every message produced is kept, the metadata included, so a request joining late is sent
+    those first and then follows along. Once they add up to more than `max_history` bytes they
+    are dropped, and requests arriving after that run a conversion of their own. Only touched
+    from the event loop.
+    """
+    def __init__(self, cancel: CancelToken, max_history: int = 0):
+        self.history: Optional[List[Union[bytes, dict]]] = []
+        self.history_bytes = 0
+        self.max_history = max_history
+        self.followers: List[asyncio.Queue] = []
+        self.cancel = SharedCancelToken([cancel])
+        self.ended = False
+
+    def joinable(self) -> bool:
+        """Whether a request joining now can still be sent every message from the first."""
+        return self.history is not None and not self.ended
+
+    def join(self, cancel: CancelToken) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        for message in self.history:
+            queue.put_nowait(message)
+        self.followers.append(queue)
+        self.cancel.tokens.append(cancel)
+        return queue
+
+    def leave(self, queue: asyncio.Queue):
+        if queue in self.followers:
+            self.followers.remove(queue)
+
+    def broadcast(self, message: Union[bytes, dict]):
+        if self.history is not None:
+            self.history_bytes += message_size(message)
+            if self.max_history and self.history_bytes > self.max_history:
+                self.history = None
+            else:
+                self.history.append(message)
+        for queue in self.followers:
+            queue.put_nowait(message)
+
+    def end(self, abandoned: bool = False):
+        if self.ended:
+            return
+        self.ended = True
+        self.history = []
+        for queue in self.followers:
+            queue.put_nowait(ABANDONED if abandoned else DONE)
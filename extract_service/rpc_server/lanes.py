@@ -0,0 +1,50 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+
+class PriorityLimit:
+    """
+    A semaphore whose waiters are let in smallest first, then in arrival order.
+
+    Jobs prefetched beyond a lane's concurrency wait here, so a small document that arrives behind
+    large ones still starts at the next free slot.
+    """
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.waiters = []
+        self.order = itertools.count()
+
+    async def acquire(self, size: int):
+        if self.slots > 0 and not self.waiters:
+            self.slots -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (size, next(self.order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Handed a slot just as it was cancelled: pass it on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, waiter = heapq.heappop(self.waiters)
+            # Cancelled waiters are left in the heap and skipped here
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.slots += 1
+
+    @asynccontextmanager
+    async def slot(self, size: int):
+        await self.acquire(size)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def waiting(self) -> int:
+        return sum(1 for _, _, waiter in self.waiters if not waiter.done())
@@ -0,0 +1,45 @@
+TABLE_FORMATS = ('markdown', 'csv', 'html')
+
+class RequestOptions:
+    """Per-request conversion options, sent by the backend as AMQP message headers."""
+    def __init__(self, headers=None):
+        headers = headers or {}
+        # Use the embedded text layer for every pdf page, skipping detection and OCR
+        self.fast = parse_bool(headers.get('fast'))
+        # Representations included in each table's data, e.g. "csv,markdown", or "none"
+        self.table_formats = parse_table_formats(parse_str(headers.get('table_formats')))
+        # Extracted images: "none" to skip them, codec (png, jpeg, webp), quality and largest side in pixels
+        self.images = parse_str(headers.get('images')) != 'none'
+        self.image_format = (parse_str(headers.get('image_format')) or 'png').upper()
+        self.image_quality = parse_int(headers.get('image_quality'))
+        self.image_max_size = parse_int(headers.get('image_max_size'))
+        # Page range of a pdf: the first page, from 0, and the number of pages; unset converts it all
+        self.start_page = parse_int(headers.get('start_page'))
+        self.max_pages = parse_int(headers.get('max_pages'))
+        if (self.start_page or 0) < 0 or (self.max_pages is not None and self.max_pages < 1):
+            raise ValueError(f'Invalid page range: start_page={self.start_page}, max_pages={self.max_pages}')
+
+def parse_str(value):
+    if isinstance(value, bytes):
+        value = value.decode()
+    return None if value is None else str(value)
+
+def parse_int(value):
+    value = parse_str(value)
+    return int(value) if value not in (None, '') else None
+
+def parse_bool(value) -> bool:
+    value = parse_str(value)
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def parse_table_formats(value):
+    """Parses a comma separated list of table formats, None keeps the extractor default."""
+    if value is None or value.strip() == '':
+        return None
+    formats = tuple(f.strip().lower() for f in value.split(',') if f.strip())
+    if formats == ('none',):
+        return ()
+    for f in formats:
+        if f not in TABLE_FORMATS:
+            raise ValueError(f'Invalid table format: {f}')
+    return formats
@@ -0,0 +1,8 @@
+import uuid
+
+def client_queue(prefix: str) -> str:
+    """
+    A unique name for an exclusive queue of this process. Named here rather than by the broker, so
+    that the robust connection declares it again under the same name on reconnect.
+    """
+    return f'{prefix}.{uuid.uuid4().hex}'
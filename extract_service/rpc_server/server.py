@@ -1,89 +1,573 @@
-import io
-import json
-import os
-import tempfile
+import asyncio
+import multiprocessing
+import queue
 import time
 import traceback
-from typing import IO
-import pika
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple, Union
+import aio_pika
 
-from extractor.docx import convert_docx_to_md
+from extractor.docx import convert_docx_file, convert_docx_to_md
 
-from extractor.pdf import convert_pdf
-from rpc_server.config import rpc_cfg
+from extractor.images import ImageOptions
+from rpc_server.config import LaneConfig, rpc_cfg
+from extractor.cancel import CancelToken, Cancelled
+from rpc_server.cancel import CANCEL_EXCHANGE, CancelRegistry, header_time, request_deadline, request_sent
+from rpc_server.blobs import RequestFile, request_size
+from rpc_server.flights import ABANDONED, DONE, Flight
+from rpc_server.lanes import PriorityLimit
+from rpc_server.shards import ShardClient, ShardedConversion, page_ranges, shard_queue
+from rpc_server.wire import WireFormat, dumps_json
+from rpc_server.options import RequestOptions, parse_bool
+from rpc_server.cache import ResultCache, conversion_settings, request_key
+from rpc_server.checkpoint import CheckpointStore, safe_name
+from rpc_server.queues import client_queue
+from extractor.metrics import Profile, maybe_stage, registry
 
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
+result_cache = ResultCache(rpc_cfg.cache_dir, rpc_cfg.cache_max_bytes) if rpc_cfg.cache_dir else None
+checkpoints = CheckpointStore(rpc_cfg.checkpoint_dir, rpc_cfg.checkpoint_max_age) if rpc_cfg.checkpoint_dir else None
+
+async def connect():
+    return await aio_pika.connect_robust(
         host=rpc_cfg.host,
-        port=rpc_cfg.port,
-        credentials=pika.PlainCredentials(
-            rpc_cfg.user,
-            rpc_cfg.password
-        )
+        port=int(rpc_cfg.port or 5672),
+        login=rpc_cfg.user,
+        password=rpc_cfg.password,
+        heartbeat=rpc_cfg.heartbeat
     )
-)
-
-channel = connection.channel()
-
-channel.queue_declare(queue='pdf')
-channel.queue_declare(queue='docx')
 
-def extract_text(file: bytes, file_type: str):
+def extract_text(file: RequestFile, file_type: str, options: RequestOptions, start_page: int = 0, max_pages: int = None, profile=None, cancel=None):
     if file_type == 'pdf':
-        file = io.BytesIO(file)
-        return convert_pdf(file)
+        # Imported by pdf lanes only, it loads marker and torch
+        from extractor.pdf import convert_pdf
+        return convert_pdf(
+            file.source(),
+            fast=options.fast,
+            table_formats=options.table_formats,
+            start_page=start_page,
+            max_pages=max_pages,
+            image_options=image_options(options),
+            profile=profile,
+            cancel=cancel
+        )
     if file_type == 'docx':
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as temp_file:
-            temp_file.write(file)
-            temp_file_path = temp_file.name
-        print(f"Temp file path: {temp_file_path}")
-        return convert_docx_to_md(temp_file_path)
+        # Read from the blob in place, or from the message body in memory
+        return convert_docx_to_md(
+            file.path if file.path is not None else file.body,
+            profile=profile,
+            table_formats=options.table_formats,
+            image_options=image_options(options)
+        )
     return [{"message": "Invalid file type"}]
 
 
-def on_request(ch, method, properties, body, file_type='pdf'):
-    request = body
-    print(f'Received request for {file_type}')
-    try:
-        response = extract_text(request, file_type)
-    except Exception as e:
-        response = [{'message': f"Failed to extract: {e}"}, {'message': 'eof'}]
-        traceback.print_exc()
-    for page in response:
-        ch.basic_publish(
-            exchange='',
-            routing_key=properties.reply_to,
-            properties=pika.BasicProperties(
-                correlation_id=properties.correlation_id
-            ),
-            body=json.dumps(page)
-        )
-        print(f"send page with message {page.get('message')}")
-    ch.basic_publish(
-        exchange='',
-        routing_key=properties.reply_to,
-        properties=pika.BasicProperties(
-            correlation_id=properties.correlation_id
+def image_options(options: RequestOptions) -> ImageOptions:
+    return ImageOptions(
+        format=options.image_format,
+        quality=options.image_quality,
+        max_size=options.image_max_size,
+        enabled=options.images
+    )
+
+
+async def publish(channel, request: aio_pika.abc.AbstractIncomingMessage, body: bytes, wire: WireFormat,
+                  content_encoding: Optional[str] = None, replayed=False):
+    await channel.default_exchange.publish(
+        aio_pika.Message(
+            body=body,
+            correlation_id=request.correlation_id,
+            content_type=wire.content_type,
+            content_encoding=content_encoding,
+            # Lets clients drop pages they already received before a redelivery
+            headers={'replayed': True} if replayed else None
         ),
-        body=json.dumps({'message': 'eof'})
+        routing_key=request.reply_to
     )
-    ch.basic_ack(delivery_tag=method.delivery_tag)
 
-def func_on_queue(file_type='pdf'):
-    def on_queue(ch, method, properties, body):
-        on_request(ch, method, properties, body, file_type)
-    return on_queue
+class Job:
+    """
+    The blocking side of one request: cache and checkpoint lookups, conversion and storage.
+
+    Its methods run on the conversion executor, one at a time, so the event loop stays free to
+    send heartbeats and publish pages while models run.
+    """
+    def __init__(self, body: bytes, file_type: str, headers, redelivered: bool, pool=None, cancel: CancelToken = None,
+                 correlation_id: Optional[str] = None):
+        self.body = body
+        # Names the checkpoint, which a redelivery of the same message reads back
+        self.correlation_id = correlation_id
+        self.file = None
+        self.options = None
+        self.key = None
+        # Page ranges other nodes convert, for a pdf large enough to be split
+        self.shards = []
+        # A page range of a larger pdf, answered to the node reassembling it
+        self.shard = parse_bool((headers or {}).get('shard'))
+        self.file_type = file_type
+        self.headers = headers
+        self.redelivered = redelivered
+        self.wire = WireFormat.from_headers(headers)
+        self.profile = Profile(file_type)
+        self.status = 'success'
+        self.cached = None
+        self.writer = None
+        self.checkpoint = None
+        self.replayed = []
+        self.pages = iter(())
+        # Process pool the docx conversion runs in, instead of this thread
+        self.pool = pool
+        self.cancel = cancel or CancelToken()
+
+    def prepare(self):
+        """Parses the request and computes its key, which identical requests share."""
+        try:
+            self.options = RequestOptions(self.headers)
+            self.file = RequestFile.from_message(self.body, self.headers, rpc_cfg.blob_dir)
+            with maybe_stage(self.profile, 'hash'):
+                self.key = request_key(self.file.digest(), conversion_settings(self.file_type, self.options))
+            if self.shardable():
+                from extractor.pdf import count_pages
+                pages = count_pages(self.file.source())
+                if pages >= rpc_cfg.shard_min_pages:
+                    self.shards = page_ranges(pages, rpc_cfg.shard_pages)
+        except Exception as e:
+            self.fail(e)
+
+    def shardable(self) -> bool:
+        # Only whole pdfs, shards are never split again, and a cached result is replayed instead
+        return (self.file_type == 'pdf' and rpc_cfg.shard_min_pages > 0
+                and self.options.start_page is None and self.options.max_pages is None
+                and not (result_cache is not None and result_cache.contains(self.key)))
+
+    def start(self):
+        if self.status == 'failed':
+            return
+        try:
+            options = self.options
+            key = self.key
+            with maybe_stage(self.profile, 'cache_lookup'):
+                # Shards are cached as part of the whole document
+                if result_cache is not None and not self.shard:
+                    self.cached = result_cache.get(key)
+                    if self.cached is None:
+                        self.writer = result_cache.writer(key)
+            if self.cached is None and checkpoints is not None and self.file_type == 'pdf':
+                self.checkpoint = checkpoints.open(key, self.correlation_id)
+                if self.redelivered:
+                    self.replayed = self.checkpoint.messages()
+                else:
+                    self.checkpoint.remove()
+            if self.cached is None and not (self.checkpoint is not None and self.checkpoint.finished()):
+                # Resume model work from the first page without a checkpointed result
+                first_page = options.start_page or 0
+                start_page = max(first_page, self.checkpoint.next_page()) if self.checkpoint is not None else first_page
+                end_page = None if options.max_pages is None else first_page + options.max_pages
+                if start_page > first_page:
+                    print(f'Resuming {self.file_type} from page {start_page}')
+                if self.pool is not None:
+                    self.pages = self.pool_pages()
+                elif end_page is None or start_page < end_page:
+                    self.pages = iter(extract_text(
+                        self.file, self.file_type, options,
+                        start_page=start_page,
+                        max_pages=None if end_page is None else end_page - start_page,
+                        profile=self.profile,
+                        cancel=self.cancel
+                    ))
+        except Exception as e:
+            self.fail(e)
+
+    def fail(self, e: Exception):
+        self.status = 'failed'
+        # respond() follows it with the metadata and the one eof of the response
+        self.pages = iter([{'message': f"Failed to extract: {e}"}])
+        traceback.print_exc()
+        self.abort()
+        self.checkpoint = None
+
+    def pool_pages(self) -> Iterator[dict]:
+        # A blob is opened by path in the pool process, only inline files are sent to it
+        file = self.file.path if self.file.path is not None else self.file.body
+        yield from self.pool.pages(convert_docx_file, file, self.options.table_formats, image_options(self.options),
+                                   cancel=self.cancel, profile=self.profile)
+
+    def messages(self) -> Iterator[Tuple[Union[bytes, dict], bytes, Optional[str], bool]]:
+        """
+        The response, as (message, body, content encoding, replayed) in publishing order. The
+        message is a page or JSON read back from the cache or a checkpoint, which store messages
+        as JSON; the body is the message encoded for the wire.
+        """
+        if self.cached is not None:
+            # Replay the stored page stream
+            self.status = 'cached'
+            for message in self.cached:
+                yield (message, *self.wire.encode_stored(message), False)
+            print(f'send cached response, cache stats: {result_cache.stats()}')
+            return
+
+        try:
+            for message in self.replayed:
+                if self.writer is not None:
+                    self.writer.write(message)
+                yield (message, *self.wire.encode_stored(message), True)
+            while True:
+                # Abandon the conversion between pages once the client is gone
+                self.cancel.check()
+                # Pages are produced lazily, so converting is timed apart from publishing
+                with self.profile.stage('convert'):
+                    page = next(self.pages, None)
+                if page is None:
+                    break
+                print(f"send page with message {page.get('message')}")
+                yield self.encode(page)
+            self.commit()
+        except Cancelled as e:
+            self.status = 'cancelled'
+            self.close()
+            print(f'Abandoned {self.file_type} request: {e}')
+            message = {'message': f"Cancelled: {e}"}
+            yield (message, *self.wire.encode(message), False)
+        except Exception as e:
+            # Don't cache a partial response
+            self.status = 'failed'
+            self.abort()
+            traceback.print_exc()
+            message = {'message': f"Failed to extract: {e}"}
+            yield (message, *self.wire.encode(message), False)
+
+    def encode(self, page: dict) -> Tuple[dict, bytes, Optional[str], bool]:
+        """Stores a page in the cache and checkpoint being written, and encodes it for the wire."""
+        message = None
+        if self.writer is not None or self.checkpoint is not None:
+            message = dumps_json(page)
+        if self.writer is not None:
+            self.writer.write(message)
+        if self.checkpoint is not None:
+            self.checkpoint.append(message)
+        return (page, *self.wire.encode(page, stored=message), False)
+
+    def commit(self):
+        if self.writer is not None:
+            self.writer.commit()
+            self.writer = None
+
+    def metadata(self) -> dict:
+        # Timings are per request, so they are neither cached nor checkpointed
+        return {'message': 'metadata', 'metadata': {'timings': self.profile.totals(), **self.profile.metadata}}
+
+    def finish(self):
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+        record_request(self.file_type, self.status, self.profile)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+    def close(self):
+        """Stops an abandoned conversion, keeping its checkpoint for the redelivery."""
+        self.abort()
+        close = getattr(self.pages, 'close', None)
+        if close is not None:
+            close()
+
+def record_request(file_type: str, status: str, profile: Profile):
+    registry.inc('extractor_requests_total', description='Requests handled', file_type=file_type, status=status)
+    registry.observe('extractor_request_seconds', profile.totals()['wall_seconds'],
+                     description='Wall time per request', file_type=file_type)
+    if result_cache is not None:
+        for name, value in result_cache.stats().items():
+            if isinstance(value, (int, float)):
+                registry.set(f'extractor_cache_{name}', value, description=f'Result cache {name}')
+    if rpc_cfg.metrics_dir:
+        try:
+            registry.write_textfile(rpc_cfg.metrics_dir)
+        except OSError:
+            traceback.print_exc()
+
+# Pages a pool process may convert ahead of those published
+PAGE_QUEUE_SIZE = 4
+
+class PagePool:
+    """
+    A process pool whose conversions stream their pages back as they are produced, through a queue
+    of a manager process, rather than returning the whole document at once.
+    """
+    def __init__(self, processes: Optional[int], context):
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+        self.manager = context.Manager()
+
+    def pages(self, fn, *args, cancel: CancelToken, profile: Profile) -> Iterator[dict]:
+        """
+        Runs fn(*args, pages=queue, stop=event), which puts each page on the queue and then None,
+        unless the event is set, and returns the stages and metadata of its profile. Stops it
+        between pages once cancelled or closed.
+        """
+        pages = self.manager.Queue(maxsize=PAGE_QUEUE_SIZE)
+        stop = self.manager.Event()
+        future = self.executor.submit(fn, *args, pages=pages, stop=stop)
+        try:
+            while True:
+                cancel.check()
+                try:
+                    page = pages.get(timeout=1)
+                except queue.Empty:
+                    # Ended by None, unless the process running fn died
+                    if future.done() and pages.empty():
+                        break
+                    continue
+                if page is None:
+                    break
+                yield page
+            profile.merge(*future.result())
+        finally:
+            stop.set()
+
+# Marks the end of a job's messages, as next() on the executor can't raise StopIteration into a future
+_DONE = object()
+
+class Lane:
+    """
+    Consumes the queue of one file type on its own channel, with its own concurrency limit,
+    prefetch and conversion workers.
+    """
+    def __init__(self, cfg: LaneConfig, cancels: CancelRegistry, shards: ShardClient):
+        self.cfg = cfg
+        self.cancels = cancels
+        self.shards = shards
+        self.file_type = cfg.file_type
+        self.limit = PriorityLimit(cfg.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=cfg.concurrency, thread_name_prefix=cfg.file_type)
+        self.pool = None
+        if cfg.worker == 'process':
+            if cfg.file_type != 'docx':
+                raise ValueError(f'{cfg.file_type} needs the models and can only be converted in threads')
+            # Forkserver children import the docx converter only, neither torch nor this server
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['extractor.docx'])
+            self.pool = PagePool(cfg.processes, context)
+        self.channel = None
+        self.shard_channel = None
+        # Conversions in progress by request key, joined by identical requests
+        self.flights: Dict[str, Flight] = {}
+
+    async def start(self, connection):
+        self.channel = await connection.channel()
+        await self.channel.set_qos(prefetch_count=self.cfg.prefetch)
+        arguments = {'x-max-priority': rpc_cfg.max_priority} if rpc_cfg.max_priority else None
+        queue = await self.channel.declare_queue(self.file_type, arguments=arguments)
+        await queue.consume(self.on_request)
+        if self.file_type == 'pdf' and rpc_cfg.shard_min_pages:
+            # Its own channel, so shards are still received while prefetch is taken by documents waiting on them
+            self.shard_channel = await connection.channel()
+            await self.shard_channel.set_qos(prefetch_count=self.cfg.prefetch)
+            queue = await self.shard_channel.declare_queue(shard_queue(self.file_type), arguments=arguments)
+            await queue.consume(self.on_request)
+        print(f'Awaiting {self.file_type} requests, {self.cfg.concurrency} at a time on {self.cfg.worker}s')
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def offload(self, fn, *args):
+        # On the default executor: the lane's threads may all be converting, or waiting on shards
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def on_request(self, request: aio_pika.abc.AbstractIncomingMessage):
+        cancel = self.cancels.open(request.correlation_id, request_deadline(request.headers), request_sent(request.headers))
+        try:
+            if cancel.cancelled():
+                await self.skip(request, cancel)
+                return
+            job = Job(request.body, self.file_type, request.headers, request.redelivered, pool=self.pool,
+                      correlation_id=request.correlation_id)
+            # Hashing doesn't wait for a conversion slot, so identical requests are found before converting
+            await self.offload(job.prepare)
+            flight = self.flights.get(job.key) if job.key is not None else None
+            if flight is not None and flight.joinable():
+                await self.follow(request, flight, cancel)
+                return
+
+            # Past its history cap, an identical conversion is not joined but replaced for later requests
+            flight = Flight(cancel, rpc_cfg.flight_history_bytes)
+            if job.key is not None:
+                self.flights[job.key] = flight
+            try:
+                if job.shards:
+                    # Waits on the nodes converting the shards, so it takes no slot
+                    await self.coordinate(request, job, flight, cancel)
+                    return
+                # Prefetched jobs wait for a slot smallest first, shards of documents being answered before
+                # anything else. A reconnect can also redeliver unacknowledged jobs while their first
+                # attempt is still running.
+                async with self.limit.slot(0 if job.shard else request_size(request.body, request.headers)):
+                    # Expired or cancelled while waiting, along with any request that joined
+                    if flight.cancel.cancelled():
+                        await self.skip(request, cancel)
+                        flight.end()
+                        return
+                    await self.convert(request, job, flight, cancel)
+            finally:
+                if job.key is not None and self.flights.get(job.key) is flight:
+                    del self.flights[job.key]
+                flight.end(abandoned=True)
+        finally:
+            self.cancels.close(request.correlation_id, cancel)
+
+    async def skip(self, request: aio_pika.abc.AbstractIncomingMessage, cancel: CancelToken):
+        print(f'Skipping {self.file_type} request: {cancel.reason}')
+        wire = WireFormat.from_headers(request.headers)
+        for message in ({'message': f'Cancelled: {cancel.reason}'}, {'message': 'eof'}):
+            body, content_encoding = wire.encode(message)
+            await publish(self.channel, request, body, wire, content_encoding)
+        await request.ack()
+        registry.inc('extractor_requests_total', description='Requests handled', file_type=self.file_type, status='skipped')
+
+    async def convert(self, request: aio_pika.abc.AbstractIncomingMessage, job: 'Job', flight: Flight, cancel: CancelToken):
+        print(f'Received request for {self.file_type}')
+        # The conversion stops once this request and all that joined it are cancelled
+        job.cancel = flight.cancel
+        messages = job.messages()
+
+        async def items():
+            await self.run(job.start)
+            while True:
+                item = await self.run(next, messages, _DONE)
+                if item is _DONE:
+                    return
+                yield item
+
+        try:
+            await self.respond(request, job, flight, cancel, items())
+        except Exception:
+            # Most likely the connection dropped: the job is redelivered and resumes from its checkpoint
+            traceback.print_exc()
+            await self.run(messages.close)
+            await self.run(job.close)
+
+    async def coordinate(self, request: aio_pika.abc.AbstractIncomingMessage, job: 'Job', flight: Flight, cancel: CancelToken):
+        print(f'Received request for {self.file_type}, split into {len(job.shards)} shards')
+        # Shards are sent a reference to the file rather than a copy each, an inline one is stored first
+        file = job.file
+        if file.path is None and rpc_cfg.blob_dir:
+            name = f'{file.digest()}-{safe_name(request.correlation_id)}'
+            file = await self.offload(file.to_blob, rpc_cfg.blob_dir, name)
+        conversion = ShardedConversion(self.shards, request, self.file_type, file, job.shards, flight.cancel,
+                                       window=rpc_cfg.shard_window, timeout=rpc_cfg.shard_timeout)
+        messages = conversion.messages()
+        if result_cache is not None:
+            job.writer = result_cache.writer(job.key)
+
+        async def items():
+            async for message in messages:
+                yield await self.offload(job.encode, message)
+            job.status = conversion.status
+            job.profile.metadata.update(conversion.metadata())
+            if job.status == 'success':
+                await self.offload(job.commit)
+            else:
+                job.abort()
+
+        try:
+            await self.respond(request, job, flight, cancel, items())
+        except Exception:
+            traceback.print_exc()
+            await messages.aclose()
+            job.abort()
+        finally:
+            # A redelivery stores it again under the same name
+            if file is not job.file:
+                await self.offload(file.remove)
+
+    async def respond(self, request: aio_pika.abc.AbstractIncomingMessage, job: 'Job', flight: Flight, cancel: CancelToken,
+                      items: AsyncIterator[Tuple[Union[bytes, dict], bytes, Optional[str], bool]]):
+        """Publishes the messages of a job, and shares them with the requests that joined it."""
+        async for message, body, content_encoding, replayed in items:
+            flight.broadcast(message)
+            # Others may still be waiting on pages this request's client no longer wants
+            if cancel.cancelled():
+                continue
+            with job.profile.stage('publish'):
+                await publish(self.channel, request, body, job.wire, content_encoding, replayed=replayed)
+        metadata = job.metadata()
+        flight.broadcast(metadata)
+        if cancel.cancelled():
+            body, content_encoding = job.wire.encode({'message': f'Cancelled: {cancel.reason}'})
+        else:
+            body, content_encoding = job.wire.encode(metadata)
+        await publish(self.channel, request, body, job.wire, content_encoding)
+        body, content_encoding = job.wire.encode({'message': 'eof'})
+        await publish(self.channel, request, body, job.wire, content_encoding)
+        if job.key is not None and self.flights.get(job.key) is flight:
+            del self.flights[job.key]
+        flight.end()
+        await self.run(job.finish)
+        await request.ack()
+
+    async def follow(self, request: aio_pika.abc.AbstractIncomingMessage, flight: Flight, cancel: CancelToken):
+        """Sends a request the messages of an identical one being converted, from the first."""
+        print(f'Joining the conversion of an identical {self.file_type} request')
+        wire = WireFormat.from_headers(request.headers)
+        queue = flight.join(cancel)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=1)
+                except asyncio.TimeoutError:
+                    message = None
+                if cancel.cancelled():
+                    await self.skip(request, cancel)
+                    return
+                if message is None:
+                    continue
+                if message == ABANDONED:
+                    # Retried from the start, maybe as the conversion of its own
+                    await request.nack(requeue=True)
+                    return
+                if message == DONE:
+                    break
+                body, content_encoding = await self.offload(wire.encode_message, message)
+                await publish(self.channel, request, body, wire, content_encoding)
+            body, content_encoding = wire.encode({'message': 'eof'})
+            await publish(self.channel, request, body, wire, content_encoding)
+            await request.ack()
+            registry.inc('extractor_requests_total', description='Requests handled', file_type=self.file_type, status='shared')
+        finally:
+            flight.leave(queue)
+
+class Server:
+    """Runs a lane per file type on one connection, and listens for cancelled requests."""
+    def __init__(self, lanes):
+        self.cancels = CancelRegistry()
+        self.shards = ShardClient()
+        self.lanes = [Lane(cfg, self.cancels, self.shards) for cfg in lanes]
+        self.cancel_queue = client_queue(CANCEL_EXCHANGE)
+
+    async def serve(self):
+        # Connect here rather than at import, so every forked worker gets its own connection
+        connection = await connect()
+        async with connection:
+            channel = await connection.channel()
+            exchange = await channel.declare_exchange(CANCEL_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+            queue = await channel.declare_queue(self.cancel_queue, exclusive=True)
+            await queue.bind(exchange)
+            await queue.consume(self.on_cancel, no_ack=True)
+            await self.shards.start(connection)
+            for lane in self.lanes:
+                await lane.start(connection)
+            await asyncio.Future()
+
+    async def on_cancel(self, message: aio_pika.abc.AbstractIncomingMessage):
+        if message.correlation_id:
+            self.cancels.cancel(message.correlation_id, header_time(message.headers, 'sent_before'))
 
-def start_server():
-    channel.basic_consume(queue='pdf', on_message_callback=func_on_queue('pdf'))
-    channel.basic_consume(queue='docx', on_message_callback=func_on_queue('docx'))
-    print('Awaiting RPC requests')
+def start_server(file_types=None):
+    """Serves the lanes of `file_types`, all of them by default."""
+    server = Server([cfg for file_type, cfg in rpc_cfg.lanes.items() if file_types is None or file_type in file_types])
     while True:
         try:
-            channel.start_consuming()
-        except pika.exceptions.AMQPConnectionError as e:
+            # connect_robust reconnects by itself once connected, this covers the first attempt
+            asyncio.run(server.serve())
+        except (aio_pika.exceptions.AMQPConnectionError, ConnectionError, OSError) as e:
             print(f'Connection error: {e}, retrying in 10 seconds...')
             time.sleep(10)
-        except ConnectionError as e:
-            raise e
-        
\ No newline at end of file
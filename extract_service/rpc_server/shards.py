@@ -0,0 +1,203 @@
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aio_pika
+
+from extractor.cancel import CancelToken
+from extractor.metrics import add_stats
+from rpc_server.blobs import RequestFile
+from rpc_server.cancel import CANCEL_EXCHANGE, request_deadline
+from rpc_server.queues import client_queue
+from rpc_server.wire import FRAMES, IDENTITY, loads_frames
+
+def shard_queue(file_type: str) -> str:
+    """Queue of the page ranges of large documents, consumed apart so they never wait behind whole ones."""
+    return f'{file_type}.shards'
+
+def shard_id(correlation_id: str, start: int) -> str:
+    """Correlation id of a shard, the same for every delivery of the document so a redelivery can cancel it."""
+    return f'{correlation_id}.shard.{start}'
+
+def page_ranges(pages: int, shard_pages: int) -> List[Tuple[int, int]]:
+    """(start page, number of pages) of each shard of a document."""
+    return [(start, min(shard_pages, pages - start)) for start in range(0, pages, shard_pages)]
+
+class ShardClient:
+    """
+    Sends the page ranges of large documents to the shard queue, where any node converts them,
+    and routes the responses back by correlation id, like the backend does with whole documents.
+    """
+    def __init__(self):
+        self.channel = None
+        self.reply_queue = client_queue('extractor.shards.replies')
+        self.pending: Dict[str, asyncio.Queue] = {}
+
+    async def start(self, connection):
+        self.channel = await connection.channel()
+        queue = await self.channel.declare_queue(self.reply_queue, exclusive=True)
+        await queue.consume(self.on_response, no_ack=True)
+        connection.reconnect_callbacks.add(self.on_reconnect)
+
+    async def on_response(self, message: aio_pika.abc.AbstractIncomingMessage):
+        queue = self.pending.get(message.correlation_id)
+        if queue is not None:
+            queue.put_nowait((loads_frames(message.body), bool((message.headers or {}).get('replayed'))))
+
+    def on_reconnect(self, *args):
+        # Responses sent while the reply queue was gone are lost
+        for queue in self.pending.values():
+            queue.put_nowait(None)
+
+    async def send(self, request: aio_pika.abc.AbstractIncomingMessage, file_type: str, file: RequestFile,
+                   start: int, count: int, sent: float) -> Tuple[str, asyncio.Queue]:
+        corr_id = shard_id(request.correlation_id, start)
+        responses = asyncio.Queue()
+        self.pending[corr_id] = responses
+        deadline = request_deadline(request.headers)
+        headers = {
+            **(request.headers or {}),
+            # A reference to the file in the blob store when there is one, rather than a copy per shard
+            **file.headers(),
+            'start_page': start,
+            'max_pages': count,
+            'shard': True,
+            'sent': sent,
+            # Raw images, decoded here and encoded again for the client
+            'accept': FRAMES,
+            'accept_encoding': IDENTITY,
+        }
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=file.body if file.path is None else b'',
+                reply_to=self.reply_queue,
+                correlation_id=corr_id,
+                headers=headers,
+                priority=request.priority,
+                expiration=None if deadline is None else max(0.001, deadline - time.time()),
+            ),
+            routing_key=shard_queue(file_type)
+        )
+        return corr_id, responses
+
+    async def cancel(self, corr_id: str, before: Optional[float] = None):
+        """Cancels a shard, or with `before` only the attempts sent before that time."""
+        headers = None if before is None else {'sent_before': before}
+        try:
+            exchange = await self.channel.declare_exchange(CANCEL_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+            await exchange.publish(aio_pika.Message(body=b'', correlation_id=corr_id, headers=headers), routing_key='')
+        except Exception as e:
+            print(f'Failed to cancel shard {corr_id}: {e}')
+
+    def close(self, corr_id: str):
+        self.pending.pop(corr_id, None)
+
+class ShardedConversion:
+    """
+    A large pdf converted as page ranges by any nodes, reassembled into the stream of a single
+    conversion: pages in order, the page-0 metadata of the whole document, one metadata message.
+
+    At most `window` shards are in flight, 0 for all of them: the pages of those after the one being
+    streamed wait here, so the window bounds them. A shard that sends nothing for `timeout` seconds,
+    lost with its node or expired in the queue, fails the document rather than holding it forever.
+    """
+    def __init__(self, client: ShardClient, request: aio_pika.abc.AbstractIncomingMessage, file_type: str,
+                 file: RequestFile, ranges: List[Tuple[int, int]], cancel: CancelToken, window: int = 0,
+                 timeout: float = 0):
+        self.client = client
+        self.request = request
+        self.file_type = file_type
+        self.file = file
+        self.ranges = ranges
+        self.cancel = cancel
+        self.window = window or len(ranges)
+        self.timeout = timeout
+        self.status = 'success'
+        self.shard_metadata = []
+
+    async def messages(self) -> AsyncIterator[Dict]:
+        calls = []
+        finished = set()
+        sent = time.time()
+        try:
+            if self.request.redelivered:
+                # The shards of the previous delivery may still be queued or converting
+                for start, _ in self.ranges:
+                    await self.client.cancel(shard_id(self.request.correlation_id, start), before=sent)
+            # A window sent ahead, so other nodes pick them up while the first are streamed back
+            for start, count in self.ranges[:self.window]:
+                calls.append(await self.client.send(self.request, self.file_type, self.file, start, count, sent))
+            # Later shards queue up until the ones before them are complete
+            index = 0
+            while index < len(calls):
+                corr_id, responses = calls[index]
+                async for message in self.shard(corr_id, responses):
+                    yield message
+                    if self.status != 'success':
+                        return
+                finished.add(corr_id)
+                self.client.close(corr_id)
+                index += 1
+                if len(calls) < len(self.ranges):
+                    start, count = self.ranges[len(calls)]
+                    calls.append(await self.client.send(self.request, self.file_type, self.file, start, count, sent))
+        finally:
+            for corr_id, _ in calls:
+                self.client.close(corr_id)
+                if corr_id not in finished:
+                    await self.client.cancel(corr_id)
+
+    async def shard(self, corr_id: str, responses: asyncio.Queue) -> AsyncIterator[Dict]:
+        # Pages received, a redelivered shard replays them before resuming
+        pnums = set()
+        last = time.monotonic()
+        while True:
+            try:
+                item = await asyncio.wait_for(responses.get(), timeout=min(1, self.timeout or 1))
+            except asyncio.TimeoutError:
+                item = False
+            if self.cancel.cancelled():
+                self.status = 'cancelled'
+                yield {'message': f'Cancelled: {self.cancel.reason}'}
+                return
+            if item is False:
+                if self.timeout and time.monotonic() - last > self.timeout:
+                    self.status = 'failed'
+                    yield {'message': f'Failed to extract: no response from shard {corr_id} in {self.timeout:g}s'}
+                    return
+                continue
+            last = time.monotonic()
+            if item is None:
+                raise ConnectionError('Lost the responses of the shards')
+            message, replayed = item
+            pnum = message.get('pnum')
+            if message.get('message') == 'eof':
+                return
+            if message.get('message') == 'metadata':
+                self.shard_metadata.append(message.get('metadata') or {})
+            elif pnum is None:
+                # Failed or cancelled: the document can't be complete
+                self.status = 'failed'
+                yield message
+                return
+            elif not (replayed and pnum in pnums):
+                pnums.add(pnum)
+                if pnum == 0 and 'metadata' in message:
+                    message['metadata']['pages'] = sum(count for _, count in self.ranges)
+                yield message
+
+    def metadata(self) -> Dict:
+        """Totals over the shards, the table of contents computed from headings in page order."""
+        totals = {}
+        computed_toc = []
+        for metadata in self.shard_metadata:
+            metadata = dict(metadata)
+            computed_toc.extend(metadata.pop('computed_toc', None) or [])
+            add_stats(totals, metadata)
+        # Summed over the nodes, the wall time of the request is its own
+        shard_timings = totals.pop('timings', {})
+        return {
+            **totals,
+            'computed_toc': computed_toc,
+            'shards': {'count': len(self.ranges), 'pages': self.ranges, 'timings': shard_timings},
+        }
@@ -0,0 +1,92 @@
+import gc
+import os
+import signal
+import time
+import traceback
+
+from extractor import models
+
+def split_threads(num_workers: int) -> int:
+    """Torch intra-op threads per worker so that all workers together use each core once."""
+    return max(1, (os.cpu_count() or 1) // num_workers)
+
+def set_torch_threads(num_threads: int, interop_threads: int = 1):
+    import torch
+    torch.set_num_threads(num_threads)
+    # Shared by the model calls of the pdf pipeline
+    models.torch_threads = num_threads
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Can only be set before the first parallel work of the process
+        pass
+
+def pin_cores(index: int, num_threads: int):
+    """
+    Restricts worker `index` to `num_threads` cores of its own, taken in turn from those available.
+
+    Call it in the worker before any thread is started: threads inherit the affinity they are created with.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    start = (index * num_threads) % len(cpus)
+    cores = [cpus[(start + i) % len(cpus)] for i in range(min(num_threads, len(cpus)))]
+    os.sched_setaffinity(0, cores)
+    return cores
+
+def run_workers(num_workers: int, worker, restart_delay: float = 5):
+    """
+    Forks `num_workers` processes running `worker(index)` and restarts any that exit.
+
+    Call this after the models are loaded: the children share the parent's weights copy-on-write.
+    The parent must not run inference itself, so that no torch thread pool exists at fork time.
+    """
+    # Keep the garbage collector from touching, and so copying, objects inherited by the children
+    gc.freeze()
+
+    workers = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                print(f'Worker {index} started with pid {os.getpid()}')
+                worker(index)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(num_workers):
+        spawn(index)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f'Worker {index} (pid {pid}) exited with status {status}, restarting in {restart_delay} seconds...')
+        time.sleep(restart_delay)
+        spawn(index)
@@ -0,0 +1,151 @@
+import base64
+import gzip
+import json
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+
+from rpc_server.options import parse_str
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The backend decodes these with its own copy of the codec, backend/wire.py: tests/test_wire.py keeps them in step
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# A JSON header without the image contents, then the raw images, each prefixed by its length
+FRAMES = 'application/vnd.extractor.frames'
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+# Smaller messages, eof and most text pages, are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+def content_types() -> List[str]:
+    """Response encodings this server can produce, the default first."""
+    return [JSON, FRAMES] + ([MSGPACK] if msgpack is not None else [])
+
+def content_encodings() -> List[str]:
+    return [IDENTITY, GZIP] + ([ZSTD] if zstandard is not None else [])
+
+def negotiate(accept: Optional[str], offered: List[str]) -> str:
+    """The first value of a comma separated `accept` list that is offered, or the default."""
+    for value in (accept or '').split(','):
+        value = value.split(';')[0].strip().lower()
+        if value in offered:
+            return value
+    return offered[0]
+
+def json_default(value):
+    # Images are raw bytes until they reach a text encoding
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps_json(message: Dict) -> bytes:
+    return json.dumps(message, default=json_default).encode()
+
+def page_images(message: Dict) -> List[Dict]:
+    page = message.get('page')
+    if not isinstance(page, dict):
+        return []
+    return [image for image in page.get('images') or [] if isinstance(image, dict) and 'content' in image]
+
+def with_raw_images(message: Dict) -> Dict:
+    """A copy of the message whose image contents are bytes, decoding any base64 string."""
+    images = page_images(message)
+    if not any(isinstance(image['content'], str) for image in images):
+        return message
+    raw = []
+    for image in message['page']['images']:
+        if isinstance(image, dict) and isinstance(image.get('content'), str):
+            image = {**image, 'content': base64.b64decode(image['content'])}
+        raw.append(image)
+    return {**message, 'page': {**message['page'], 'images': raw}}
+
+def dumps_frames(message: Dict) -> bytes:
+    message = with_raw_images(message)
+    blobs = []
+    if page_images(message):
+        images = []
+        for image in message['page']['images']:
+            if isinstance(image, dict) and isinstance(image.get('content'), (bytes, bytearray)):
+                blobs.append(bytes(image['content']))
+                image = {k: v for k, v in image.items() if k != 'content'}
+                image['blob'] = len(blobs) - 1
+            images.append(image)
+        message = {**message, 'page': {**message['page'], 'images': images}}
+    parts = [dumps_json(message)] + blobs
+    return b''.join(struct.pack('>I', len(part)) + part for part in parts)
+
+def loads_frames(body: bytes) -> Dict:
+    """The message of a frames body, with image contents as bytes."""
+    parts = []
+    offset = 0
+    while offset < len(body):
+        size, = struct.unpack_from('>I', body, offset)
+        offset += 4
+        parts.append(body[offset:offset + size])
+        offset += size
+    message = json.loads(parts[0])
+    page = message.get('page')
+    if isinstance(page, dict):
+        for image in page.get('images') or []:
+            if isinstance(image, dict) and 'blob' in image:
+                image['content'] = parts[1 + image.pop('blob')]
+    return message
+
+class WireFormat:
+    """The encoding of the response messages of one request, negotiated from its headers."""
+    def __init__(self, content_type: str = JSON, content_encoding: str = IDENTITY):
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.compressor = zstandard.ZstdCompressor(level=3) if content_encoding == ZSTD else None
+
+    @classmethod
+    def from_headers(cls, headers) -> 'WireFormat':
+        headers = headers or {}
+        return cls(
+            negotiate(parse_str(headers.get('accept')), content_types()),
+            negotiate(parse_str(headers.get('accept_encoding')), content_encodings())
+        )
+
+    def encode(self, message: Dict, stored: Optional[bytes] = None) -> Tuple[bytes, Optional[str]]:
+        """
+        The body of a message and its content encoding, None when sent uncompressed.
+        `stored` is the message already serialized to JSON, reused when JSON is negotiated.
+        """
+        if self.content_type == MSGPACK:
+            body = msgpack.packb(with_raw_images(message), use_bin_type=True)
+        elif self.content_type == FRAMES:
+            body = dumps_frames(message)
+        else:
+            body = stored if stored is not None else dumps_json(message)
+        return self.compress(body)
+
+    def encode_stored(self, stored: bytes) -> Tuple[bytes, Optional[str]]:
+        """Encodes a message read back as JSON from the cache or a checkpoint."""
+        if self.content_type == JSON:
+            return self.compress(stored)
+        return self.encode(json.loads(stored))
+
+    def encode_message(self, message: Union[bytes, Dict]) -> Tuple[bytes, Optional[str]]:
+        """Encodes a message, or JSON read back from storage."""
+        if isinstance(message, (bytes, bytearray)):
+            return self.encode_stored(message)
+        return self.encode(message)
+
+    def compress(self, body: bytes) -> Tuple[bytes, Optional[str]]:
+        if self.content_encoding == IDENTITY or len(body) < COMPRESS_MIN_BYTES:
+            return body, None
+        if self.content_encoding == ZSTD:
+            return self.compressor.compress(body), ZSTD
+        return gzip.compress(body, compresslevel=5), GZIP
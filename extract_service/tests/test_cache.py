@@ -0,0 +1,43 @@
+import os
+import time
+
+from rpc_server.cache import ResultCache
+
+
+def store(cache: ResultCache, key: str, size: int):
+    writer = cache.writer(key)
+    writer.write(b'x' * (size - 1))
+    writer.commit()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    # Evicted down to 315 bytes once over the limit
+    cache = ResultCache(str(tmp_path), max_bytes=350)
+    for age, key in enumerate(("a", "b", "c")):
+        store(cache, key, 100)
+        os.utime(cache.path(key), (time.time() - 100 + age, time.time() - 100 + age))
+    # Read again, "a" is now the most recently used
+    assert list(cache.get("a")) == [b'x' * 99]
+    store(cache, "d", 100)
+    assert [key for key in "abcd" if cache.contains(key)] == ["a", "c", "d"]
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['bytes'] == 300
+    assert cache.stats()['evictions'] == 1
+
+
+def test_stats_count_hits_and_misses(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=1000)
+    assert cache.get("missing") is None
+    store(cache, "key", 10)
+    list(cache.get("key"))
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['bytes_served']) == (1, 1, 10)
+
+
+def test_replacing_an_entry_counts_it_once(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=1000)
+    store(cache, "key", 10)
+    store(cache, "key", 30)
+    assert (cache.count, cache.bytes) == (1, 30)
+    # A new process scans the same totals
+    assert ResultCache(str(tmp_path), max_bytes=1000).stats()['bytes'] == 30
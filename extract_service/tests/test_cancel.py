@@ -0,0 +1,37 @@
+from rpc_server.cancel import CancelRegistry
+
+
+def test_cancel_before_the_job_is_received():
+    registry = CancelRegistry()
+    registry.cancel('request')
+    assert registry.open('request').cancelled()
+    # Forgotten once applied: the correlation id of a new request starts afresh
+    assert not registry.open('request').cancelled()
+
+
+def test_early_cancel_spares_attempts_sent_after_it():
+    registry = CancelRegistry()
+    registry.cancel('shard', before=100.0)
+    assert registry.open('shard', sent=50.0).cancelled()
+    assert not registry.open('shard', sent=150.0).cancelled()
+    # Kept for other earlier attempts that may still be queued
+    assert registry.open('shard', sent=60.0).cancelled()
+
+
+def test_cancel_sent_before_applies_to_active_jobs():
+    registry = CancelRegistry()
+    old = registry.open('shard', sent=50.0)
+    new = registry.open('shard', sent=150.0)
+    registry.cancel('shard', before=100.0)
+    assert old.cancelled()
+    assert not new.cancelled()
+
+
+def test_closed_jobs_are_no_longer_cancelled():
+    registry = CancelRegistry()
+    token = registry.open('request')
+    registry.close('request', token)
+    assert 'request' not in registry.active
+    registry.cancel('request')
+    # Remembered for a redelivery instead
+    assert 'request' in registry.early
@@ -0,0 +1,58 @@
+import json
+import os
+import threading
+import time
+
+from rpc_server.checkpoint import CheckpointStore
+
+
+def page(pnum: int) -> bytes:
+    return json.dumps({'pnum': pnum, 'message': 'success'}).encode()
+
+
+def test_concurrent_jobs_on_the_same_key(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    key = 'same-document'
+    first = store.open(key, 'request-1')
+    second = store.open(key, 'request-2')
+    barrier = threading.Barrier(2)
+
+    def convert(checkpoint, pages):
+        barrier.wait()
+        for pnum in range(pages):
+            checkpoint.append(page(pnum))
+
+    threads = [threading.Thread(target=convert, args=(first, 5)), threading.Thread(target=convert, args=(second, 3))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The first job finishes and removes its checkpoint, the second is cut short
+    first.remove()
+
+    # Redelivered with its correlation id, the second resumes from its own pages
+    resumed = store.open(key, 'request-2')
+    assert resumed.messages() == [page(pnum) for pnum in range(3)]
+    assert resumed.next_page() == 3
+    assert store.open(key, 'request-1').messages() == []
+
+
+def test_correlation_id_is_a_file_name(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    checkpoint = store.open('key', '../other/id')
+    checkpoint.append(page(0))
+    assert [p.name for p in tmp_path.iterdir()] == ['key..._other_id.jsonl']
+
+
+def test_abandoned_checkpoints_are_swept(tmp_path):
+    store = CheckpointStore(str(tmp_path), max_age=60)
+    old = store.open('key', 'abandoned')
+    old.append(page(0))
+    os.utime(old.path, (time.time() - 120, time.time() - 120))
+    recent = store.open('key', 'converting')
+    recent.append(page(0))
+
+    # Swept on startup, as by a worker restarted after the old one's job was dropped
+    CheckpointStore(str(tmp_path), max_age=60)
+    assert [p.name for p in tmp_path.iterdir()] == ['key.converting.jsonl']
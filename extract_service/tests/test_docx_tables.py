@@ -0,0 +1,81 @@
+from extractor.doc_convertor.convert import Converter
+from extractor.doc_convertor.tables import Table
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def cell(text: str, props: str = '') -> str:
+    return f'<w:tc><w:tcPr>{props}</w:tcPr><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:tc>'
+
+
+def document(rows: str) -> bytes:
+    grid = '<w:tblGrid><w:gridCol/><w:gridCol/><w:gridCol/></w:tblGrid>'
+    return f'<w:document xmlns:w="{W}"><w:body><w:tbl>{grid}{rows}</w:tbl></w:body></w:document>'.encode()
+
+
+# A | A | B       A spans two columns, B two rows
+#   | C | B       the row starts one grid column in
+# D | E | F
+ROWS = (
+    '<w:tr>' + cell('A', '<w:gridSpan w:val="2"/>') + cell('B', '<w:vMerge w:val="restart"/>') + '</w:tr>'
+    '<w:tr><w:trPr><w:gridBefore w:val="1"/></w:trPr>' + cell('C') + cell('', '<w:vMerge/>') + '</w:tr>'
+    '<w:tr>' + cell('D') + cell('E') + cell('F') + '</w:tr>'
+)
+
+
+def convert_table(formats=("csv", "html", "markdown")) -> dict:
+    pages = Converter(document(ROWS), None, use_md_table=False, table_formats=formats).convert()
+    return pages[0]["tables"][0]
+
+
+def test_spans_and_grid_before():
+    table = convert_table()
+    assert table["grid"] == {
+        "rows": 3,
+        "columns": 3,
+        "cells": [
+            {"row": 0, "column": 0, "rowspan": 1, "colspan": 2, "text": "A"},
+            {"row": 0, "column": 2, "rowspan": 2, "colspan": 1, "text": "B"},
+            {"row": 1, "column": 1, "rowspan": 1, "colspan": 1, "text": "C"},
+            {"row": 2, "column": 0, "rowspan": 1, "colspan": 1, "text": "D"},
+            {"row": 2, "column": 1, "rowspan": 1, "colspan": 1, "text": "E"},
+            {"row": 2, "column": 2, "rowspan": 1, "colspan": 1, "text": "F"},
+        ],
+    }
+    assert table["content"] == "A,,B\n,C,\nD,E,F"
+    assert table["format"] == "csv"
+
+
+def test_html_has_rowspan_colspan_and_leading_cells():
+    html = convert_table()["html"]
+    assert '<td colspan="2">A</td>\n<td rowspan="2">B</td>' in html
+    # The merged cell below B is left out, the skipped grid column is an empty cell
+    assert '<tr>\n<td></td>\n<td>C</td>\n</tr>' in html
+
+
+def test_vertical_merge_ends_at_a_row_without_it():
+    table = Table(2)
+    table.add_row()
+    table.add_cell("top", vmerge="restart")
+    table.add_cell("x")
+    table.add_row()
+    table.add_cell("", vmerge="continue")
+    table.add_cell("y")
+    table.add_row()
+    table.add_cell("middle")
+    table.add_cell("z")
+    table.add_row()
+    # Nothing above to continue: kept as a cell of its own
+    table.add_cell("", vmerge="continue")
+    table.add_cell("w")
+    table.close()
+    assert [cell.rowspan for cell in table.rows[0].cells] == [2, 1]
+    assert table.rows[1].cells[0].covered
+    assert not table.rows[3].cells[0].covered
+
+
+def test_markdown_text_without_table_data():
+    pages = Converter(document(ROWS), None, use_md_table=True, table_formats=()).convert()
+    assert pages[0]["tables"] == []
+    assert "|A||B|" in pages[0]["text"]
+    assert "||C||" in pages[0]["text"]
@@ -0,0 +1,33 @@
+from extractor.cancel import CancelToken
+from rpc_server.flights import DONE, Flight
+
+
+def page(pnum: int, image: bytes) -> dict:
+    return {'pnum': pnum, 'page': {'page': pnum, 'text': 'text', 'images': [{'content': image}]}}
+
+
+def drain(queue) -> list:
+    messages = []
+    while not queue.empty():
+        messages.append(queue.get_nowait())
+    return messages
+
+
+def test_late_joiners_replay_the_history():
+    flight = Flight(CancelToken(), max_history=1024)
+    flight.broadcast(page(0, b'x' * 100))
+    queue = flight.join(CancelToken())
+    flight.broadcast(page(1, b'x' * 100))
+    flight.end()
+    assert drain(queue) == [page(0, b'x' * 100), page(1, b'x' * 100), DONE]
+
+
+def test_history_past_the_cap_is_dropped():
+    flight = Flight(CancelToken(), max_history=1024)
+    early = flight.join(CancelToken())
+    for pnum in range(3):
+        flight.broadcast(page(pnum, b'x' * 500))
+    # Those who joined still get every page, later requests convert on their own
+    assert flight.history is None
+    assert not flight.joinable()
+    assert len(drain(early)) == 3
@@ -0,0 +1,43 @@
+import asyncio
+
+from rpc_server.lanes import PriorityLimit
+
+
+def test_waiters_start_smallest_first_then_in_arrival_order():
+    async def run():
+        limit = PriorityLimit(1)
+        started = []
+
+        async def job(name: str, size: int):
+            async with limit.slot(size):
+                started.append(name)
+                await asyncio.sleep(0)
+
+        await limit.acquire(0)
+        tasks = []
+        for name, size in (("large", 50), ("small", 10), ("small again", 10), ("medium", 30)):
+            tasks.append(asyncio.create_task(job(name, size)))
+            await asyncio.sleep(0)
+        assert limit.waiting() == 4
+        limit.release()
+        await asyncio.gather(*tasks)
+        return started
+
+    assert asyncio.run(run()) == ["small", "small again", "medium", "large"]
+
+
+def test_cancelled_waiter_gives_up_its_turn():
+    async def run():
+        limit = PriorityLimit(1)
+        await limit.acquire(0)
+        cancelled = asyncio.create_task(limit.acquire(1))
+        waiting = asyncio.create_task(limit.acquire(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        limit.release()
+        await asyncio.wait_for(waiting, timeout=1)
+        # The slot went to the next waiter and is taken
+        return limit.slots, limit.waiting()
+
+    assert asyncio.run(run()) == (0, 0)
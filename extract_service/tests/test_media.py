@@ -0,0 +1,61 @@
+import io
+import zipfile
+
+from PIL import Image
+from docx2md.docxmedia import DocxMedia
+
+from extractor.doc_convertor.media import InMemoryDocx, MediaCache
+from extractor.images import ImageOptions
+
+RELS = b'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/image1.png"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/image1.png"/>
+<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/image2.png"/>
+<Relationship Id="rId4" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/missing.png"/>
+</Relationships>'''
+
+
+def png(color) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(out, format="PNG")
+    return out.getvalue()
+
+
+def docx_media() -> DocxMedia:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as docx:
+        docx.writestr("word/document.xml", b"<document/>")
+        docx.writestr("word/_rels/document.xml.rels", RELS)
+        docx.writestr("word/media/image1.png", png("red"))
+        # The same file under another name
+        docx.writestr("word/media/image2.png", png("red"))
+    return DocxMedia(InMemoryDocx(data.getvalue()))
+
+
+def test_missing_part_is_skipped():
+    cache = MediaCache(docx_media(), ImageOptions(format="PNG"))
+    assert cache.image("rId4") is None
+    assert cache.image("rId1")["name"] == "image1.png"
+
+
+def test_repeated_images_are_sent_once():
+    cache = MediaCache(docx_media(), ImageOptions(format="PNG"))
+    first = cache.image("rId1")
+    # Stored as png already, sent as is
+    assert first == {"name": "image1.png", "hash": first["hash"], "format": "PNG", "content": png("red")}
+    # The same relationship again, another one to the same part, and an identical file under another name
+    assert cache.image("rId1") == {"name": "image1.png", "ref": "image1.png", "hash": first["hash"]}
+    assert cache.image("rId2") == {"name": "image1.png", "ref": "image1.png", "hash": first["hash"]}
+    assert cache.image("rId3") == {"name": "image2.png", "ref": "image1.png", "hash": first["hash"]}
+
+
+def test_images_are_converted_to_the_requested_format():
+    cache = MediaCache(docx_media(), ImageOptions(format="JPEG"))
+    image = cache.image("rId1")
+    assert image["format"] == "JPEG"
+    assert Image.open(io.BytesIO(image["content"])).format == "JPEG"
+
+
+def test_disabled_images():
+    assert MediaCache(docx_media(), ImageOptions(enabled=False)).image("rId1") is None
@@ -0,0 +1,40 @@
+import threading
+import time
+
+import pytest
+
+from extractor import models
+from extractor.models import INFERENCE_SLOTS, model_call
+
+torch = pytest.importorskip("torch")
+
+
+def test_one_call_per_model(monkeypatch):
+    monkeypatch.setattr(models, "torch_threads", 2 * INFERENCE_SLOTS)
+    lock = threading.Lock()
+    running = {"calls": 0}
+    most = {}
+    threads_per_call = set()
+
+    def call(*called):
+        with model_call(*called):
+            threads_per_call.add(torch.get_num_threads())
+            with lock:
+                for name in ("calls",) + called:
+                    running[name] = running.get(name, 0) + 1
+                    most[name] = max(most.get(name, 0), running[name])
+            time.sleep(0.02)
+            with lock:
+                for name in ("calls",) + called:
+                    running[name] -= 1
+
+    # Detection from detect_ocr and tables at once, and table recognition which also runs OCR
+    calls = [("detection",), ("detection",), ("ocr",), ("table_rec", "ocr"), ("layout",), ("order",), (None,)]
+    threads = [threading.Thread(target=call, args=called) for called in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert most["detection"] == most["ocr"] == 1
+    assert most["calls"] == INFERENCE_SLOTS
+    assert threads_per_call == {2}
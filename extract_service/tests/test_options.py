@@ -0,0 +1,44 @@
+import pytest
+
+from rpc_server.options import RequestOptions, parse_table_formats
+
+
+def test_parse_table_formats():
+    assert parse_table_formats(None) is None
+    assert parse_table_formats(' ') is None
+    assert parse_table_formats('none') == ()
+    assert parse_table_formats('CSV, markdown,') == ('csv', 'markdown')
+    with pytest.raises(ValueError, match='Invalid table format: xml'):
+        parse_table_formats('csv,xml')
+
+
+def test_request_options_from_headers():
+    options = RequestOptions({
+        'fast': b'true',
+        'table_formats': b'html',
+        'images': 'none',
+        'image_format': 'webp',
+        'image_quality': '80',
+        'start_page': 2,
+        'max_pages': '5',
+    })
+    assert options.fast
+    assert options.table_formats == ('html',)
+    assert not options.images
+    assert (options.image_format, options.image_quality, options.image_max_size) == ('WEBP', 80, None)
+    assert (options.start_page, options.max_pages) == (2, 5)
+
+
+def test_request_options_defaults():
+    options = RequestOptions(None)
+    assert not options.fast
+    assert options.table_formats is None
+    assert options.images
+    assert options.image_format == 'PNG'
+    assert (options.start_page, options.max_pages) == (None, None)
+
+
+@pytest.mark.parametrize('headers', [{'start_page': '-1'}, {'max_pages': '0'}])
+def test_invalid_page_range(headers):
+    with pytest.raises(ValueError, match='Invalid page range'):
+        RequestOptions(headers)
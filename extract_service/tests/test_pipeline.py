@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from extractor.pdf_convertor.pipeline import Pipeline
+
+
+def test_span_bounds_items_between_stages():
+    lock = threading.Lock()
+    inside = 0
+    most = 0
+
+    def enter(item):
+        nonlocal inside, most
+        with lock:
+            inside += 1
+            most = max(most, inside)
+        return item
+
+    def leave(item):
+        nonlocal inside
+        # The last stage is the slowest, so the queues before it fill up
+        time.sleep(0.01)
+        with lock:
+            inside -= 1
+        return item
+
+    stages = [("first", enter), ("middle", lambda item: item), ("last", leave)]
+    pipeline = Pipeline(stages, capacity=4, span=("first", "last", 2))
+    assert list(pipeline.run(range(20))) == list(range(20))
+    assert most == 2
+
+
+def test_items_come_out_in_order():
+    def jitter(item):
+        time.sleep(0.001 * (item % 3))
+        return item
+
+    stages = [("first", jitter), ("second", lambda item: item * 2), ("third", jitter)]
+    assert list(Pipeline(stages, capacity=2).run(range(30))) == [item * 2 for item in range(30)]
+
+
+def test_stage_error_reaches_the_consumer():
+    def fail(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    pipeline = Pipeline([("first", lambda item: item), ("fail", fail), ("last", lambda item: item)])
+    received = []
+    with pytest.raises(ValueError, match="bad item"):
+        for item in pipeline.run(range(10)):
+            received.append(item)
+    # Items before the failed one are delivered, then every thread stops
+    assert received == [0, 1, 2]
+    assert not any(thread.is_alive() for thread in pipeline.threads)
+
+
+def test_input_error_reaches_the_consumer():
+    def items():
+        yield 0
+        raise OSError("unreadable")
+
+    pipeline = Pipeline([("only", lambda item: item)])
+    with pytest.raises(OSError, match="unreadable"):
+        list(pipeline.run(items()))
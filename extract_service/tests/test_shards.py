@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+from extractor.cancel import CancelToken
+from rpc_server.shards import ShardedConversion, page_ranges, shard_id
+
+
+class FakeClient:
+    """Answers each shard as soon as it is sent, or never with `answer` False."""
+    def __init__(self, answer: bool = True):
+        self.answer = answer
+        self.open = set()
+        self.most_open = 0
+        self.cancelled = []
+
+    async def send(self, request, file_type, file, start, count, sent):
+        corr_id = shard_id(request.correlation_id, start)
+        responses = asyncio.Queue()
+        if self.answer:
+            for pnum in range(start, start + count):
+                responses.put_nowait(({'pnum': pnum, 'message': 'success'}, False))
+            responses.put_nowait(({'message': 'metadata', 'metadata': {}}, False))
+            responses.put_nowait(({'message': 'eof'}, False))
+        self.open.add(corr_id)
+        self.most_open = max(self.most_open, len(self.open))
+        return corr_id, responses
+
+    async def cancel(self, corr_id, before=None):
+        self.cancelled.append(corr_id)
+
+    def close(self, corr_id):
+        self.open.discard(corr_id)
+
+
+def conversion(client, pages: int, **kwargs) -> ShardedConversion:
+    request = SimpleNamespace(correlation_id='doc', redelivered=False, headers={}, priority=0)
+    return ShardedConversion(client, request, 'pdf', None, page_ranges(pages, 2), CancelToken(), **kwargs)
+
+
+async def collect(messages) -> list:
+    return [message async for message in messages]
+
+
+def test_shards_in_flight_are_bounded_by_the_window():
+    client = FakeClient()
+    sharded = conversion(client, 11, window=2)
+    messages = asyncio.run(collect(sharded.messages()))
+    assert [message['pnum'] for message in messages] == list(range(11))
+    assert sharded.status == 'success'
+    assert client.most_open == 2
+    assert client.cancelled == []
+
+
+def test_silent_shard_fails_the_document():
+    client = FakeClient(answer=False)
+    sharded = conversion(client, 6, window=2, timeout=0.1)
+    messages = asyncio.run(collect(sharded.messages()))
+    assert sharded.status == 'failed'
+    assert messages[-1]['message'].startswith('Failed to extract: no response from shard doc.shard.0')
+    # Both shards in flight are cancelled, the last was never sent
+    assert client.cancelled == ['doc.shard.0', 'doc.shard.2']
+
+
+def test_page_ranges():
+    assert page_ranges(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert page_ranges(8, 4) == [(0, 4), (4, 4)]
+    assert page_ranges(3, 64) == [(0, 3)]
+    assert page_ranges(0, 4) == []
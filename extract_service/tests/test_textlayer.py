@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("marker")
+
+from extractor.pdf_convertor.textlayer import has_usable_text_layer
+
+TEXT = "The quarterly report covers revenue, costs and the outlook for the next year. "
+
+
+def page(text: str, lines: int = 10, blank_lines: int = 0):
+    return SimpleNamespace(
+        prelim_text=text,
+        get_all_lines=lambda: [object()] * (lines + blank_lines),
+        get_nonblank_lines=lambda: [object()] * lines,
+    )
+
+
+def test_enough_clean_text_is_usable():
+    assert has_usable_text_layer(page(TEXT), min_chars=50, min_line_ratio=0.8)
+
+
+def test_too_little_text():
+    assert not has_usable_text_layer(page(TEXT[:40]), min_chars=50, min_line_ratio=0.8)
+    assert has_usable_text_layer(page(TEXT[:40]), min_chars=30, min_line_ratio=0.8)
+
+
+def test_garbled_text():
+    assert not has_usable_text_layer(page("@#$%^&*()_+{}|:<>?~ " * 10), min_chars=50, min_line_ratio=0.8)
+
+
+def test_mostly_blank_lines():
+    # A scan with a sparse invisible text layer
+    assert not has_usable_text_layer(page(TEXT, lines=7, blank_lines=3), min_chars=50, min_line_ratio=0.8)
+    assert has_usable_text_layer(page(TEXT, lines=8, blank_lines=2), min_chars=50, min_line_ratio=0.8)
+    assert not has_usable_text_layer(page(TEXT, lines=0), min_chars=50, min_line_ratio=0.8)
@@ -0,0 +1,73 @@
+"""The extractor's encodings against the backend's decoder, which keeps its own copy of the codec."""
+import importlib.util
+import json
+import os
+
+import pytest
+
+from rpc_server.wire import FRAMES, GZIP, IDENTITY, JSON, MSGPACK, ZSTD, WireFormat, dumps_json
+
+BACKEND_WIRE = os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'wire.py')
+
+
+def load_backend_wire():
+    spec = importlib.util.spec_from_file_location('backend_wire', BACKEND_WIRE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+backend = load_backend_wire()
+
+
+def page_message() -> dict:
+    return {
+        'page': {
+            'page': 3,
+            'text': 'lorem ipsum ' * 200,
+            'images': [
+                {'name': 'a.png', 'hash': 'aa', 'format': 'PNG', 'content': bytes(range(256)) * 8},
+                {'name': 'b.png', 'ref': 'a.png', 'hash': 'aa'},
+                {'name': 'c.jpg', 'hash': 'cc', 'format': 'JPEG', 'content': b'\xff\xd8jpeg'},
+            ],
+            'tables': [],
+        },
+        'pnum': 3,
+        'message': 'success',
+    }
+
+
+@pytest.mark.parametrize('content_type', [JSON, MSGPACK, FRAMES])
+@pytest.mark.parametrize('content_encoding', [IDENTITY, GZIP, ZSTD])
+def test_round_trip(content_type, content_encoding):
+    message = page_message()
+    wire = WireFormat(content_type, content_encoding)
+    body, encoding = wire.encode(message)
+    if content_encoding != IDENTITY:
+        assert encoding == content_encoding
+    decoded = backend.decode(body, content_type, encoding)
+    if content_type == JSON:
+        # Images stay base64 in JSON
+        assert decoded == json.loads(dumps_json(message))
+    else:
+        assert decoded == message
+    # Every encoding reaches the HTTP client as the same JSON
+    assert json.loads(backend.to_json(decoded, body, content_type, encoding)) == json.loads(dumps_json(message))
+
+
+def test_small_messages_are_not_compressed():
+    body, encoding = WireFormat(FRAMES, ZSTD).encode({'message': 'eof'})
+    assert encoding is None
+    assert backend.decode(body, FRAMES, encoding) == {'message': 'eof'}
+
+
+def test_backend_accept_is_served():
+    wire = WireFormat.from_headers({'accept': backend.ACCEPT, 'accept_encoding': backend.ACCEPT_ENCODING})
+    assert wire.content_type == MSGPACK
+    assert wire.content_encoding == ZSTD
+
+
+def test_stored_json_is_reencoded():
+    message = page_message()
+    body, encoding = WireFormat(FRAMES, GZIP).encode_stored(dumps_json(message))
+    assert backend.decode(body, FRAMES, encoding) == message